@@ -21,6 +21,14 @@ def create_app(config_class=Config):
     login.init_app(app)
     csrf.init_app(app)
 
+    # Shared LLM client pool
+    from app.services import llm_gateway
+    llm_gateway.init_app(app)
+
+    # Buffered invoice progress writes
+    from app.services import progress_reporter
+    progress_reporter.init_app(app)
+
     # Register blueprints
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -39,4 +47,8 @@ def create_app(config_class=Config):
     from app import cli
     cli.init_app(app)
 
+    # Start background invoice workers
+    from app.services import job_queue
+    job_queue.init_app(app)
+
     return app
\ No newline at end of file
@@ -67,6 +67,132 @@ def init_categories():
     db.session.commit()
     print("Categories initialized successfully")
 
+@click.command('extraction-cache')
+@click.option('--evict', is_flag=True, help='Remove expired and excess entries first')
+@with_appcontext
+def extraction_cache_command(evict):
+    """Show invoice extraction cache statistics."""
+    from app.services.extraction_cache import ExtractionCacheService, extraction_version
+    from app.services.invoice_processor import EXTRACTION_MODEL, EXTRACTION_PROMPT
+
+    cache = ExtractionCacheService(extraction_version(EXTRACTION_MODEL, EXTRACTION_PROMPT))
+    if evict:
+        removed = cache.evict()
+        db.session.commit()
+        click.echo(f'Evicted {removed} entries')
+
+    for key, value in cache.stats().items():
+        click.echo(f'{key}: {value}')
+
+@click.command('backfill-category-memo')
+@with_appcontext
+def backfill_category_memo_command():
+    """Seed the product name -> category memo from past invoices."""
+    from app.services.category_memo import CategoryMemoService
+
+    added = CategoryMemoService().backfill_from_history()
+    click.echo(f'Added {added} category memo entries')
+
+@click.command('fingerprint-invoices')
+@with_appcontext
+def fingerprint_invoices_command():
+    """Add duplicate-detection fingerprints to stored invoices that have none."""
+    from app.services.blob_store import BlobStore
+    from app.services.duplicate_detector import DuplicateDetector
+
+    done = DuplicateDetector().backfill(BlobStore())
+    click.echo(f'Fingerprinted {done} invoices')
+
+@click.command('reprice-catalog')
+@click.option('--rounding', type=click.Choice(['99', '95', 'std']), default='99', help='Retail rounding rule')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing')
+@with_appcontext
+def reprice_catalog_command(rounding, dry_run):
+    """Reprice all active products from their category's default margin."""
+    from app.services.price_service import EnhancedPriceService
+
+    result = EnhancedPriceService().reprice_catalog(rounding_method=rounding, dry_run=dry_run)
+    verb = 'would change' if dry_run else 'changed'
+    click.echo(f"Priced {result['priced']} products, {verb} {result['changed']} prices")
+
+@click.command('rebuild-category-stats')
+@with_appcontext
+def rebuild_category_stats_command():
+    """Recompute confirmed margin statistics from invoices with prices set."""
+    from app.services.category_stats import CategoryStatsService
+
+    counted = CategoryStatsService().rebuild()
+    click.echo(f'Counted {counted} confirmed category margins')
+
+@click.command('benchmark-pipeline')
+@click.argument('invoice_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--invoices', default=5, show_default=True, help='Number of invoices to process')
+@click.option('--location', default='Houston, TX', show_default=True)
+@click.option('--live', is_flag=True, help='Allow running against the live LLM APIs')
+@with_appcontext
+def benchmark_pipeline_command(invoice_file, invoices, location, live):
+    """Time extraction, categorization, saving and margin suggestions."""
+    import os
+    import time
+    from datetime import date
+    from flask import current_app
+    from app.models import Invoice, Wholesaler
+    from app.services.blob_store import BlobStore
+    from app.services.invoice_processor import EnhancedInvoiceProcessor
+    from app.services.margin_service import EnhancedMarginService
+
+    if current_app.config.get('LLM_BACKEND') != 'replay' and not live:
+        raise click.UsageError('Set LLM_BACKEND=replay for an offline run, or pass --live')
+
+    wholesaler = Wholesaler.query.filter_by(name='Benchmark').first()
+    if not wholesaler:
+        wholesaler = Wholesaler(name='Benchmark')
+        db.session.add(wholesaler)
+        db.session.commit()
+
+    timings = {stage: [] for stage in ('extract', 'categorize', 'save', 'margins', 'total')}
+    store = BlobStore()
+    with open(invoice_file, 'rb') as f:
+        original = f.read()
+
+    for number in range(invoices):
+        invoice = Invoice(wholesaler_id=wholesaler.id, invoice_date=date.today(),
+                          status='processing', invoice_number=f'BENCH-{number}')
+        db.session.add(invoice)
+        db.session.commit()
+
+        # Distinct copies so the extraction cache does not short-circuit later runs
+        blob_key = store.put_bytes(original + f'\n{invoice.id}'.encode())
+        processor = EnhancedInvoiceProcessor()
+        payload = {'blob_key': blob_key}
+        try:
+            started = time.perf_counter()
+            for stage in ('extract', 'categorize', 'save'):
+                stage_start = time.perf_counter()
+                payload = processor.run_stage(invoice, stage, payload)
+                timings[stage].append(time.perf_counter() - stage_start)
+
+            stage_start = time.perf_counter()
+            EnhancedMarginService().get_margin_suggestions(invoice.id, location)
+            timings['margins'].append(time.perf_counter() - stage_start)
+            timings['total'].append(time.perf_counter() - started)
+        finally:
+            os.remove(store.path(blob_key))
+        click.echo(f'Invoice {invoice.id}: {len(payload["products"])} products '
+                   f'in {timings["total"][-1]:.2f}s')
+
+    for stage, values in timings.items():
+        if values:
+            values.sort()
+            click.echo(f'{stage:<12} mean {sum(values) / len(values):.3f}s  '
+                       f'p50 {values[len(values) // 2]:.3f}s  max {values[-1]:.3f}s')
+
 def init_app(app):
     app.cli.add_command(add_categories_command)
-    app.cli.add_command(init_categories)
\ No newline at end of file
+    app.cli.add_command(init_categories)
+    app.cli.add_command(extraction_cache_command)
+    app.cli.add_command(backfill_category_memo_command)
+    app.cli.add_command(fingerprint_invoices_command)
+    app.cli.add_command(reprice_catalog_command)
+    app.cli.add_command(rebuild_category_stats_command)
+    app.cli.add_command(benchmark_pipeline_command)
\ No newline at end of file
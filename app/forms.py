@@ -3,8 +3,8 @@ from wtforms import (StringField, PasswordField, BooleanField, SubmitField,
                     TextAreaField, FloatField, DateTimeField, DateField, 
                     SelectField, FileField)
 from wtforms.validators import (DataRequired, Email, EqualTo, ValidationError, 
-                                NumberRange)
-from flask_wtf.file import FileField, FileAllowed, FileRequired
+                                NumberRange, Optional, Length)
+from flask_wtf.file import FileField, FileAllowed, FileRequired, MultipleFileField
 from app.models import User
 from datetime import datetime  
 
@@ -87,4 +87,25 @@ class UploadForm(FlaskForm):
         validators=[DataRequired(message='Please provide the invoice date.')],
         format='%Y-%m-%d'
     )
-    submit = SubmitField('Upload Invoice')
\ No newline at end of file
+    invoice_number = StringField('Invoice Number',
+        validators=[Optional(), Length(max=100)]
+    )
+    confirm_duplicate = BooleanField('Upload even if it looks like a duplicate')
+    submit = SubmitField('Upload Invoice')
+
+class BatchUploadForm(FlaskForm):
+    """Form for uploading several invoices, or ZIP archives of them, at once"""
+    files = MultipleFileField('Invoice Files', validators=[
+        FileAllowed(['jpg', 'jpeg', 'png', 'pdf', 'zip'],
+                    message='Only image, PDF and ZIP files are allowed.')
+    ])
+    wholesaler_id = SelectField('Wholesaler', 
+        coerce=int, 
+        validators=[DataRequired(message='Please select a wholesaler.')],
+        choices=[]  # Will be populated dynamically in the route
+    )
+    invoice_date = DateField('Invoice Date', 
+        validators=[DataRequired(message='Please provide the invoice date.')],
+        format='%Y-%m-%d'
+    )
+    submit = SubmitField('Upload Invoices')
\ No newline at end of file
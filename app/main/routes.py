@@ -35,7 +35,9 @@ from flask import (
     flash, 
     request, 
     current_app, 
-    jsonify
+    jsonify,
+    send_file,
+    abort
 )
 from flask_login import login_required, current_user
 from sqlalchemy import func, desc
@@ -56,6 +58,9 @@ from app.models import (
 )
 from app.utils.storage import CloudinaryStorage
 from app.utils.storage import FileStorage
+from app.services.blob_store import BlobStore
+from app.services.blob_replication import BlobReplicator
+from app.services.cloudinary_service import CloudinaryService
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -1292,32 +1297,14 @@ def upload_sales_document():
         if not all([sales_id, document_type, file]):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
             
-        # Upload to Cloudinary
-        result = CloudinaryStorage.upload_file(
-            file,
-            folder=f"sales_reports/{document_type}",
-            public_id_prefix=f"sales_{sales_id}_{document_type}"
-        )
-        
-        if not result['success']:
-            return jsonify({'success': False, 'error': result['error']}), 500
-            
-        # Save document record
-        document = SalesDocument(
-            sales_id=sales_id,
-            document_type=document_type,
-            filename=file.filename,
-            cloudinary_public_id=result['public_id'],
-            secure_url=result['secure_url']
-        )
-        
-        db.session.add(document)
+        # Store locally; Cloudinary replication runs in the background
+        document = BlobReplicator().add_sales_document(sales_id, document_type, file)
         db.session.commit()
         
         return jsonify({
             'success': True,
             'document_id': document.id,
-            'url': document.secure_url
+            'url': url_for('main.sales_document_file', document_id=document.id)
         })
         
     except Exception as e:
@@ -1331,16 +1318,29 @@ def delete_sales_document(document_id):
     try:
         document = SalesDocument.query.get_or_404(document_id)
         
-        # Delete from Cloudinary
-        if CloudinaryStorage.delete_file(document.cloudinary_public_id):
-            db.session.delete(document)
-            db.session.commit()
-            return jsonify({'success': True})
-        else:
+        # Delete from Cloudinary once replicated; a pending replication skips deleted documents
+        if document.cloudinary_public_id and not CloudinaryService().delete(document.cloudinary_public_id):
             return jsonify({'success': False, 'error': 'Failed to delete from storage'}), 500
+
+        db.session.delete(document)
+        db.session.commit()
+        return jsonify({'success': True})
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/sales/document/<int:document_id>/file')
+@login_required
+def sales_document_file(document_id):
+    """Serve a sales document from Cloudinary when replicated, else from the local store"""
+    document = SalesDocument.query.get_or_404(document_id)
+    if document.secure_url:
+        return redirect(document.secure_url)
+
+    store = BlobStore()
+    if not store.exists(document.blob_key):
+        abort(404)
+    return send_file(store.path(document.blob_key), download_name=document.filename)
     
     # app/main/routes.py
 
@@ -1378,57 +1378,16 @@ def record_daily_sales():
             db.session.add(sales)
             db.session.commit()  # Commit first to get sales.id
 
-            # Initialize CloudinaryStorage
-            storage = CloudinaryStorage()
-            
-            # Handle file uploads
-            if form.register_reports.data:
-                result = storage.upload_file(
-                    form.register_reports.data,
-                    folder="register_reports",
-                    public_id_prefix=f"sales_{sales.id}_register"
-                )
-                if result['success']:
-                    doc = SalesDocument(
-                        sales_id=sales.id,
-                        document_type='register_report',
-                        filename=form.register_reports.data.filename,
-                        cloudinary_public_id=result['public_id'],
-                        secure_url=result['secure_url']
-                    )
-                    db.session.add(doc)
-
-            if form.credit_card_statement.data:
-                result = storage.upload_file(
-                    form.credit_card_statement.data,
-                    folder="credit_card_statements",
-                    public_id_prefix=f"sales_{sales.id}_cc"
-                )
-                if result['success']:
-                    doc = SalesDocument(
-                        sales_id=sales.id,
-                        document_type='credit_card_statement',
-                        filename=form.credit_card_statement.data.filename,
-                        cloudinary_public_id=result['public_id'],
-                        secure_url=result['secure_url']
-                    )
-                    db.session.add(doc)
-
-            if form.otc_statements.data:
-                result = storage.upload_file(
-                    form.otc_statements.data,
-                    folder="otc_statements",
-                    public_id_prefix=f"sales_{sales.id}_otc"
-                )
-                if result['success']:
-                    doc = SalesDocument(
-                        sales_id=sales.id,
-                        document_type='otc_statement',
-                        filename=form.otc_statements.data.filename,
-                        cloudinary_public_id=result['public_id'],
-                        secure_url=result['secure_url']
-                    )
-                    db.session.add(doc)
+            # Handle file uploads; stored locally and replicated to Cloudinary in the background
+            replicator = BlobReplicator()
+            documents = [
+                ('register_report', form.register_reports.data),
+                ('credit_card_statement', form.credit_card_statement.data),
+                ('otc_statement', form.otc_statements.data)
+            ]
+            for document_type, upload in documents:
+                if upload:
+                    replicator.add_sales_document(sales.id, document_type, upload)
 
             db.session.commit()
             flash('Sales record saved successfully!', 'success')
@@ -1513,9 +1472,10 @@ def delete_sales(sales_id):
         sales = DailySales.query.get_or_404(sales_id)
         
         # Delete associated documents from Cloudinary
+        cloudinary = CloudinaryService()
         for document in sales.documents:
-            if document.cloudinary_public_id:  # Check if document exists
-                CloudinaryStorage.delete_file(document.cloudinary_public_id)
+            if document.cloudinary_public_id:  # Only replicated documents exist there
+                cloudinary.delete(document.cloudinary_public_id)
         
         # Delete the sales record and its documents
         db.session.delete(sales)
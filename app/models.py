@@ -303,8 +303,9 @@ class SalesDocument(db.Model):
     sales_id = db.Column(db.Integer, db.ForeignKey('daily_sales.id'), nullable=False)
     document_type = db.Column(db.String(50), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
-    cloudinary_public_id = db.Column(db.String(255), nullable=False)
-    secure_url = db.Column(db.String(512), nullable=False)
+    blob_key = db.Column(db.String(64))  # Local copy in the blob store
+    cloudinary_public_id = db.Column(db.String(255))  # Filled in once replicated
+    secure_url = db.Column(db.String(512))
     upload_time = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Invoice(db.Model):
@@ -316,7 +317,8 @@ class Invoice(db.Model):
     wholesaler_id = db.Column(db.Integer, db.ForeignKey('wholesaler.id'), nullable=False)
     processed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     file_path = db.Column(db.String(255))
-    cloudinary_public_id = db.Column(db.String(255))
+    blob_key = db.Column(db.String(64), index=True)  # Original document in the blob store
+    cloudinary_public_id = db.Column(db.String(255))  # Cloudinary fields are filled in once replicated
     cloudinary_url = db.Column(db.String(512))
     cloudinary_secure_url = db.Column(db.String(512))
     cloudinary_signature = db.Column(db.String(255))
@@ -339,8 +341,12 @@ class Invoice(db.Model):
     location = db.Column(db.String(100))
     area_type = db.Column(db.String(50))
     
+    # Set when uploaded as part of a batch
+    batch_id = db.Column(db.Integer, db.ForeignKey('invoice_batch.id'), index=True)
+    
     # Relationships
     wholesaler = db.relationship('Wholesaler', back_populates='invoices')
+    batch = db.relationship('InvoiceBatch', back_populates='invoices')
     processed_by = db.relationship('User', back_populates='processed_invoices')
     temp_products = db.relationship('TempProduct', back_populates='invoice',
                                   cascade='all, delete-orphan')
@@ -359,6 +365,16 @@ class Invoice(db.Model):
     processing_progress = db.relationship('ProcessingProgress', back_populates='invoice',
                                         cascade='all, delete-orphan',
                                         uselist=False)  # One-to-one relationship
+    processing_jobs = db.relationship('ProcessingJob', back_populates='invoice',
+                                    cascade='all, delete-orphan')
+    extracted_products = db.relationship('ExtractedProduct', back_populates='invoice',
+                                       cascade='all, delete-orphan')
+    llm_calls = db.relationship('LLMCall', back_populates='invoice',
+                              cascade='all, delete-orphan', lazy='dynamic')
+    fingerprints = db.relationship('InvoiceFingerprint', back_populates='invoice',
+                                 cascade='all, delete-orphan')
+    label_sheets = db.relationship('LabelSheet', back_populates='invoice',
+                                 cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Invoice {self.invoice_number}>'
@@ -373,9 +389,18 @@ class Invoice(db.Model):
 
     def update_category_summary(self):
         """Update category summary based on temp products"""
+        self.apply_category_summary(
+            (product.category_name, product.cost_price, product.selling_price)
+            for product in self.temp_products
+        )
+
+    def apply_category_summary(self, items):
+        """
+        Set category_summary and totals from (category, cost_price, selling_price) tuples
+        Lets callers that already hold the product values skip reloading temp_products
+        """
         summary = {}
-        for product in self.temp_products:
-            category = product.category_name
+        for category, cost_price, selling_price in items:
             if category not in summary:
                 summary[category] = {
                     'count': 0,
@@ -383,27 +408,31 @@ class Invoice(db.Model):
                     'total_selling': 0
                 }
             summary[category]['count'] += 1
-            summary[category]['total_cost'] += product.cost_price
-            if product.selling_price:
-                summary[category]['total_selling'] += product.selling_price
+            summary[category]['total_cost'] += cost_price
+            if selling_price:
+                summary[category]['total_selling'] += selling_price
         
         self.category_summary = summary
         self.total_items = sum(cat['count'] for cat in summary.values())
         self.total_amount = sum(cat['total_cost'] for cat in summary.values())
 
     def create_price_update_tasks(self):
-        """Create tasks for staff to update price tags"""
-        if not self.temp_products:
+        """Create tasks for staff to update price tags, one per category"""
+        # Tasks need someone to assign them to
+        if not self.temp_products or self.processed_by_id is None:
             return
             
-        # Group products by category for better task organization
+        # Group priced products by category for better task organization
         categories = {}
         for product in self.temp_products:
-            if product.category_name not in categories:
-                categories[product.category_name] = []
-            categories[product.category_name].append(product)
+            if product.selling_price is None:
+                continue
+            category = product.category_name or 'Uncategorized'
+            if category not in categories:
+                categories[category] = []
+            categories[category].append(product)
         
-        # Create tasks for each category
+        # Create tasks for each category; its labels print as one sheet
         for category, products in categories.items():
             product_list = "\n".join([
                 f"- {p.name}: New price ${p.selling_price:.2f}" 
@@ -412,7 +441,8 @@ class Invoice(db.Model):
             
             task = Task(
                 title=f"Update price tags - {category}",
-                description=f"Please update price tags for the following products:\n{product_list}",
+                description=(f"Print the {category} label sheet ({len(products)} labels) and "
+                             f"update price tags for the following products:\n{product_list}"),
                 invoice_id=self.id,
                 created_by_id=self.processed_by_id,
                 assigned_to_id=self.processed_by_id,  # Initially assign to same person
@@ -423,6 +453,25 @@ class Invoice(db.Model):
         
         db.session.commit()
 
+class InvoiceBatch(db.Model):
+    """Invoices uploaded together in one request"""
+    __tablename__ = 'invoice_batch'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    wholesaler_id = db.Column(db.Integer, db.ForeignKey('wholesaler.id'), nullable=False)
+    uploaded_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    invoice_date = db.Column(db.Date, nullable=False)
+    file_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    wholesaler = db.relationship('Wholesaler')
+    uploaded_by = db.relationship('User')
+    invoices = db.relationship('Invoice', back_populates='batch', order_by='Invoice.id')
+
+    def __repr__(self):
+        return f'<InvoiceBatch {self.id} ({self.file_count} files)>'
+
 class InvoiceItem(db.Model):
     """Model for individual items in an invoice"""
     __tablename__ = 'invoice_item'
@@ -643,15 +692,188 @@ class ProcessingProgress(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class ProcessingJob(db.Model):
+    """Durable queue entry for background work such as driving an invoice through the processing pipeline"""
+    __tablename__ = 'processing_job'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), index=True)  # None for jobs not tied to an invoice
+    job_type = db.Column(db.String(50), nullable=False, default='process_invoice')
+    stage = db.Column(db.String(50))  # Next pipeline stage to run, None once finished
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, completed, failed
+    payload = db.Column(db.JSON)  # Stage inputs/outputs checkpointed between stages
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    error_message = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    # Relationships
+    invoice = db.relationship('Invoice', back_populates='processing_jobs')
+
+    def __repr__(self):
+        return f'<ProcessingJob {self.id} {self.job_type} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'invoice_id': self.invoice_id,
+            'job_type': self.job_type,
+            'stage': self.stage,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'error_message': self.error_message,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class ExtractedProduct(db.Model):
+    """Product row recognized during streaming extraction, shown before the invoice is saved"""
+    __tablename__ = 'extracted_product'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
+    page_number = db.Column(db.Integer, nullable=False, default=1)
+    position = db.Column(db.Integer, nullable=False)  # Order on the page
+    name = db.Column(db.String(200), nullable=False)
+    quantity = db.Column(db.Integer)
+    price = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    invoice = db.relationship('Invoice', back_populates='extracted_products')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'page': self.page_number,
+            'position': self.position,
+            'name': self.name,
+            'quantity': self.quantity,
+            'price': self.price
+        }
+
+    def __repr__(self):
+        return f'<ExtractedProduct {self.invoice_id} p{self.page_number}#{self.position}>'
+
+class LLMCall(db.Model):
+    """One LLM request (or a cache hit that replaced one) with its tokens, cost and timing"""
+    __tablename__ = 'llm_call'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), index=True)  # None outside the invoice pipeline
+    stage = db.Column(db.String(50), index=True)  # extract, categorize, margins...
+    provider = db.Column(db.String(20), nullable=False)
+    model = db.Column(db.String(100))
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    cost = db.Column(db.Float, default=0.0)  # USD, estimated from llm_usage.MODEL_PRICES
+    latency_ms = db.Column(db.Integer, default=0)  # Wall time including retries and backoff
+    retries = db.Column(db.Integer, default=0)
+    cached = db.Column(db.Boolean, default=False)  # Answered from a cache, no request sent
+    streamed = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(20), default='ok')  # ok, error
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    invoice = db.relationship('Invoice', back_populates='llm_calls')
+
+    def __repr__(self):
+        return f'<LLMCall {self.provider}/{self.model} {self.stage} {self.status}>'
+
+class InvoiceFingerprint(db.Model):
+    """Lookup key for spotting an invoice that was uploaded before"""
+    __tablename__ = 'invoice_fingerprint'
+    __table_args__ = (
+        db.Index('ix_invoice_fingerprint_kind_value', 'kind', 'value'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # dhash, dhash_band, reference
+    value = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    invoice = db.relationship('Invoice', back_populates='fingerprints')
+
+    def __repr__(self):
+        return f'<InvoiceFingerprint {self.kind} {self.value} -> {self.invoice_id}>'
+
+class ExtractionCache(db.Model):
+    """Validated extraction results keyed by file content and prompt/model version"""
+    __tablename__ = 'extraction_cache'
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'version', name='uq_extraction_cache_hash_version'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the file bytes
+    version = db.Column(db.String(64), nullable=False)  # Hash of extraction model + prompt
+    products = db.Column(db.JSON, nullable=False)
+    product_count = db.Column(db.Integer, default=0)
+    file_size = db.Column(db.Integer)
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    def __repr__(self):
+        return f'<ExtractionCache {self.content_hash[:12]} {self.product_count} products>'
+
+class CategoryMemo(db.Model):
+    """Remembered category for a normalized product name"""
+    __tablename__ = 'category_memo'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    normalized_name = db.Column(db.String(255), nullable=False, unique=True)
+    category_name = db.Column(db.String(100), nullable=False)
+    source = db.Column(db.String(20), default='llm')  # llm, history
+    times_seen = db.Column(db.Integer, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CategoryMemo {self.normalized_name} -> {self.category_name}>'
+
+class MarketInsight(db.Model):
+    """Cached market analysis for a store location"""
+    __tablename__ = 'market_insight'
+    __table_args__ = (
+        db.UniqueConstraint('location_key', 'area_type', 'source', name='uq_market_insight_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    location_key = db.Column(db.String(100), nullable=False)  # Normalized location
+    area_type = db.Column(db.String(50), nullable=False, default='')
+    source = db.Column(db.String(50), nullable=False)  # gpt, location_service
+    location = db.Column(db.String(100))  # As entered
+    insights = db.Column(db.JSON)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime)
+    refresh_started_at = db.Column(db.DateTime)  # Set while a background refresh runs
+
+    def is_stale(self, now=None):
+        return not self.expires_at or self.expires_at <= (now or datetime.utcnow())
+
+    def __repr__(self):
+        return f'<MarketInsight {self.source} {self.location_key}/{self.area_type}>'
+
 class MarginSuggestion(db.Model):
     """Model for AI margin suggestions"""
     __tablename__ = 'margin_suggestion'
     
     id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
-    category = db.Column(db.String(100))
-    suggested_margin = db.Column(db.Float)
-    reasoning = db.Column(db.Text)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
+    category_name = db.Column(db.String(100), nullable=False, index=True)
+    suggested_margin = db.Column(db.Float, nullable=False)
+    location = db.Column(db.String(100))
+    area_type = db.Column(db.String(50))
+    insights = db.Column(db.JSON)  # Reasoning, confidence and risk level from the AI
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -660,8 +882,73 @@ class MarginSuggestion(db.Model):
     def to_dict(self):
         return {
             'id': self.id,
-            'category': self.category,
+            'category': self.category_name,
             'suggested_margin': self.suggested_margin,
-            'reasoning': self.reasoning,
-            'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+            'location': self.location,
+            'area_type': self.area_type,
+            'insights': self.insights,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class CategoryMarginStats(db.Model):
+    """Running statistics of the margins confirmed for a category"""
+    __tablename__ = 'category_margin_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    category_name = db.Column(db.String(100), nullable=False, unique=True)
+    count = db.Column(db.Integer, nullable=False, default=0)  # Confirmed margins seen
+    mean_margin = db.Column(db.Float)  # Over all of them
+    ewma_margin = db.Column(db.Float)  # Weighted towards the latest
+    recent_margins = db.Column(db.JSON)  # The latest CATEGORY_STATS_WINDOW, oldest first
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        recent = self.recent_margins or []
+        return {
+            'count': self.count,
+            'mean_margin': self.mean_margin,
+            'ewma_margin': self.ewma_margin,
+            'recent_mean': round(sum(recent) / len(recent), 2) if recent else None,
+            'recent_margins': recent
+        }
+
+    def __repr__(self):
+        return f'<CategoryMarginStats {self.category_name} n={self.count}>'
+
+class LabelSheet(db.Model):
+    """Rendered price-tag label sheet (PDF) for one category of an invoice"""
+    __tablename__ = 'label_sheet'
+    __table_args__ = (
+        db.UniqueConstraint('invoice_id', 'category_name', 'template', name='uq_label_sheet_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
+    category_name = db.Column(db.String(100), nullable=False)  # '' for uncategorized products
+    template = db.Column(db.String(20), nullable=False)
+    content_hash = db.Column(db.String(64))  # SHA-256 of the labels and layout it was rendered from
+    status = db.Column(db.String(20), default='queued')  # queued, ready, failed
+    blob_key = db.Column(db.String(64))  # The PDF, in the blob store
+    label_count = db.Column(db.Integer, default=0)
+    page_count = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    rendered_at = db.Column(db.DateTime)
+
+    # Relationships
+    invoice = db.relationship('Invoice', back_populates='label_sheets')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'category': self.category_name or 'Uncategorized',
+            'template': self.template,
+            'status': self.status,
+            'label_count': self.label_count,
+            'page_count': self.page_count,
+            'error_message': self.error_message,
+            'rendered_at': self.rendered_at.isoformat() if self.rendered_at else None
+        }
+
+    def __repr__(self):
+        return f'<LabelSheet {self.invoice_id}/{self.category_name}/{self.template} {self.status}>'
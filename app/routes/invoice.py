@@ -6,20 +6,36 @@ from flask import (
     current_app, 
     url_for,
     flash, 
-    redirect
+    redirect,
+    abort,
+    Response,
+    send_file,
+    stream_with_context
 )
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
 import json
+import time
 
 from app.extensions import db
-from app.models import Invoice, Wholesaler, TempProduct
-from app.forms import UploadForm
-from app.services.cloudinary_service import CloudinaryService
-from app.services.invoice_processor import EnhancedInvoiceProcessor as InvoiceProcessor
+from app.models import (
+    Invoice, InvoiceBatch, Wholesaler, TempProduct, ProcessingProgress, ExtractedProduct, LabelSheet
+)
+from app.forms import UploadForm, BatchUploadForm
+from app.services.invoice_processor import EnhancedInvoiceProcessor as InvoiceProcessor, PIPELINE_STAGES
+from app.services.job_queue import JobQueue
+from app.services.batch_upload import BatchUploadService
+from app.services.blob_store import BlobStore
+from app.services.duplicate_detector import DuplicateDetector
+from app.services.llm_usage import LLMUsageReport
+from app.services.llm_schemas import schema_stats
 from app.services.margin_service import EnhancedMarginService
+from app.services.category_stats import CategoryStatsService
+from app.services.label_sheets import LABEL_TEMPLATES, LabelSheetService
+from app.services.price_commit import PriceCommitService
+from app.services.price_service import EnhancedPriceService
 from app.services.location_service import get_demographics, analyze_competition, get_market_insights
 from app.utils.error_handling import APIError, handle_database_error, log_api_call
 
@@ -41,14 +57,17 @@ def allowed_file(filename):
 @login_required
 def upload_invoice():
     """
-    Handle invoice upload with Cloudinary and OpenAI processing
+    Handle invoice upload
     
     Follows the system flow:
     Phase 1: Invoice Processing
-    a) Upload & Initial Setup (0-25%):
+    a) Upload & Initial Setup (0-5%):
        - Create Invoice Record
-       - File Upload to Cloudinary
-       - Create Progress Record
+       - Save File to the local blob store
+       - Create Progress Record and Queue Processing Job
+    b) Extraction, categorization and saving run in the background
+       workers (see app/services/job_queue.py); Cloudinary replication
+       runs alongside them as a separate job
     """
     # Create form instance and set up wholesaler choices
     form = UploadForm()
@@ -73,106 +92,56 @@ def upload_invoice():
                     'message': 'Invalid file type'
                 }), 400
 
+            # Check for an earlier upload of the same invoice before doing any work
+            file_bytes = file.read()
+            detector = DuplicateDetector()
+            fingerprint = detector.fingerprint(
+                file_bytes, wholesaler_id, form.invoice_number.data, invoice_date
+            )
+            if not form.confirm_duplicate.data:
+                matches = detector.find_duplicates(fingerprint)
+                if matches:
+                    return _duplicate_response(matches)
+
             # Create invoice record (0%)
             invoice = Invoice(
                 processed_by_id=current_user.id,
                 wholesaler_id=wholesaler_id,
+                invoice_number=form.invoice_number.data or None,
                 invoice_date=invoice_date,
                 status='processing',
                 file_path=secure_filename(file.filename)
             )
             db.session.add(invoice)
+            db.session.flush()
+
+            # Save file for the worker (5%)
+            invoice.blob_key = BlobStore().put_bytes(file_bytes)
+            detector.record(invoice, fingerprint)
+            current_app.logger.info(f"Invoice file stored as blob {invoice.blob_key}")
+
+            # Create progress record and queue the pipeline; workers take it from here
+            progress = ProcessingProgress(
+                invoice_id=invoice.id,
+                progress=5,
+                current_step='queued',
+                detailed_status='Waiting for an available worker...',
+                total_steps=len(PIPELINE_STAGES)
+            )
+            db.session.add(progress)
+            JobQueue().enqueue(invoice.id, {'blob_key': invoice.blob_key})
             db.session.commit()
             current_app.logger.info(f"Created invoice record with ID: {invoice.id}")
 
-            # Save file temporarily (10%)
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            unique_filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(filepath)
-            current_app.logger.info(f"Temporary file saved at: {filepath}")
-
-            # Upload to Cloudinary (25%)
-            try:
-                cloudinary_service = CloudinaryService()
-                cloudinary_result = cloudinary_service.upload_invoice(filepath, invoice.id)
-                
-                invoice.cloudinary_public_id = cloudinary_result.get('public_id')
-                invoice.cloudinary_url = cloudinary_result.get('url')
-                invoice.cloudinary_secure_url = cloudinary_result.get('secure_url')
-                invoice.cloudinary_signature = cloudinary_result.get('signature')
-                
-                if not invoice.cloudinary_secure_url:
-                    raise ValueError("No secure URL returned from Cloudinary")
-                    
-                db.session.commit()
-                current_app.logger.info(f"Cloudinary upload successful: {invoice.cloudinary_secure_url}")
-            except Exception as cloudinary_error:
-                current_app.logger.error(f"Cloudinary upload failed: {str(cloudinary_error)}")
-                invoice.status = 'upload_failed'
-                invoice.error_message = str(cloudinary_error)
-                db.session.commit()
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                return jsonify({
-                    'status': 'error', 
-                    'message': 'Cloudinary upload failed',
-                    'details': str(cloudinary_error)
-                }), 500
-
-            # Process invoice with OpenAI (50%)
-            try:
-                processor = InvoiceProcessor()
-                
-                # Extract text (75%)
-                extracted_data = processor._extract_text(filepath)
-                current_app.logger.info(f"Extracted {len(extracted_data)} products from invoice")
-                
-                # Categorize products (90%)
-                categorized_products = processor._categorize_products(extracted_data)
-                
-                # Store products in temp_products table (100%)
-                for product_data in categorized_products:
-                    temp_product = TempProduct(
-                        invoice_id=invoice.id,
-                        name=product_data['name'],
-                        category_name=product_data['category_name'],
-                        quantity=product_data['quantity'],
-                        cost_price=product_data['price']
-                    )
-                    db.session.add(temp_product)
-                
-                invoice.status = 'processed'
-                db.session.commit()
-                
-                current_app.logger.info(f"Stored {len(categorized_products)} temp products for invoice {invoice.id}")
-                
-                # Clean up temporary file
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                
-                return jsonify({
-                    'status': 'success', 
-                    'message': 'Invoice processed successfully',
-                    'invoice_id': invoice.id,
-                    'redirect_url': url_for('invoice.summary', invoice_id=invoice.id)
-                }), 200
-
-            except Exception as processing_error:
-                current_app.logger.error(f"Invoice processing failed: {str(processing_error)}")
-                invoice.status = 'processing_failed'
-                invoice.error_message = str(processing_error)
-                db.session.commit()
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                return jsonify({
-                    'status': 'error', 
-                    'message': 'Invoice processing failed',
-                    'details': str(processing_error)
-                }), 500
+            return jsonify({
+                'status': 'success',
+                'message': 'Invoice uploaded, processing has started',
+                'invoice_id': invoice.id,
+                'redirect_url': url_for('invoice.processing', invoice_id=invoice.id)
+            }), 202
 
         except Exception as e:
+            db.session.rollback()
             current_app.logger.critical(f"Unexpected error in invoice upload: {str(e)}")
             return jsonify({
                 'status': 'error', 
@@ -189,6 +158,133 @@ def upload_invoice():
         'errors': errors
     }), 400
 
+def _duplicate_response(matches):
+    """
+    Answer an upload that matches earlier invoices
+    An identical file goes straight to the existing invoice; a similar
+    image or the same invoice number asks the user to confirm first
+    """
+    for match in matches:
+        endpoint = 'invoice.summary' if match['status'] == 'processed' else 'invoice.processing'
+        match['url'] = url_for(endpoint, invoice_id=match['invoice_id'])
+
+    best = matches[0]
+    if best['match'] == 'exact':
+        return jsonify({
+            'status': 'duplicate',
+            'message': f"This file was already uploaded as invoice #{best['invoice_id']}",
+            'invoice_id': best['invoice_id'],
+            'redirect_url': best['url'],
+            'matches': matches
+        }), 200
+
+    reason = 'has the same invoice number' if best['match'] == 'reference' else 'looks like the same document'
+    return jsonify({
+        'status': 'possible_duplicate',
+        'message': f"This upload {reason} as invoice #{best['invoice_id']}",
+        'invoice_id': best['invoice_id'],
+        'redirect_url': best['url'],
+        'matches': matches
+    }), 409
+
+@bp.route('/upload-batch', methods=['GET', 'POST'])
+@login_required
+def upload_batch():
+    """
+    Upload several invoices, or ZIP archives of invoices, in one request
+    All invoices are created in one transaction and queued together; the
+    workers process them concurrently, at most INVOICE_BATCH_CONCURRENCY
+    of one batch at a time
+    """
+    form = BatchUploadForm()
+    form.wholesaler_id.choices = [(w.id, w.name) for w in Wholesaler.query.all()]
+
+    if not form.wholesaler_id.choices:
+        form.wholesaler_id.choices = [(0, 'No Wholesalers Available')]
+
+    if request.method == 'GET':
+        return render_template('invoice/batch_upload.html', form=form)
+
+    if not form.validate_on_submit():
+        errors = {field: errors for field, errors in form.errors.items()}
+        current_app.logger.warning(f"Batch upload validation failed: {errors}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Form validation failed',
+            'errors': errors
+        }), 400
+
+    service = BatchUploadService()
+    try:
+        files, skipped = service.collect_files(form.files.data)
+        batch = service.create_batch(
+            files,
+            form.wholesaler_id.data,
+            form.invoice_date.data,
+            current_user.id
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        current_app.logger.critical(f"Unexpected error in batch upload: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Unexpected server error',
+            'details': str(e)
+        }), 500
+
+    return jsonify({
+        'status': 'success',
+        'message': f'{batch.file_count} invoices uploaded, processing has started',
+        'batch_id': batch.id,
+        'skipped': skipped,
+        'duplicates': service.duplicates,
+        'redirect_url': url_for('invoice.batch_processing', batch_id=batch.id)
+    }), 202
+
+@bp.route('/batch/<int:batch_id>')
+@login_required
+def batch_processing(batch_id):
+    """Show processing status for every invoice in a batch"""
+    if not current_user.role == 'owner':
+        abort(403)
+    batch = InvoiceBatch.query.get_or_404(batch_id)
+    return render_template('invoice/batch_processing.html', batch=batch)
+
+@bp.route('/batch/<int:batch_id>/status')
+@login_required
+def batch_status(batch_id):
+    """Aggregated processing status of a batch"""
+    if not current_user.role == 'owner':
+        return jsonify({'error': 'Access denied'}), 403
+    InvoiceBatch.query.get_or_404(batch_id)
+    return jsonify(BatchUploadService().batch_status(batch_id))
+
+@bp.route('/llm-usage')
+@login_required
+def llm_usage_report():
+    """Invoices, wholesalers and pipeline stages ranked by LLM cost or latency"""
+    if not current_user.role == 'owner':
+        abort(403)
+    days = max(1, request.args.get('days', 30, type=int))
+    order_by = request.args.get('sort', 'cost')
+    if order_by not in ('cost', 'latency'):
+        order_by = 'cost'
+
+    report = LLMUsageReport(days)
+    data = {
+        'days': days,
+        'sort': order_by,
+        'summary': report.summary(),
+        'stages': report.by_stage(order_by),
+        'wholesalers': report.by_wholesaler(order_by),
+        'invoices': report.by_invoice(order_by),
+        'schemas': schema_stats()
+    }
+    if request.args.get('format') == 'json':
+        return jsonify(data)
+    return render_template('invoice/llm_usage.html', **data)
+
 @bp.route('/progress/<int:invoice_id>')
 @login_required
 def check_progress(invoice_id):
@@ -226,36 +322,106 @@ def check_status(invoice_id):
         return jsonify({'error': 'Access denied'}), 403
 
     invoice = Invoice.query.get_or_404(invoice_id)
-    
+    return jsonify(_status_payload(invoice))
+
+def _status_payload(invoice):
+    """Processing status of an invoice as returned by the status endpoints"""
     # Get processing progress from the database
-    progress = ProcessingProgress.query.filter_by(invoice_id=invoice_id).first()
+    progress = ProcessingProgress.query.filter_by(invoice_id=invoice.id).first()
     
     if not progress:
-        return jsonify({
+        return {
             'status': 'error',
             'error': 'No progress record found'
-        })
+        }
     
     if invoice.status == 'processed':
-        return jsonify({
+        return {
             'status': 'processed',
-            'redirect': url_for('invoice.summary', invoice_id=invoice_id)
-        })
+            'redirect': url_for('invoice.summary', invoice_id=invoice.id)
+        }
     elif invoice.status == 'failed':
-        return jsonify({
+        return {
             'status': 'failed',
             'error': progress.error_message or invoice.error_message or 'Unknown error'
-        })
+        }
     else:
+        # The estimate was taken at the last write; count down from there
+        remaining = progress.estimated_time_remaining
+        if remaining is not None and progress.updated_at:
+            elapsed = (datetime.utcnow() - progress.updated_at).total_seconds()
+            remaining = max(0, int(remaining - elapsed))
+
         # Return current progress
-        return jsonify({
+        return {
             'status': 'processing',
             'progress': progress.progress,
             'current_step': progress.current_step,
+            'step_number': progress.step_number,
+            'total_steps': progress.total_steps,
             'detailed_status': progress.detailed_status,
-            'estimated_time_remaining': progress.estimated_time_remaining,
-            'invoice_id': invoice_id
-        })
+            'estimated_time_remaining': remaining,
+            'invoice_id': invoice.id
+        }
+
+@bp.route('/<int:invoice_id>/stream')
+@login_required
+def stream_status(invoice_id):
+    """
+    Server-Sent Events feed for the processing page
+    Emits `product` events as extracted rows appear, `progress` events
+    when the status changes and a final `processed`/`failed` event.
+    Reconnecting clients resume after the Last-Event-ID row.
+    """
+    if not current_user.role == 'owner':
+        return jsonify({'error': 'Access denied'}), 403
+
+    Invoice.query.get_or_404(invoice_id)
+    last_id = request.headers.get('Last-Event-ID', type=int) or 0
+    poll_interval = current_app.config.get('INVOICE_STREAM_POLL_INTERVAL', 0.5)
+    max_seconds = current_app.config.get('INVOICE_STREAM_MAX_SECONDS', 300)
+
+    def events():
+        nonlocal last_id
+        yield 'retry: 2000\n\n'
+        last_status = None
+        last_sent = started = time.monotonic()
+
+        while time.monotonic() - started < max_seconds:
+            rows = ExtractedProduct.query.filter(
+                ExtractedProduct.invoice_id == invoice_id,
+                ExtractedProduct.id > last_id
+            ).order_by(ExtractedProduct.id).all()
+            for row in rows:
+                last_id = row.id
+                yield f"id: {row.id}\nevent: product\ndata: {json.dumps(row.to_dict())}\n\n"
+
+            status = _status_payload(Invoice.query.get(invoice_id))
+            # Release the connection while idle
+            db.session.remove()
+
+            # The ETA counts down on every poll; only send it along with real changes
+            compared = {key: value for key, value in status.items() if key != 'estimated_time_remaining'}
+            if compared != last_status:
+                last_status = compared
+                event = status['status'] if status['status'] in ('processed', 'failed') else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(status)}\n\n"
+                if event != 'progress':
+                    return
+                last_sent = time.monotonic()
+            elif rows:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > 15:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+
+            time.sleep(poll_interval)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @bp.route('/<int:invoice_id>/retry', methods=['POST'])
 @login_required
@@ -266,23 +432,29 @@ def retry_processing(invoice_id):
         if invoice.status != 'failed':
             return jsonify({'error': 'Can only retry failed invoices'}), 400
         
+        queue = JobQueue()
+        last_job = queue.latest_job(invoice.id)
+        payload = dict(last_job.payload or {}) if last_job else {}
+        payload.setdefault('blob_key', invoice.blob_key)
+        if not BlobStore().exists(payload['blob_key']) and not os.path.exists(payload.get('file_path') or ''):
+            return jsonify({'error': 'Original upload is no longer available, please upload again'}), 400
+
         invoice.status = 'processing'
         invoice.error_message = None
-        db.session.commit()
-        
-        # Create new progress record
-        progress = ProcessingProgress(
-            invoice_id=invoice.id,
-            progress=0,
-            current_step='Retrying...',
-            detailed_status='Preparing to retry invoice processing...'
-        )
-        db.session.add(progress)
-        db.session.commit()
 
-        # Start processing in background
-        processor = InvoiceProcessor()
-        processor.process_invoice(invoice.id)
+        # Reset the progress record
+        progress = ProcessingProgress.query.filter_by(invoice_id=invoice.id).first()
+        if not progress:
+            progress = ProcessingProgress(invoice_id=invoice.id, total_steps=len(PIPELINE_STAGES))
+            db.session.add(progress)
+        progress.progress = 0
+        progress.current_step = 'queued'
+        progress.detailed_status = 'Preparing to retry invoice processing...'
+        progress.error_message = None
+
+        # Resume from the stage that failed
+        queue.enqueue(invoice.id, payload, stage=last_job.stage if last_job else None)
+        db.session.commit()
         
         return jsonify({'status': 'success'})
         
@@ -423,6 +595,75 @@ def price_updates():
         flash('An error occurred while loading price updates.', 'danger')
         return redirect(url_for('main.index'))
 
+@bp.route('/<int:invoice_id>/labels')
+@login_required
+def labels(invoice_id):
+    """Printable price-tag label sheets of an invoice, one per category"""
+    invoice = Invoice.query.get_or_404(invoice_id)
+    template = request.args.get('template', current_app.config.get('LABEL_DEFAULT_TEMPLATE', 'shelf'))
+    if template not in LABEL_TEMPLATES:
+        abort(404)
+    return render_template('invoice/labels.html', invoice=invoice, template=template,
+                           templates=list(LABEL_TEMPLATES))
+
+@bp.route('/<int:invoice_id>/labels', methods=['POST'])
+@login_required
+def request_labels(invoice_id):
+    """Queue label sheets for rendering; sheets with unchanged prices are reused"""
+    Invoice.query.get_or_404(invoice_id)
+    data = request.get_json(silent=True) or {}
+    try:
+        sheets = LabelSheetService().request_sheets(
+            invoice_id, data.get('template'), data.get('categories')
+        )
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'sheets': [sheet.to_dict() for sheet in sheets]}), 202
+
+@bp.route('/<int:invoice_id>/labels/status')
+@login_required
+def labels_status(invoice_id):
+    """Rendering status of an invoice's label sheets"""
+    Invoice.query.get_or_404(invoice_id)
+    try:
+        sheets = LabelSheetService().sheets(invoice_id, request.args.get('template'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'sheets': [sheet.to_dict() for sheet in sheets],
+        'complete': all(sheet.status != 'queued' for sheet in sheets)
+    })
+
+@bp.route('/labels/<int:sheet_id>.pdf')
+@login_required
+def label_sheet_pdf(sheet_id):
+    """Download one rendered label sheet"""
+    sheet = LabelSheet.query.get_or_404(sheet_id)
+    store = BlobStore()
+    if sheet.status != 'ready' or not store.exists(sheet.blob_key):
+        abort(404)
+    name = secure_filename(sheet.category_name or 'uncategorized') or 'labels'
+    return send_file(store.path(sheet.blob_key), mimetype='application/pdf',
+                     download_name=f"invoice-{sheet.invoice_id}-{name}-{sheet.template}.pdf")
+
+@bp.route('/<int:invoice_id>/labels.pdf')
+@login_required
+def labels_pdf(invoice_id):
+    """Download every ready label sheet of an invoice as one PDF"""
+    Invoice.query.get_or_404(invoice_id)
+    template = request.args.get('template')
+    try:
+        pdf = LabelSheetService().combined_pdf(invoice_id, template)
+    except ValueError:
+        abort(404)
+    if pdf is None:
+        abort(404)
+    return Response(pdf, mimetype='application/pdf', headers={
+        'Content-Disposition': f'inline; filename=invoice-{invoice_id}-labels.pdf'
+    })
+
 @bp.route('/<int:invoice_id>/pricing')
 @login_required
 def pricing_method(invoice_id):
@@ -550,26 +791,14 @@ def save_prices(invoice_id):
         if invoice.status != 'processed':
             return jsonify({'error': 'Invoice must be processed first'}), 400
             
-        # Update prices for each product
-        for price_data in data['prices']:
-            product_id = price_data.get('product_id')
-            margin = price_data.get('margin')
-            selling_price = price_data.get('selling_price')
-            
-            temp_product = TempProduct.query.get(product_id)
-            if temp_product and temp_product.invoice_id == invoice_id:
-                temp_product.margin = margin
-                temp_product.selling_price = selling_price
-                temp_product.status = 'pending_update'
-        
-        invoice.status = 'prices_set'
+        # Apply all submitted prices in one bulk commit
+        result = PriceCommitService().commit(invoice, data['prices'], user=current_user)
         db.session.commit()
         
         # Create staff tasks for label updates
-        task_service = TaskService()
-        task_service.create_price_update_tasks(invoice_id)
+        EnhancedPriceService().create_tasks(invoice_id)
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, **result})
         
     except Exception as e:
         db.session.rollback()
@@ -610,7 +839,9 @@ def finalize_prices(invoice_id):
         for product in temp_products:
             product.status = 'pending_update'
             
+        CategoryStatsService().record_invoice(invoice)
         invoice.status = 'prices_set'
+        LabelSheetService().request_sheets(invoice_id)
         db.session.commit()
         
         flash('Prices have been finalized. Staff can now update price tags.', 'success')
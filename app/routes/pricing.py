@@ -4,6 +4,8 @@ from flask import Blueprint, jsonify, request, current_app, render_template, red
 from flask_login import login_required, current_user
 from app.models import Invoice, TempProduct, Category, MarginSuggestion, Task
 from app.services.price_service import EnhancedPriceService
+from app.services.margin_service import EnhancedMarginService
+from app.services.category_stats import CategoryStatsService
 from app.services.claude_service import ClaudeService
 from app.extensions import db
 from app.utils.error_handling import APIError, handle_database_error, log_api_call
@@ -90,6 +92,42 @@ def calculate_prices(invoice_id):
         current_app.logger.error(f"Error calculating prices: {str(e)}")
         raise APIError("Failed to calculate prices")
 
+@bp.route('/api/invoice/<int:invoice_id>/simulate-margins', methods=['POST'])
+@login_required
+@log_api_call
+def simulate_margins(invoice_id):
+    """Evaluate what-if margin scenarios without saving any prices"""
+    data = request.get_json()
+    if not data:
+        raise APIError("No data provided")
+
+    scenarios = data.get('scenarios') or []
+    grid = data.get('grid') or {}
+    if not isinstance(scenarios, list) or not isinstance(grid, dict):
+        raise APIError("Scenarios must be a list and grid an object")
+    if not scenarios and not grid:
+        raise APIError("Scenarios or a margin grid are required")
+
+    Invoice.query.get_or_404(invoice_id)
+    try:
+        result = EnhancedMarginService().simulate_margins(
+            invoice_id,
+            scenarios=scenarios,
+            grid=grid,
+            base=data.get('base') or {},
+            rounding_method=data.get('rounding', '99')
+        )
+    except (TypeError, ValueError) as e:
+        raise APIError(str(e))
+    except Exception as e:
+        current_app.logger.error(f"Error simulating margins: {str(e)}")
+        raise APIError("Failed to simulate margins", status_code=500)
+
+    return jsonify({
+        'status': 'success',
+        **result
+    })
+
 @bp.route('/api/invoice/<int:invoice_id>/suggest-margins', methods=['POST'])
 @login_required
 @log_api_call
@@ -117,14 +155,20 @@ def suggest_margins(invoice_id):
         suggestions = claude.get_margin_suggestions(location, area_type)
         
         # Calculate summary with suggested margins
+        margins = {
+            category: advice['suggested_margin']
+            for category, advice in suggestions['margins'].items()
+        }
         service = EnhancedPriceService()
-        result = service.calculate_prices(invoice_id, suggestions)
+        result = service.calculate_prices(invoice_id, margins)
+        if result is None:
+            raise APIError("Failed to calculate prices")
         
         db.session.commit()
         
         return jsonify({
             'status': 'success',
-            'margins': suggestions,
+            'margins': suggestions['margins'],
             'summary': {
                 'total_products': result['summary']['total_products'],
                 'total_cost': result['summary']['total_cost'],
@@ -161,6 +205,7 @@ def save_prices(invoice_id):
         
         # Update invoice status
         invoice = Invoice.query.get_or_404(invoice_id)
+        CategoryStatsService().record_invoice(invoice)
         invoice.status = 'prices_set'
         invoice.processed_date = datetime.utcnow()
         db.session.commit()
@@ -0,0 +1,191 @@
+# app/services/batch_upload.py
+import os
+import zipfile
+import zlib
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app.extensions import db
+from app.models import Invoice, InvoiceBatch, ProcessingProgress
+from app.services.blob_store import BlobStore
+from app.services.duplicate_detector import DuplicateDetector
+from app.services.job_queue import JobQueue
+from app.services.invoice_processor import PIPELINE_STAGES
+
+INVOICE_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+class BatchUploadService:
+    """Create a batch of invoices from several files or ZIP archives and queue them all"""
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.max_files = current_app.config.get('INVOICE_BATCH_MAX_FILES', 50)
+        self.max_file_size = current_app.config.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024
+        self.duplicates = []  # Files skipped by create_batch because they were uploaded before
+
+    def collect_files(self, uploads):
+        """
+        Expand uploads into (filename, bytes) pairs
+        ZIP archives contribute every invoice file they contain;
+        anything that is not an invoice is reported as skipped
+        Returns (files, skipped)
+        """
+        files, skipped = [], []
+        for upload in uploads:
+            if not upload or not upload.filename:
+                continue
+            extension = _extension(upload.filename)
+            if extension == 'zip':
+                self._read_archive(upload, files, skipped)
+            elif extension in INVOICE_EXTENSIONS:
+                files.append((upload.filename, upload.read()))
+            else:
+                skipped.append(upload.filename)
+
+            if len(files) > self.max_files:
+                raise ValueError(f"A batch can contain at most {self.max_files} invoices")
+        return files, skipped
+
+    def _read_archive(self, upload, files, skipped):
+        try:
+            archive = zipfile.ZipFile(upload.stream)
+        except zipfile.BadZipFile:
+            raise ValueError(f"{upload.filename} is not a valid ZIP archive")
+
+        with archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                if member.is_dir() or not name or name.startswith('.') or '__MACOSX' in member.filename:
+                    continue
+                if _extension(name) not in INVOICE_EXTENSIONS:
+                    skipped.append(member.filename)
+                    continue
+                # Declared size guards against archives that expand far beyond the upload limit
+                if member.file_size > self.max_file_size:
+                    raise ValueError(f"{member.filename} in {upload.filename} is too large")
+                try:
+                    data = archive.read(member)
+                except (zipfile.BadZipFile, zlib.error, NotImplementedError, EOFError):
+                    raise ValueError(f"{member.filename} in {upload.filename} could not be read")
+                files.append((name, data))
+                if len(files) > self.max_files:
+                    raise ValueError(f"A batch can contain at most {self.max_files} invoices")
+
+    def create_batch(self, files, wholesaler_id, invoice_date, user_id):
+        """
+        Store the files, then create the batch, its invoices, progress
+        records and processing jobs in one transaction
+        Exact copies of earlier invoices, or of another file in the
+        upload, are left out and listed in self.duplicates
+        """
+        if not files:
+            raise ValueError("No invoice files found in the upload")
+
+        detector = DuplicateDetector()
+        fresh, seen = [], set()
+        for filename, data in files:
+            fingerprint = detector.fingerprint(data, wholesaler_id, invoice_date=invoice_date)
+            matches = detector.find_duplicates(fingerprint, exact_only=True)
+            if matches or fingerprint['sha256'] in seen:
+                self.duplicates.append({
+                    'filename': filename,
+                    'invoice_id': matches[0]['invoice_id'] if matches else None
+                })
+                continue
+            seen.add(fingerprint['sha256'])
+            fresh.append((filename, data, fingerprint))
+
+        if not fresh:
+            raise ValueError("Every invoice in the upload was uploaded before")
+
+        store = BlobStore()
+        try:
+            batch = InvoiceBatch(
+                wholesaler_id=wholesaler_id,
+                uploaded_by_id=user_id,
+                invoice_date=invoice_date,
+                file_count=len(fresh)
+            )
+            db.session.add(batch)
+
+            invoices = []
+            for filename, data, fingerprint in fresh:
+                invoice = Invoice(
+                    processed_by_id=user_id,
+                    wholesaler_id=wholesaler_id,
+                    invoice_date=invoice_date,
+                    status='processing',
+                    file_path=secure_filename(filename) or f"invoice.{_extension(filename)}",
+                    blob_key=store.put_bytes(data),
+                    batch=batch
+                )
+                db.session.add(invoice)
+                detector.record(invoice, fingerprint)
+                invoices.append(invoice)
+
+            db.session.flush()
+
+            queue = JobQueue()
+            for invoice in invoices:
+                db.session.add(ProcessingProgress(
+                    invoice_id=invoice.id,
+                    progress=5,
+                    current_step='queued',
+                    detailed_status='Waiting for an available worker...',
+                    total_steps=len(PIPELINE_STAGES)
+                ))
+                queue.enqueue(invoice.id, {'blob_key': invoice.blob_key})
+
+            db.session.commit()
+            self.logger.info(f"Created invoice batch {batch.id} with {len(invoices)} invoices")
+            return batch
+
+        except Exception:
+            # Stored blobs are left in place; they may be shared with other invoices
+            db.session.rollback()
+            raise
+
+    def batch_status(self, batch_id):
+        """Aggregated progress across all invoices of a batch"""
+        rows = db.session.query(
+            Invoice.id,
+            Invoice.file_path,
+            Invoice.status,
+            Invoice.error_message,
+            ProcessingProgress.progress,
+            ProcessingProgress.current_step,
+            ProcessingProgress.detailed_status
+        ).outerjoin(
+            ProcessingProgress, ProcessingProgress.invoice_id == Invoice.id
+        ).filter(Invoice.batch_id == batch_id).order_by(Invoice.id).all()
+
+        counts = {'processing': 0, 'processed': 0, 'failed': 0}
+        invoices = []
+        total_progress = 0
+        for row in rows:
+            if row.status == 'processing':
+                state, progress = 'processing', row.progress or 0
+            else:
+                # Every later status (processed, prices_set, completed, ...) is done
+                state, progress = 'failed' if row.status == 'failed' else 'processed', 100
+            counts[state] += 1
+            total_progress += progress
+            invoices.append({
+                'invoice_id': row.id,
+                'filename': row.file_path,
+                'status': state,
+                'progress': progress,
+                'current_step': row.current_step,
+                'detailed_status': row.error_message if state == 'failed' else row.detailed_status
+            })
+
+        return {
+            'batch_id': batch_id,
+            'total': len(rows),
+            'counts': counts,
+            'progress': round(total_progress / len(rows)) if rows else 0,
+            'complete': bool(rows) and counts['processing'] == 0,
+            'invoices': invoices
+        }
@@ -0,0 +1,101 @@
+# app/services/blob_replication.py
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app.extensions import db
+from app.models import Invoice, ProcessingJob, SalesDocument
+from app.services.blob_store import BlobStore
+from app.services.cloudinary_service import CloudinaryService
+from app.services.job_queue import JobQueue, register_job_handler
+
+class BlobReplicator:
+    """
+    Copy documents from the local blob store to Cloudinary in the background
+
+    Replication runs as 'replicate_blob' jobs on the processing queue, so it
+    gets the queue's retries with exponential backoff; the cloudinary_*
+    columns stay empty until the upload has succeeded.
+    """
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.max_attempts = current_app.config.get('CLOUDINARY_REPLICATION_MAX_ATTEMPTS', 8)
+
+    def _enqueue(self, invoice_id, payload):
+        return JobQueue().enqueue(
+            invoice_id, payload, job_type='replicate_blob', max_attempts=self.max_attempts
+        )
+
+    def schedule_invoice(self, invoice):
+        """Queue replication of an invoice's document unless done or pending; the caller commits"""
+        if invoice.cloudinary_secure_url or not invoice.blob_key:
+            return None
+        pending = ProcessingJob.query.filter(
+            ProcessingJob.invoice_id == invoice.id,
+            ProcessingJob.job_type == 'replicate_blob',
+            ProcessingJob.status.in_(('queued', 'running'))
+        ).first()
+        if pending:
+            return pending
+        return self._enqueue(invoice.id, {
+            'target': 'invoice',
+            'target_id': invoice.id,
+            'blob_key': invoice.blob_key
+        })
+
+    def add_sales_document(self, sales_id, document_type, upload):
+        """
+        Store an uploaded sales document locally and queue its replication
+        Returns the SalesDocument; the caller commits
+        """
+        blob_key = BlobStore().put_stream(upload.stream)
+        document = SalesDocument(
+            sales_id=sales_id,
+            document_type=document_type,
+            filename=secure_filename(upload.filename) or document_type,
+            blob_key=blob_key
+        )
+        db.session.add(document)
+        db.session.flush()
+        self._enqueue(None, {
+            'target': 'sales_document',
+            'target_id': document.id,
+            'blob_key': blob_key,
+            'folder': f"sales_reports/{document_type}",
+            'public_id': f"sales_{sales_id}_{document_type}_{document.id}"
+        })
+        return document
+
+    def replicate(self, job):
+        """Upload one blob and record where it landed"""
+        payload = job.payload or {}
+        target, target_id = payload.get('target'), payload.get('target_id')
+        path = BlobStore().path(payload.get('blob_key'))
+
+        if target == 'invoice':
+            invoice = db.session.get(Invoice, target_id)
+            if not invoice or invoice.cloudinary_secure_url:
+                return
+            result = CloudinaryService().upload_invoice(path, invoice.id)
+            invoice.cloudinary_public_id = result.get('public_id')
+            invoice.cloudinary_url = result.get('url')
+            invoice.cloudinary_secure_url = result.get('secure_url')
+            invoice.cloudinary_signature = result.get('signature')
+
+        elif target == 'sales_document':
+            document = db.session.get(SalesDocument, target_id)
+            if not document or document.secure_url:
+                return
+            result = CloudinaryService().upload(path, payload['folder'], payload['public_id'])
+            document.cloudinary_public_id = result.get('public_id')
+            document.secure_url = result.get('secure_url')
+
+        else:
+            raise ValueError(f"Unknown replication target: {target}")
+
+        db.session.commit()
+        self.logger.info(f"Replicated {target} {target_id} to Cloudinary: {result.get('public_id')}")
+
+@register_job_handler('replicate_blob')
+def run_replication_job(job, queue):
+    """Queue entry point for Cloudinary replication jobs"""
+    BlobReplicator().replicate(job)
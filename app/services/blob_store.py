@@ -0,0 +1,84 @@
+# app/services/blob_store.py
+import hashlib
+import os
+import tempfile
+from flask import current_app
+
+CHUNK_SIZE = 1024 * 1024
+
+class BlobStore:
+    """
+    Content-addressed file store on local disk
+
+    Files are keyed by the SHA-256 of their contents and kept under
+    <BLOB_STORE_FOLDER>/<first two hex digits>/<key>, so storing the same
+    document twice costs nothing and a key always names the same bytes.
+    Writes go to a temporary file first and are renamed into place.
+    """
+
+    def __init__(self, root=None):
+        self.logger = current_app.logger
+        self.root = root or current_app.config['BLOB_STORE_FOLDER']
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, key):
+        """Filesystem path of a blob"""
+        if not key or len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key)
+
+    def exists(self, key):
+        return bool(key) and os.path.exists(self.path(key))
+
+    def read(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def put_stream(self, stream):
+        """Store a readable binary stream (e.g. an uploaded FileStorage); returns its key"""
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            return self._commit(tmp_path, digest.hexdigest())
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        """Store bytes already in memory; returns their key"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            return self._commit(tmp_path, digest)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_file(self, file_path, move=False):
+        """Store a file already on disk; with move=True the original is removed"""
+        with open(file_path, 'rb') as f:
+            key = self.put_stream(f)
+        if move:
+            os.remove(file_path)
+        return key
+
+    def _commit(self, tmp_path, key):
+        final_path = self.path(key)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return key
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        self.logger.info(f"Stored blob {key}")
+        return key
@@ -0,0 +1,113 @@
+# app/services/category_memo.py
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import CategoryMemo, TempProduct
+
+UNCATEGORIZED = 'Uncategorized'
+
+def normalize_product_name(name):
+    """Lowercase, drop punctuation and collapse whitespace so invoice spellings line up"""
+    name = re.sub(r'[^a-z0-9%./ ]+', ' ', str(name or '').lower())
+    return re.sub(r'\s+', ' ', name).strip()
+
+class CategoryMemoService:
+    """Normalized product name -> category lookups, learned from past invoices"""
+
+    def __init__(self):
+        self.logger = current_app.logger
+
+    def lookup(self, names):
+        """
+        Look up categories for product names in one query
+        Returns dict of normalized name -> category name for names seen before
+        """
+        normalized = {normalize_product_name(n) for n in names}
+        normalized.discard('')
+        if not normalized:
+            return {}
+
+        rows = db.session.query(
+            CategoryMemo.normalized_name, CategoryMemo.category_name
+        ).filter(CategoryMemo.normalized_name.in_(normalized)).all()
+        return {row.normalized_name: row.category_name for row in rows}
+
+    def remember(self, categories, source='llm'):
+        """
+        Store name -> category results
+        Args:
+            categories: dict of product name -> category name
+            source: where the categories came from
+        """
+        mapping = {}
+        for name, category in categories.items():
+            key = normalize_product_name(name)
+            if key and category and category != UNCATEGORIZED:
+                mapping[key] = category
+        if not mapping:
+            return 0
+
+        try:
+            with db.session.begin_nested():
+                existing = {
+                    memo.normalized_name: memo
+                    for memo in CategoryMemo.query.filter(
+                        CategoryMemo.normalized_name.in_(mapping.keys())
+                    )
+                }
+                for key, category in mapping.items():
+                    memo = existing.get(key)
+                    if memo:
+                        memo.category_name = category
+                        memo.times_seen = (memo.times_seen or 0) + 1
+                        memo.updated_at = datetime.utcnow()
+                    else:
+                        db.session.add(CategoryMemo(
+                            normalized_name=key,
+                            category_name=category,
+                            source=source,
+                            times_seen=1
+                        ))
+            db.session.commit()
+            return len(mapping)
+        except IntegrityError:
+            # A concurrent invoice learned the same names; they will be picked up next time
+            db.session.commit()
+            return 0
+
+    def backfill_from_history(self):
+        """Seed the memo with the most common category per name across all TempProducts"""
+        counts = defaultdict(Counter)
+        rows = db.session.query(TempProduct.name, TempProduct.category_name).filter(
+            TempProduct.category_name.isnot(None),
+            TempProduct.category_name != UNCATEGORIZED
+        ).yield_per(1000)
+        for name, category in rows:
+            key = normalize_product_name(name)
+            if key:
+                counts[key][category] += 1
+
+        existing = {
+            memo.normalized_name: memo for memo in CategoryMemo.query.all()
+        }
+        added = 0
+        for key, counter in counts.items():
+            category = counter.most_common(1)[0][0]
+            memo = existing.get(key)
+            if memo:
+                memo.times_seen = max(memo.times_seen or 0, sum(counter.values()))
+                continue
+            db.session.add(CategoryMemo(
+                normalized_name=key,
+                category_name=category,
+                source='history',
+                times_seen=sum(counter.values())
+            ))
+            added += 1
+
+        db.session.commit()
+        self.logger.info(f"Backfilled {added} category memo entries from history")
+        return added
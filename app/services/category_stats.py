@@ -0,0 +1,158 @@
+# app/services/category_stats.py
+from collections import defaultdict
+from itertools import groupby
+from statistics import median
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import Category, CategoryMarginStats, Invoice, TempProduct
+from app.services.price_service import as_percent
+
+# Invoice statuses whose prices have been confirmed
+CONFIRMED_STATUSES = ('prices_set',)
+
+def per_category(lines):
+    """
+    One (category_name, median margin) pair per category of a confirmed
+    invoice, from its (category_name, margin) lines, so a long invoice
+    counts once per category rather than once per line
+    """
+    margins = defaultdict(list)
+    for category_name, margin in lines:
+        if category_name and margin is not None:
+            margins[category_name].append(float(margin))
+    return [(category_name, median(values)) for category_name, values in margins.items()]
+
+class CategoryStatsService:
+    """
+    Margin statistics per category, kept current as prices are confirmed
+
+    Each confirmation of an invoice contributes its median margin per
+    category, which updates the category's count, running mean,
+    exponentially weighted mean and window of recent margins in place, so
+    readers get everything with one query instead of scanning history.
+    """
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.window = current_app.config.get('CATEGORY_STATS_WINDOW', 100)
+        self.alpha = current_app.config.get('CATEGORY_STATS_EWMA_ALPHA', 0.1)
+
+    # ----- Updates -----
+
+    def record(self, observations):
+        """
+        Fold (category_name, margin percent) confirmations, oldest first,
+        into the statistics; the caller commits. Returns how many were counted
+        """
+        margins = defaultdict(list)
+        for category_name, margin in observations:
+            if category_name and margin is not None:
+                margins[category_name].append(float(margin))
+        if not margins:
+            return 0
+
+        rows = self._locked_rows(margins.keys())
+        for category_name, values in margins.items():
+            row = rows.get(category_name) or self._insert(category_name)
+            self._update(row, values)
+        return sum(len(values) for values in margins.values())
+
+    def _locked_rows(self, category_names):
+        # Locks the rows on databases that support it, so concurrent
+        # confirmations don't overwrite each other's updates
+        return {
+            row.category_name: row for row in CategoryMarginStats.query.filter(
+                CategoryMarginStats.category_name.in_(category_names)
+            ).with_for_update()
+        }
+
+    def _insert(self, category_name):
+        """A new category's row, or the one another confirmation inserted first"""
+        try:
+            with db.session.begin_nested():
+                row = CategoryMarginStats(category_name=category_name, count=0, recent_margins=[])
+                db.session.add(row)
+            return row
+        except IntegrityError:
+            # New rows can't be locked in advance; wait for the other
+            # transaction's row and update it instead
+            return self._locked_rows([category_name])[category_name]
+
+    def _update(self, row, values):
+        count = row.count or 0
+        mean = row.mean_margin or 0.0
+        ewma = row.ewma_margin
+        for value in values:
+            ewma = value if ewma is None else ewma + self.alpha * (value - ewma)
+
+        total = count + len(values)
+        row.mean_margin = round(mean + (sum(values) - len(values) * mean) / total, 4)
+        row.ewma_margin = round(ewma, 4)
+        row.count = total
+        # Assign a new list so the JSON column is seen as changed
+        row.recent_margins = ((row.recent_margins or []) + [round(value, 2) for value in values])[-self.window:]
+
+    def record_lines(self, lines):
+        """Record one confirmation from an invoice's (category_name, margin) lines"""
+        return self.record(per_category(lines))
+
+    def record_invoice(self, invoice):
+        """
+        Count an invoice's margins as its prices are confirmed
+        Call before the invoice's status changes; an invoice whose prices
+        were already confirmed is not counted again
+        """
+        if invoice.status in CONFIRMED_STATUSES:
+            return 0
+        rows = db.session.execute(
+            select(TempProduct.category_name, TempProduct.margin)
+            .where(TempProduct.invoice_id == invoice.id)
+            .order_by(TempProduct.id)
+        ).all()
+        return self.record_lines(rows)
+
+    def rebuild(self):
+        """Recompute every category's statistics from the confirmed invoices"""
+        CategoryMarginStats.query.delete()
+        rows = db.session.execute(
+            select(TempProduct.invoice_id, TempProduct.category_name, TempProduct.margin)
+            .join(Invoice, TempProduct.invoice_id == Invoice.id)
+            .where(Invoice.status.in_(CONFIRMED_STATUSES))
+            .order_by(func.coalesce(Invoice.processed_date, Invoice.upload_date), Invoice.id, TempProduct.id)
+        ).all()
+        confirmations = []
+        for _, lines in groupby(rows, key=lambda row: row.invoice_id):
+            confirmations.extend(per_category((row.category_name, row.margin) for row in lines))
+        counted = self.record(confirmations)
+        db.session.commit()
+        return counted
+
+    # ----- Lookups -----
+
+    def lookup(self, category_names):
+        """
+        Default margin and confirmed margin statistics of known categories,
+        in one query. avg_margin is the mean of the recent window, or the
+        default margin while nothing has been confirmed
+        """
+        rows = db.session.execute(
+            select(Category.name, Category.default_margin, CategoryMarginStats)
+            .outerjoin(CategoryMarginStats, CategoryMarginStats.category_name == Category.name)
+            .where(Category.name.in_([name for name in category_names if name]))
+        ).all()
+
+        stats = {}
+        for name, default_margin, row in rows:
+            confirmed = None
+            if row:
+                confirmed = row.to_dict()
+                del confirmed['recent_margins']  # Summarized by recent_mean
+            default_margin = as_percent(default_margin)
+            stats[name] = {
+                'default_margin': default_margin,
+                'confirmed': confirmed,
+                'avg_margin': confirmed['recent_mean'] if confirmed and confirmed['recent_mean'] is not None else default_margin
+            }
+        return stats
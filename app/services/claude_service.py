@@ -1,5 +1,6 @@
-import anthropic
 from flask import current_app
+from .llm_gateway import get_llm_gateway
+from .llm_schemas import EXTRACTION, MARGINS
 from .prompts import create_extraction_prompt, create_pricing_prompt
 
 def extract_invoice_data(file_path):
@@ -11,28 +12,33 @@ def extract_invoice_data(file_path):
 
 class ClaudeService:
     def __init__(self):
-        self.client = anthropic.Client(api_key=current_app.config['CLAUDE_API_KEY'])
+        self.gateway = get_llm_gateway()
 
     def extract_invoice_data(self, text):
-        """Extract product data from invoice text"""
+        """Extract product data from invoice text, as {'products': [{name, quantity, price}]}"""
         prompt = create_extraction_prompt(text)
         
-        response = self.client.messages.create(
+        response = self.gateway.create(
+            'anthropic',
             model="claude-3-opus-20240229",
             max_tokens=4000,
             messages=[{"role": "user", "content": prompt}]
         )
         
-        return response.content
+        return EXTRACTION.parse(response.content[0].text)
 
     def get_margin_suggestions(self, location, categories):
-        """Get margin suggestions based on location and categories"""
+        """
+        Get margin suggestions based on location and categories, as
+        {'margins': {category: {suggested_margin, reasoning, ...}}, 'market_summary': ...}
+        """
         prompt = create_pricing_prompt(location, categories)
         
-        response = self.client.messages.create(
+        response = self.gateway.create(
+            'anthropic',
             model="claude-3-opus-20240229",
             max_tokens=2000,
             messages=[{"role": "user", "content": prompt}]
         )
         
-        return response.content
\ No newline at end of file
+        return MARGINS.parse(response.content[0].text)
\ No newline at end of file
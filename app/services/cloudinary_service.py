@@ -3,18 +3,110 @@ import cloudinary
 import cloudinary.uploader
 from cloudinary import api
 from flask import current_app
+import hashlib
 import os
+import random
+import shutil
+import time
+
+UPLOAD_TIMEOUT = 60  # Seconds
+
+class LocalCloudinary:
+    """
+    Stand-in for the Cloudinary upload API (CLOUDINARY_BACKEND=local)
+
+    Copies uploads into a local folder and answers with the fields the real
+    API returns, so replication can be exercised in tests and development
+    without network access. error_rate injects failures to exercise retries.
+    """
+
+    def __init__(self, root, cloud_name='local', error_rate=0.0):
+        self.root = root
+        self.cloud_name = cloud_name
+        self.error_rate = error_rate
+
+    def _path(self, public_id):
+        return os.path.join(self.root, *public_id.split('/'))
+
+    def upload(self, file, folder=None, public_id=None, **options):
+        if self.error_rate and random.random() < self.error_rate:
+            raise ConnectionError("Injected failure from local Cloudinary")
+
+        public_id = '/'.join(part for part in (folder, public_id or os.path.basename(file)) if part)
+        path = self._path(public_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(file, path)
+
+        version = int(time.time())
+        with open(path, 'rb') as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        url = f"res.cloudinary.local/{self.cloud_name}/image/upload/v{version}/{public_id}"
+        return {
+            'public_id': public_id,
+            'version': version,
+            'signature': hashlib.sha1(f"{public_id}{version}".encode('utf-8')).hexdigest(),
+            'etag': etag,
+            'bytes': os.path.getsize(path),
+            'resource_type': 'image',
+            'url': f"http://{url}",
+            'secure_url': f"https://{url}"
+        }
+
+    def destroy(self, public_id, **options):
+        path = self._path(public_id)
+        if not os.path.exists(path):
+            return {'result': 'not found'}
+        os.remove(path)
+        return {'result': 'ok'}
 
 class CloudinaryService:
     def __init__(self):
+        # Configuration is done in the Config class; use ping() to verify it
+        self.logger = current_app.logger
+        self.backend = current_app.config.get('CLOUDINARY_BACKEND', 'live')
+        if self.backend == 'local':
+            self.uploader = LocalCloudinary(
+                current_app.config['CLOUDINARY_LOCAL_FOLDER'],
+                error_rate=current_app.config.get('CLOUDINARY_LOCAL_ERROR_RATE', 0)
+            )
+        elif self.backend == 'live':
+            self.uploader = cloudinary.uploader
+        else:
+            raise ValueError(f"Unknown CLOUDINARY_BACKEND: {self.backend}")
+
+    def ping(self):
+        """Check credentials and connectivity; a network round-trip on the live backend"""
+        if self.backend == 'local':
+            return True
         try:
-            # Configuration is already done in Config class
-            # Just verify the configuration
-            ping_result = api.ping()
-            current_app.logger.info("Cloudinary configured successfully")
+            api.ping()
+            return True
         except Exception as e:
-            current_app.logger.error(f"Error configuring Cloudinary: {str(e)}")
-            raise
+            self.logger.error(f"Error configuring Cloudinary: {str(e)}")
+            return False
+
+    def upload(self, file_path, folder, public_id):
+        """
+        Upload a file to Cloudinary
+        Returns dict with public_id, url, secure_url, and signature
+        """
+        if not file_path or not os.path.exists(file_path):
+            raise ValueError(f"File not found: {file_path}")
+
+        self.logger.info(f"Attempting to upload file: {file_path}")
+        result = self.uploader.upload(
+            file_path,
+            folder=folder,
+            public_id=public_id,
+            resource_type="auto",
+            timeout=UPLOAD_TIMEOUT
+        )
+
+        if not result or 'public_id' not in result or 'secure_url' not in result:
+            raise ValueError("Invalid response from Cloudinary")
+
+        self.logger.info(f"Upload successful: {result['public_id']}")
+        return result
 
     def upload_invoice(self, file_path, invoice_id=None):
         """
@@ -25,44 +117,24 @@ class CloudinaryService:
         Returns: dict with public_id, url, secure_url, and signature
         """
         try:
-            # Verify file exists
-            if not os.path.exists(file_path):
-                raise ValueError(f"File not found: {file_path}")
-
-            current_app.logger.info(f"Attempting to upload file: {file_path}")
-            
-            # Add additional error checking
-            if not file_path:
-                raise ValueError("Missing required parameter: file_path")
-            
             # Generate a unique identifier if no invoice_id is provided
             public_id = f"invoice_{invoice_id}" if invoice_id else f"invoice_temp_{os.path.basename(file_path)}"
-                
-            # Upload with error handling
-            result = cloudinary.uploader.upload(
-                file_path,
-                folder="invoices",
-                public_id=public_id,
-                resource_type="auto",
-                timeout=60  # Add timeout
-            )
-            
-            if not result or 'public_id' not in result or 'secure_url' not in result:
-                raise ValueError("Invalid response from Cloudinary")
-            
-            current_app.logger.info(f"Upload successful: {result['public_id']}")
-            return result
+            return self.upload(file_path, "invoices", public_id)
         except Exception as e:
-            current_app.logger.error(f"Cloudinary upload error: {str(e)}")
+            self.logger.error(f"Cloudinary upload error: {str(e)}")
             raise
 
     def delete_invoice(self, public_id):
         """Delete invoice from Cloudinary"""
+        return self.delete(public_id)
+
+    def delete(self, public_id):
+        """Delete an uploaded file from Cloudinary"""
         try:
             if not public_id:
                 raise ValueError("public_id is required")
-            result = cloudinary.uploader.destroy(public_id)
+            result = self.uploader.destroy(public_id)
             return result.get('result') == 'ok'
         except Exception as e:
-            current_app.logger.error(f"Cloudinary delete error: {str(e)}")
-            raise
\ No newline at end of file
+            self.logger.error(f"Cloudinary delete error: {str(e)}")
+            raise
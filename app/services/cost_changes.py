@@ -0,0 +1,115 @@
+# app/services/cost_changes.py
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import case, func, update
+from app.extensions import db
+from app.models import InvoiceItem, Product
+
+DEFAULT_ALERT_THRESHOLD = 10.0  # Percent, matches Product.price_alert_threshold
+
+class CostChangeDetector:
+    """
+    Compare matched invoice lines with each product's last purchase price
+    for a whole invoice at once, the set-based counterpart of
+    Product.update_price_trend
+    """
+
+    def __init__(self):
+        self.logger = current_app.logger
+
+    def _invoice_costs(self, invoice_id):
+        """Quantity-weighted unit cost per matched product on the invoice"""
+        quantity = func.coalesce(InvoiceItem.quantity, 1)
+        return db.session.query(
+            InvoiceItem.product_id.label('product_id'),
+            (func.sum(InvoiceItem.unit_price * quantity) / func.sum(quantity)).label('unit_price')
+        ).filter(
+            InvoiceItem.invoice_id == invoice_id,
+            InvoiceItem.status == 'matched',
+            InvoiceItem.product_id.isnot(None),
+            InvoiceItem.unit_price.isnot(None)
+        ).group_by(InvoiceItem.product_id).subquery()
+
+    def apply(self, invoice_id):
+        """
+        Update price_trend, last_purchase_price and last_price_update for
+        every product on the invoice in one statement
+        Returns the invoice lines whose cost moved past the product's alert
+        threshold; the caller commits, together with the lines themselves, so
+        a retry never compares against prices this invoice already wrote
+        """
+        costs = self._invoice_costs(invoice_id)
+
+        # Previous prices are read before the update overwrites them
+        changes = db.session.query(
+            costs.c.product_id,
+            costs.c.unit_price,
+            Product.name,
+            Product.last_purchase_price,
+            Product.price_alert_threshold
+        ).join(Product, Product.id == costs.c.product_id).all()
+        if not changes:
+            return []
+
+        now = datetime.utcnow()
+        db.session.execute(
+            update(Product)
+            .where(Product.id == costs.c.product_id)
+            .values(
+                price_trend=case(
+                    (Product.last_purchase_price.is_(None), Product.price_trend),
+                    (costs.c.unit_price > Product.last_purchase_price, 'increasing'),
+                    (costs.c.unit_price < Product.last_purchase_price, 'decreasing'),
+                    else_='stable'
+                ),
+                last_purchase_price=costs.c.unit_price,
+                last_price_update=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        alerted = {}
+        for change in changes:
+            previous = change.last_purchase_price
+            if not previous:
+                continue
+            change_pct = (change.unit_price - previous) / previous * 100
+            threshold = change.price_alert_threshold or DEFAULT_ALERT_THRESHOLD
+            if abs(change_pct) > threshold:
+                alerted[change.product_id] = {
+                    'product_id': change.product_id,
+                    'product_name': change.name,
+                    'previous_cost': round(previous, 2),
+                    'new_cost': round(change.unit_price, 2),
+                    'change_pct': round(change_pct, 1),
+                    'threshold': threshold
+                }
+
+        alerts = []
+        notes = []
+        if alerted:
+            lines = db.session.query(
+                InvoiceItem.id, InvoiceItem.product_id, InvoiceItem.raw_product_name
+            ).filter(
+                InvoiceItem.invoice_id == invoice_id,
+                InvoiceItem.status == 'matched',
+                InvoiceItem.product_id.in_(alerted.keys())
+            ).order_by(InvoiceItem.id).all()
+            for line in lines:
+                alert = dict(alerted[line.product_id], item_id=line.id, line_name=line.raw_product_name)
+                alerts.append(alert)
+                notes.append({
+                    'id': line.id,
+                    'matching_notes': (
+                        f"Cost {'up' if alert['change_pct'] > 0 else 'down'} {abs(alert['change_pct'])}% "
+                        f"from {alert['previous_cost']:.2f} (alert threshold {alert['threshold']:g}%)"
+                    )
+                })
+        if notes:
+            db.session.execute(update(InvoiceItem), notes)
+
+        self.logger.info(
+            f"Updated purchase prices for {len(changes)} products on invoice {invoice_id}, "
+            f"{len(alerts)} line(s) over their alert threshold"
+        )
+        return alerts
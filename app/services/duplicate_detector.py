@@ -0,0 +1,228 @@
+# app/services/duplicate_detector.py
+import hashlib
+import io
+import re
+from flask import current_app
+from sqlalchemy import select
+from app.extensions import db
+from app.models import Invoice, InvoiceFingerprint
+from app.services.document_pages import detect_mime_type, INK_THRESHOLD
+
+HASH_SIZE = 16  # dHash grid, giving a 256-bit image hash
+BAND_COUNT = 32  # Hashes differing in fewer than BAND_COUNT bits share at least one band
+PAPER_LEVEL = 200  # Grayscale level above which a pixel counts as paper
+BAND_WIDTH = HASH_SIZE * HASH_SIZE // 4 // BAND_COUNT  # Hex digits per band
+
+def normalize_invoice_number(number):
+    """Compare invoice numbers without case, punctuation or leading zeros"""
+    number = re.sub(r'[^0-9A-Z]', '', (number or '').upper())
+    return re.sub(r'(?<![0-9])0+(?=[0-9])', '', number)
+
+def hash_distance(first, second):
+    """Number of differing bits between two hex image hashes"""
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+class DuplicateDetector:
+    """
+    Spot invoices that were uploaded before, before any work is spent on them
+
+    Each upload gets three fingerprints: the SHA-256 of the file, which is
+    also its blob key, so exact copies are found through Invoice.blob_key;
+    a difference hash of the first page, so a photo and a scan of the same
+    paper invoice land close together; and (wholesaler, invoice number,
+    date) when the number is known. Image hashes are split into bands
+    stored in the indexed invoice_fingerprint table, so candidates come
+    from index lookups and only they are compared bit by bit.
+    """
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.max_distance = min(
+            current_app.config.get('INVOICE_DUPLICATE_MAX_DISTANCE', 28),
+            BAND_COUNT - 1
+        )
+
+    # ----- Fingerprints -----
+
+    def fingerprint(self, file_bytes, wholesaler_id, invoice_number=None, invoice_date=None):
+        """Fingerprints of an upload, as a dict for find_duplicates() and record()"""
+        reference = None
+        number = normalize_invoice_number(invoice_number)
+        if number and invoice_date:
+            reference = f"{wholesaler_id}:{number}:{invoice_date.isoformat()}"
+        return {
+            'wholesaler_id': wholesaler_id,
+            'sha256': hashlib.sha256(file_bytes).hexdigest(),
+            'image_hash': self.image_hash(file_bytes),
+            'reference': reference
+        }
+
+    def image_hash(self, file_bytes):
+        """Difference hash of the document's first page, or None if it cannot be read"""
+        try:
+            from PIL import Image, ImageOps
+            import numpy as np
+        except ImportError:
+            return None
+
+        try:
+            image = self._first_page(file_bytes)
+            if image is None:
+                return None
+            image = ImageOps.autocontrast(ImageOps.exif_transpose(image).convert('L'))
+            image.thumbnail((1024, 1024))
+
+            # Crop to the paper, then to the printed area on it, so the table or
+            # scanner bed around the page and stray specks don't count
+            image = self._crop(image, lambda v: 255 if v > PAPER_LEVEL else 0, density=0.9)
+            image = self._crop(image, lambda v: 255 if v < INK_THRESHOLD else 0)
+            image = ImageOps.autocontrast(image)
+
+            pixels = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+            bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+            return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+        except Exception as e:
+            self.logger.warning(f"Could not hash invoice image: {str(e)}")
+            return None
+
+    def _crop(self, image, classify, cell=8, density=0.1):
+        """Crop to the cells where at least `density` of the pixels pass `classify`"""
+        from PIL import Image
+
+        width, height = image.width // cell, image.height // cell
+        if not width or not height:
+            return image
+        coarse = image.point(classify).resize((width, height), Image.BOX)
+        box = coarse.point(lambda v: 255 if v >= 255 * density else 0).getbbox()
+        if not box:
+            return image
+        return image.crop(tuple(edge * cell for edge in box))
+
+    def _first_page(self, file_bytes):
+        from PIL import Image
+
+        mime_type = detect_mime_type(file_bytes)
+        if mime_type == 'application/pdf':
+            try:
+                import fitz  # PyMuPDF
+            except ImportError:
+                return None
+            with fitz.open(stream=file_bytes, filetype='pdf') as document:
+                if not document.page_count:
+                    return None
+                pixmap = document[0].get_pixmap(colorspace=fitz.csGRAY, alpha=False)
+                return Image.frombytes('L', (pixmap.width, pixmap.height), pixmap.samples)
+        if mime_type in ('image/png', 'image/jpeg'):
+            image = Image.open(io.BytesIO(file_bytes))
+            image.draft('L', (1024, 1024))  # Let JPEG decode at reduced size
+            return image
+        return None
+
+    def _bands(self, fingerprint):
+        image_hash = fingerprint['image_hash']
+        return [
+            f"{fingerprint['wholesaler_id']}:{index}:{image_hash[index * BAND_WIDTH:(index + 1) * BAND_WIDTH]}"
+            for index in range(BAND_COUNT)
+        ]
+
+    # ----- Lookups -----
+
+    def find_duplicates(self, fingerprint, exact_only=False):
+        """
+        Earlier invoices matching the fingerprint, best match first
+        Returns dicts with invoice_id, match (exact, reference or image) and distance
+        """
+        matches = {}
+
+        def add(invoice_id, match, distance=0):
+            if invoice_id not in matches:
+                matches[invoice_id] = {'invoice_id': invoice_id, 'match': match, 'distance': distance}
+
+        for (invoice_id,) in db.session.query(Invoice.id).filter(
+            Invoice.blob_key == fingerprint['sha256']
+        ):
+            add(invoice_id, 'exact')
+
+        if fingerprint['reference'] and not exact_only:
+            for (invoice_id,) in db.session.query(InvoiceFingerprint.invoice_id).filter(
+                InvoiceFingerprint.kind == 'reference',
+                InvoiceFingerprint.value == fingerprint['reference']
+            ):
+                add(invoice_id, 'reference')
+
+        if fingerprint['image_hash'] and not exact_only:
+            candidates = select(InvoiceFingerprint.invoice_id).where(
+                InvoiceFingerprint.kind == 'dhash_band',
+                InvoiceFingerprint.value.in_(self._bands(fingerprint))
+            )
+            image_matches = []
+            for invoice_id, image_hash in db.session.query(
+                InvoiceFingerprint.invoice_id, InvoiceFingerprint.value
+            ).filter(
+                InvoiceFingerprint.kind == 'dhash',
+                InvoiceFingerprint.invoice_id.in_(candidates)
+            ):
+                distance = hash_distance(image_hash, fingerprint['image_hash'])
+                if distance <= self.max_distance:
+                    image_matches.append((distance, invoice_id))
+            for distance, invoice_id in sorted(image_matches):
+                add(invoice_id, 'image', distance)
+
+        if not matches:
+            return []
+
+        # Failed invoices never got processed, so uploading again is expected
+        invoices = {
+            invoice.id: invoice for invoice in Invoice.query.filter(
+                Invoice.id.in_(matches.keys()),
+                Invoice.status != 'failed'
+            )
+        }
+        results = []
+        for invoice_id, match in matches.items():
+            invoice = invoices.get(invoice_id)
+            if invoice is None:
+                continue
+            match.update({
+                'invoice_number': invoice.invoice_number,
+                'invoice_date': invoice.invoice_date.isoformat() if invoice.invoice_date else None,
+                'upload_date': invoice.upload_date.isoformat() if invoice.upload_date else None,
+                'filename': invoice.file_path,
+                'status': invoice.status
+            })
+            results.append(match)
+        return results
+
+    def record(self, invoice, fingerprint):
+        """Store an invoice's fingerprints; the caller commits"""
+        rows = []
+        if fingerprint['reference']:
+            rows.append(InvoiceFingerprint(kind='reference', value=fingerprint['reference']))
+        if fingerprint['image_hash']:
+            rows.append(InvoiceFingerprint(kind='dhash', value=fingerprint['image_hash']))
+            rows.extend(InvoiceFingerprint(kind='dhash_band', value=band) for band in self._bands(fingerprint))
+        invoice.fingerprints.extend(rows)
+        return rows
+
+    def backfill(self, store):
+        """Fingerprint stored invoices that have none yet; returns how many were done"""
+        done = 0
+        fingerprinted = select(InvoiceFingerprint.invoice_id)
+        invoices = Invoice.query.filter(
+            Invoice.blob_key.isnot(None),
+            Invoice.id.notin_(fingerprinted)
+        ).all()
+        for invoice in invoices:
+            if not store.exists(invoice.blob_key):
+                continue
+            fingerprint = self.fingerprint(
+                store.read(invoice.blob_key),
+                invoice.wholesaler_id,
+                invoice.invoice_number,
+                invoice.invoice_date
+            )
+            if self.record(invoice, fingerprint):
+                done += 1
+        db.session.commit()
+        return done
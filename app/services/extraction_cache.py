@@ -0,0 +1,132 @@
+# app/services/extraction_cache.py
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import ExtractionCache
+
+# Process-wide hit/miss counters
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def extraction_version(model, prompt):
+    """Version key for an extraction model + prompt; changing either invalidates the cache"""
+    return hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
+
+class ExtractionCacheService:
+    """Persistent cache of validated invoice extraction results"""
+
+    def __init__(self, version):
+        self.logger = current_app.logger
+        self.version = version
+        self.enabled = current_app.config.get('EXTRACTION_CACHE_ENABLED', True)
+        self.ttl = timedelta(days=current_app.config.get('EXTRACTION_CACHE_TTL_DAYS', 30))
+        self.max_entries = current_app.config.get('EXTRACTION_CACHE_MAX_ENTRIES', 5000)
+
+    @staticmethod
+    def content_hash(file_bytes):
+        return hashlib.sha256(file_bytes).hexdigest()
+
+    def get(self, file_bytes):
+        """Return the cached product list for these bytes, or None"""
+        if not self.enabled:
+            return None
+        try:
+            entry = ExtractionCache.query.filter_by(
+                content_hash=self.content_hash(file_bytes),
+                version=self.version
+            ).first()
+
+            now = datetime.utcnow()
+            if not entry or (entry.expires_at and entry.expires_at < now):
+                _count('misses')
+                return None
+
+            entry.hit_count = (entry.hit_count or 0) + 1
+            entry.last_used_at = now
+            db.session.commit()
+            _count('hits')
+            self.logger.info(f"Extraction cache hit for {entry.content_hash[:12]} ({entry.product_count} products)")
+            return [dict(product) for product in entry.products]
+
+        except Exception as e:
+            db.session.rollback()
+            self.logger.warning(f"Extraction cache lookup failed: {str(e)}")
+            return None
+
+    def put(self, file_bytes, products):
+        """Store a validated product list and evict old entries"""
+        if not self.enabled:
+            return
+        now = datetime.utcnow()
+        content_hash = self.content_hash(file_bytes)
+        try:
+            with db.session.begin_nested():
+                # An expired entry for the same file would block the insert
+                ExtractionCache.query.filter(
+                    ExtractionCache.content_hash == content_hash,
+                    ExtractionCache.version == self.version,
+                    ExtractionCache.expires_at < now
+                ).delete(synchronize_session=False)
+                db.session.add(ExtractionCache(
+                    content_hash=content_hash,
+                    version=self.version,
+                    products=products,
+                    product_count=len(products),
+                    file_size=len(file_bytes),
+                    hit_count=0,
+                    created_at=now,
+                    last_used_at=now,
+                    expires_at=now + self.ttl
+                ))
+            _count('stores')
+            self.evict()
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same file first
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.warning(f"Extraction cache store failed: {str(e)}")
+
+    def evict(self):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        removed = ExtractionCache.query.filter(
+            ExtractionCache.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+
+        overflow = ExtractionCache.query.count() - self.max_entries
+        if overflow > 0:
+            stale_ids = [row.id for row in db.session.query(ExtractionCache.id).order_by(
+                ExtractionCache.last_used_at
+            ).limit(overflow)]
+            removed += ExtractionCache.query.filter(
+                ExtractionCache.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+
+        if removed:
+            _count('evictions', removed)
+        return removed
+
+    def stats(self):
+        """Hit/miss counters for this process plus table totals"""
+        with _stats_lock:
+            counters = dict(_stats)
+        lookups = counters['hits'] + counters['misses']
+        entries, stored_hits = db.session.query(
+            func.count(ExtractionCache.id),
+            func.coalesce(func.sum(ExtractionCache.hit_count), 0)
+        ).first()
+        counters.update({
+            'hit_rate': round(counters['hits'] / lookups, 3) if lookups else None,
+            'entries': entries,
+            'total_hits': int(stored_hits)
+        })
+        return counters
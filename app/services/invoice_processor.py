@@ -1,14 +1,56 @@
 import base64
-import json
 import os
-from openai import OpenAI
+import asyncio
 from flask import current_app
-from app.models import Invoice, TempProduct, Category, ProcessingProgress
+from app.models import Invoice, InvoiceItem, TempProduct, Category, ProcessingProgress, ExtractedProduct
 from app.extensions import db
+from app.services.blob_store import BlobStore
+from app.services.blob_replication import BlobReplicator
+from app.services.job_queue import register_job_handler
+from app.services.extraction_cache import ExtractionCacheService, extraction_version
+from app.services.category_memo import CategoryMemoService, normalize_product_name
+from app.services.document_pages import DocumentPages
+from app.services.llm_gateway import get_llm_gateway
+from app.services.llm_usage import track_llm_usage, record_cache_hit
+from app.services.llm_schemas import CATEGORIZATION, EXTRACTION, PRODUCT_LINE, LLMOutputError
+from app.services.progress_reporter import ProgressReporter
+from app.services.product_stream import ProductStreamParser, ExtractedProductPublisher
+from app.services.product_matcher import ProductMatcher
+from app.services.cost_changes import CostChangeDetector
+
+# Pipeline stages in execution order: (stage, progress % when started, message)
+PIPELINE_STAGES = [
+    ('store', 10, 'Storing invoice...'),
+    ('extract', 25, 'Extracting products from invoice...'),
+    ('categorize', 50, 'Matching products to categories...'),
+    ('save', 75, 'Saving products...')
+]
+
+EXTRACTION_MODEL = "gpt-4-turbo"
+CATEGORIZATION_MODEL = "gpt-4-turbo"
+EXTRACTION_PROMPT = """Extract only these fields from the invoice:
+1. Product name (exactly as written)
+2. Quantity (as number)
+3. Unit price (as decimal)
+
+Return ONLY JSON in this exact format:
+{
+    "products": [
+        {
+            "name": "Product name",
+            "quantity": 10,
+            "price": 5.99
+        }
+    ]
+}
+
+If no products are found, return an empty list."""
 
 class EnhancedInvoiceProcessor:
     def __init__(self):
         self.logger = current_app.logger
+        self.page_stats = None
+        self.progress = None  # ProgressReporter while a pipeline runs
 
     def _create_progress_record(self, invoice_id):
         """Create initial progress record"""
@@ -19,7 +61,7 @@ class EnhancedInvoiceProcessor:
                 current_step='Started',
                 detailed_status='Starting invoice processing...',
                 step_number=1,
-                total_steps=4
+                total_steps=len(PIPELINE_STAGES)
             )
             db.session.add(progress)
             db.session.commit()
@@ -28,260 +70,503 @@ class EnhancedInvoiceProcessor:
             self.logger.error(f"Error creating progress record: {str(e)}")
             raise
 
-    def _update_progress(self, progress_record, stage, message, percentage):
-        """Update progress record"""
+    def _get_progress_record(self, invoice_id):
+        """Get the invoice's progress record, creating it if needed"""
+        progress = ProcessingProgress.query.filter_by(invoice_id=invoice_id).first()
+        if progress:
+            return progress
+        return self._create_progress_record(invoice_id)
+
+    def _start_progress(self, invoice_id):
+        """Reporter for the invoice's progress; its writes stay out of the pipeline's transactions"""
+        self._get_progress_record(invoice_id)
+        self.progress = ProgressReporter(invoice_id, PIPELINE_STAGES)
+        return self.progress
+
+    def run_stage(self, invoice, stage, payload):
+        """
+        Run a single pipeline stage and return the updated payload
+        LLM calls made by the stage are recorded against the invoice
+        """
+        handlers = {
+            'store': self._stage_store,
+            'extract': self._stage_extract,
+            'categorize': self._stage_categorize,
+            'save': self._stage_save
+        }
+        with track_llm_usage(invoice.id, stage):
+            return handlers[stage](invoice, dict(payload))
+
+    def _stage_store(self, invoice, payload):
+        """
+        Make sure the original is in the local blob store and queue its
+        Cloudinary replication, which runs alongside the remaining stages
+        """
+        if not payload.get('blob_key'):
+            # Jobs queued with a plain upload path
+            payload['blob_key'] = BlobStore().put_file(payload.pop('file_path'), move=True)
+        invoice.blob_key = payload['blob_key']
+        BlobReplicator().schedule_invoice(invoice)
+        return payload
+
+    def _stage_extract(self, invoice, payload):
+        self.page_stats = None
+        publisher = ExtractedProductPublisher(invoice.id)
+        publisher.reset()
+        payload['products'] = self._extract_text(BlobStore().path(payload['blob_key']), publisher)
+        if self.page_stats:
+            # Original vs. reduced payload sizes sent to the vision model
+            payload['page_stats'] = self.page_stats
+        self.logger.info(f"Extracted {len(payload['products'])} products")
+        return payload
+
+    def _stage_categorize(self, invoice, payload):
+        payload['products'] = self._categorize_products(payload['products'])
+        self.logger.info(f"Categorized {len(payload['products'])} products")
+        return payload
+
+    def _stage_save(self, invoice, payload):
+        """
+        Save lines, catalog matches and cost changes without committing;
+        the caller's commit (the job checkpoint) makes them land together
+        """
+        invoice.update_status('processed')
+        self._save_products(invoice, payload['products'])
+        # Lines whose cost moved past the product's alert threshold
+        payload['cost_alerts'] = CostChangeDetector().apply(invoice.id)
+        return payload
+
+    def run_job(self, job, queue):
+        """
+        Drive a queued job through the remaining pipeline stages,
+        checkpointing after each one so retries resume where they stopped
+        """
+        invoice = Invoice.query.get(job.invoice_id)
+        if not invoice:
+            raise ValueError(f"Invoice {job.invoice_id} not found")
+
+        progress = self._start_progress(invoice.id)
+        payload = dict(job.payload or {})
+        stage_names = [name for name, _, _ in PIPELINE_STAGES]
+        start = stage_names.index(job.stage) if job.stage in stage_names else 0
+        if not payload.get('blob_key'):
+            # Queued with a plain upload path, which the store stage takes in
+            start = 0
+
         try:
-            progress_record.current_step = stage
-            progress_record.detailed_status = message
-            progress_record.progress = percentage
-            db.session.commit()
-        except Exception as e:
-            self.logger.error(f"Error updating progress: {str(e)}")
+            for index in range(start, len(PIPELINE_STAGES)):
+                stage = stage_names[index]
+                progress.start_stage(stage)
+
+                payload = self.run_stage(invoice, stage, payload)
+                next_stage = stage_names[index + 1] if index + 1 < len(stage_names) else None
+                queue.checkpoint(job, next_stage, payload)
+
+            progress.complete("Invoice processing complete")
+        finally:
+            progress.close()
+        self.logger.info(f"Successfully processed invoice {invoice.id}")
 
     def process_invoice(self, invoice_id, file_path):
         """
-        Comprehensive invoice processing workflow
+        Run the full pipeline synchronously in the current request
         Stages:
-        0-25%: Initial setup and file upload
+        0-25%: Store locally, queue Cloudinary replication
         25-50%: Text extraction
         50-75%: Product categorization
         75-100%: Saving products
         """
         try:
-            # Stage 0-25%: Initial setup
             invoice = Invoice.query.get_or_404(invoice_id)
-            progress_record = self._create_progress_record(invoice_id)
+            progress = self._start_progress(invoice_id)
             self.logger.info(f"Processing invoice {invoice_id} from {file_path}")
 
-            # Stage 25-50%: Text Extraction
+            payload = {'blob_key': BlobStore().put_file(file_path)}
             try:
-                extracted_products = self._extract_text(file_path)
-                self._update_progress(progress_record, 50, "Text extracted successfully")
-                self.logger.info(f"Extracted {len(extracted_products)} products")
-            except Exception as extract_error:
-                self.logger.error(f"Text extraction failed: {str(extract_error)}")
-                self._update_progress(progress_record, 25, f"Text extraction error: {str(extract_error)}")
-                raise
-
-            # Stage 50-75%: Categorization
-            try:
-                categorized_products = self._categorize_products(extracted_products)
-                self._update_progress(progress_record, 75, "Products categorized")
-                self.logger.info(f"Categorized {len(categorized_products)} products")
-            except Exception as categorize_error:
-                self.logger.error(f"Product categorization failed: {str(categorize_error)}")
-                self._update_progress(progress_record, 50, f"Categorization error: {str(categorize_error)}")
-                raise
-
-            # Stage 75-100%: Save Products
-            try:
-                self._save_products(invoice, categorized_products)
-                self._update_progress(progress_record, 100, "Invoice processing complete")
-                self.logger.info(f"Successfully processed invoice {invoice_id}")
-            except Exception as save_error:
-                self.logger.error(f"Product saving failed: {str(save_error)}")
-                self._update_progress(progress_record, 75, f"Saving error: {str(save_error)}")
-                raise
+                for stage, _, _ in PIPELINE_STAGES:
+                    progress.start_stage(stage)
+                    try:
+                        payload = self.run_stage(invoice, stage, payload)
+                    except Exception as stage_error:
+                        self.logger.error(f"Stage {stage} failed: {str(stage_error)}")
+                        progress.update(f"{stage.capitalize()} error: {str(stage_error)}")
+                        raise
+                db.session.commit()
 
-            return categorized_products
+                progress.complete("Invoice processing complete")
+            finally:
+                progress.close()
+            self.logger.info(f"Successfully processed invoice {invoice_id}")
+            return payload['products']
 
         except Exception as e:
             self.logger.critical(f"Comprehensive invoice processing failed: {str(e)}")
-            # Ensure progress is updated even in failure scenarios
-            if 'progress_record' in locals():
-                self._update_progress(progress_record, 0, f"Processing failed: {str(e)}")
+            db.session.rollback()
             raise
 
-    def _extract_text(self, file_path):
-        """Extract text from invoice using GPT-4 turbo"""
+    def _extract_text(self, file_path, publisher=None):
+        """
+        Extract products from invoice using GPT-4 turbo
+        Multi-page PDFs are rendered locally and the pages extracted concurrently.
+        Products are streamed to `publisher` as the model emits them.
+        """
         try:
             # Validate file exists and is readable
             if not os.path.exists(file_path):
                 raise ValueError(f"File not found: {file_path}")
             
-            # Read and encode the image
             with open(file_path, 'rb') as file:
                 file_bytes = file.read()
                 if len(file_bytes) == 0:
                     raise ValueError("Empty file")
-                file_b64 = base64.b64encode(file_bytes).decode('utf-8')
 
-            # Create OpenAI client
-            client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
-            
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",  # Use vision model
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Extract only these fields from the invoice:
-                        1. Product name (exactly as written)
-                        2. Quantity (as number)
-                        3. Unit price (as decimal)
-
-                        Return ONLY JSON in this exact format:
-                        {
-                            "products": [
-                                {
-                                    "name": "Product name",
-                                    "quantity": 10,
-                                    "price": 5.99
-                                }
-                            ]
-                        }
-                        
-                        If no products are found, return an empty list."""
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Extract the products from this invoice."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{file_b64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=4000,
-                response_format={"type": "json_object"}  # Force JSON response
-            )
+            # Identical file already extracted with this model/prompt
+            cache = ExtractionCacheService(extraction_version(EXTRACTION_MODEL, EXTRACTION_PROMPT))
+            cached_products = cache.get(file_bytes)
+            if cached_products is not None:
+                record_cache_hit(EXTRACTION_MODEL)
+                if publisher:
+                    publisher.publish_all(cached_products)
+                return cached_products
+
+            document = DocumentPages()
+            pages = document.split(file_bytes)
+            self.page_stats = document.stats
 
-            content = response.choices[0].message.content
+            # Pages are extracted concurrently on the gateway; results keep page order
+            gateway = get_llm_gateway()
+            future = gateway.submit(self._extract_pages(gateway, pages, publisher))
+            page_products = publisher.wait(future) if publisher else future.result()
+
+            validated_products = [product for page in page_products for product in page]
+
+            # Log extraction details
+            self.logger.info(f"Extracted {len(validated_products)} products from {len(pages)} page(s)")
             
-            # Clean up response - remove any markdown or code blocks
-            content = content.replace('```json', '').replace('```', '').strip()
+            if not validated_products:
+                self.logger.warning("No valid products found in extracted data")
+            else:
+                cache.put(file_bytes, validated_products)
             
-            try:
-                data = json.loads(content)
-                products = data.get('products', [])
-                
-                # Detailed validation
-                validated_products = []
-                for idx, product in enumerate(products, 1):
-                    try:
-                        validated_product = {
-                            'name': str(product.get('name', f'Unknown Product {idx}')).strip(),
-                            'quantity': max(1, int(float(product.get('quantity', 1)))),
-                            'price': max(0, float(product.get('price', 0)))
-                        }
-                        validated_products.append(validated_product)
-                    except (ValueError, TypeError) as val_err:
-                        self.logger.warning(f"Validation error for product {idx}: {val_err}")
-                
-                # Log extraction details
-                self.logger.info(f"Extracted {len(validated_products)} products from invoice")
-                
-                if not validated_products:
-                    self.logger.warning("No valid products found in extracted data")
-                
-                return validated_products
-                
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Failed to parse GPT response: {str(e)}")
-                self.logger.error(f"Response content that failed to parse: {content}")
-                raise ValueError("Failed to parse invoice")
+            return validated_products
                 
         except Exception as e:
             self.logger.error(f"Comprehensive error extracting text: {str(e)}")
             raise
 
+    async def _extract_pages(self, gateway, pages, publisher=None):
+        """Extract all pages, at most INVOICE_PAGE_WORKERS at a time"""
+        semaphore = asyncio.Semaphore(current_app.config.get('INVOICE_PAGE_WORKERS', 4))
+
+        done = 0
+
+        async def extract(page_number, image_bytes, mime_type):
+            nonlocal done
+            async with semaphore:
+                products = await self._extract_page(gateway, image_bytes, mime_type, page_number, publisher)
+            done += 1
+            if self.progress:
+                self.progress.update(f"Extracted page {done} of {len(pages)}", fraction=done / len(pages))
+            return products
+
+        return await asyncio.gather(*[
+            extract(number, image, mime_type)
+            for number, (image, mime_type) in enumerate(pages, 1)
+        ])
+
+    async def _extract_page(self, gateway, image_bytes, mime_type, page_number, publisher=None):
+        """
+        Extract and validate the products on a single page image
+        The response is streamed so each product can be published as soon
+        as its JSON object is complete
+        """
+        image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        parser = ProductStreamParser()
+        streamed = 0
+
+        async for delta in gateway.astream(
+            'openai',
+            model=EXTRACTION_MODEL,  # Use vision model
+            messages=[
+                {
+                    "role": "system",
+                    "content": EXTRACTION_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "Extract the products from this invoice page."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{image_b64}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            max_tokens=4000,
+            response_format={"type": "json_object"}  # Force JSON response
+        ):
+            for product in parser.feed(delta):
+                streamed += 1
+                validated_product = self._validate_product(product, streamed)
+                if validated_product and publisher:
+                    publisher.push(page_number, streamed, validated_product)
+
+        content = parser.text
+
+        # Validate the complete response; malformed products are dropped or repaired
+        try:
+            data = EXTRACTION.parse(content)
+        except LLMOutputError as e:
+            self.logger.error(f"Failed to parse GPT response for page {page_number}: {str(e)}")
+            self.logger.error(f"Response content that failed to parse: {content}")
+            raise ValueError(f"Failed to parse invoice page {page_number}")
+
+        products = data['products']
+        if len(products) < streamed:
+            self.logger.warning(f"Dropped {streamed - len(products)} malformed product(s) on page {page_number}")
+        for idx, product in enumerate(products, 1):
+            product['name'] = product['name'] or f'Unknown Product {idx}'
+        return products
+
+    def _validate_product(self, product, idx):
+        """Normalize one streamed product; None if it cannot be used"""
+        try:
+            validated = PRODUCT_LINE.validate(product)
+        except LLMOutputError:
+            return None  # The final parse of the page reports it
+        validated['name'] = validated['name'] or f'Unknown Product {idx}'
+        return validated
+
     def _categorize_products(self, products):
-        """Categorize products using GPT matching to DB categories"""
+        """
+        Categorize products, reusing remembered categories and sending
+        only names never seen before to GPT in concurrent chunks
+        """
         try:
             # Get categories from DB
             categories = Category.query.all()
             category_names = [cat.name for cat in categories]
-            categories_str = ', '.join(category_names)
-            
-            # Prepare product list for GPT
-            product_list = '\n'.join([f"- {p['name']}" for p in products])
-            
-            # Create OpenAI client
-            client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
-            
-            # Get categorization from GPT
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": f"""You are a product categorization expert.
-                        Categorize each product into exactly one of these categories: {categories_str}
-                        
-                        Rules:
-                        1. Only use categories from the provided list
-                        2. Be consistent with similar products
-                        3. Return JSON with product indices and categories
-                        4. If unsure, use closest match
-                        
-                        Example response:
-                        {{
-                            "categorized_products": [
-                                {{"index": 0, "name": "Product Name", "category": "Category Name"}}
-                            ]
-                        }}"""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Categorize these products:\n{product_list}"
-                    }
-                ],
-                response_format={ "type": "json_object" }
+            valid_categories = set(category_names)
+
+            # Resolve names we have categorized before
+            memo = CategoryMemoService()
+            known = {
+                name: category for name, category in memo.lookup(p['name'] for p in products).items()
+                if category in valid_categories
+            }
+
+            # Unique unseen names, in invoice order
+            unseen = []
+            unseen_keys = set()
+            for product in products:
+                key = normalize_product_name(product['name'])
+                if key not in known and key not in unseen_keys:
+                    unseen_keys.add(key)
+                    unseen.append(product['name'])
+
+            self.logger.info(
+                f"Category memo resolved {len(products) - len(unseen)} of {len(products)} products, "
+                f"{len(unseen)} sent to GPT"
             )
-            
-            # Parse categorization
-            result = json.loads(response.choices[0].message.content)
-            categorized = result.get('categorized_products', [])
-            
+
+            if not unseen and products:
+                record_cache_hit(CATEGORIZATION_MODEL)
+            if unseen:
+                learned = self._request_categories(unseen, category_names)
+                learned = {
+                    name: category for name, category in learned.items()
+                    if category in valid_categories
+                }
+                memo.remember(learned)
+                known.update({normalize_product_name(name): category for name, category in learned.items()})
+
             # Map categories back to products
             categorized_products = []
-            for i, product in enumerate(products):
-                # Find category for this product
-                cat_info = next(
-                    (cat for cat in categorized if cat['index'] == i),
-                    {'category': 'Uncategorized'}
-                )
-                
-                # Add category to product
-                product['category_name'] = cat_info['category']
+            for product in products:
+                product['category_name'] = known.get(normalize_product_name(product['name']), 'Uncategorized')
                 categorized_products.append(product)
-            
+
             return categorized_products
-            
+
         except Exception as e:
             self.logger.error(f"Error categorizing products: {str(e)}")
             # Return products with default category
             return [dict(p, category_name='Uncategorized') for p in products]
 
+    def _request_categories(self, names, category_names):
+        """
+        Ask GPT to categorize product names; returns dict of name -> category
+        Names go out in chunks of CATEGORIZATION_CHUNK_SIZE, several at a time
+        """
+        size = max(1, current_app.config.get('CATEGORIZATION_CHUNK_SIZE', 40))
+        chunks = [names[start:start + size] for start in range(0, len(names), size)]
+        gateway = get_llm_gateway()
+        results = gateway.run(self._categorize_chunks(gateway, chunks, category_names))
+
+        categorized = {}
+        for result in results:
+            categorized.update(result)
+        missing = len(names) - len(categorized)
+        if missing:
+            self.logger.warning(f"{missing} of {len(names)} products could not be categorized")
+        return categorized
+
+    async def _categorize_chunks(self, gateway, chunks, category_names):
+        """Categorize all chunks, at most CATEGORIZATION_WORKERS at a time"""
+        semaphore = asyncio.Semaphore(current_app.config.get('CATEGORIZATION_WORKERS', 4))
+        attempts = max(1, current_app.config.get('CATEGORIZATION_CHUNK_ATTEMPTS', 3))
+        done = 0
+
+        async def categorize(number, chunk):
+            nonlocal done
+            async with semaphore:
+                result = await self._categorize_chunk(gateway, chunk, category_names, number, attempts)
+            done += 1
+            if self.progress:
+                self.progress.update(f"Categorized batch {done} of {len(chunks)}", fraction=done / len(chunks))
+            return result
+
+        return await asyncio.gather(*[
+            categorize(number, chunk) for number, chunk in enumerate(chunks, 1)
+        ])
+
+    async def _categorize_chunk(self, gateway, names, category_names, number, attempts):
+        """
+        Categorize one chunk; failed requests and names missing from the
+        answer are retried on their own. Whatever is still unanswered after
+        the last attempt is left out, so only those products end up Uncategorized
+        """
+        categorized = {}
+        pending = list(names)
+        for attempt in range(1, attempts + 1):
+            try:
+                categorized.update(await self._acategorize(gateway, pending, category_names))
+            except Exception as e:
+                self.logger.warning(
+                    f"Categorization batch {number} attempt {attempt}/{attempts} failed: {str(e)}"
+                )
+            pending = [name for name in pending if name not in categorized]
+            if not pending:
+                break
+        return categorized
+
+    async def _acategorize(self, gateway, names, category_names):
+        """One categorization request; returns dict of name -> category for the answered names"""
+        categories_str = ', '.join(category_names)
+
+        # Prepare product list for GPT; indices map answers back to names
+        product_list = '\n'.join([f"{i}. {name}" for i, name in enumerate(names)])
+
+        # Get categorization from GPT
+        response = await gateway.acreate(
+            'openai',
+            model=CATEGORIZATION_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"""You are a product categorization expert.
+                    Categorize each product into exactly one of these categories: {categories_str}
+                    
+                    Rules:
+                    1. Only use categories from the provided list
+                    2. Be consistent with similar products
+                    3. Return JSON with product indices and categories
+                    4. If unsure, use closest match
+                    
+                    Example response:
+                    {{
+                        "categorized_products": [
+                            {{"index": 0, "name": "Product Name", "category": "Category Name"}}
+                        ]
+                    }}"""
+                },
+                {
+                    "role": "user",
+                    "content": f"Categorize these products:\n{product_list}"
+                }
+            ],
+            response_format={ "type": "json_object" }
+        )
+
+        # Parse categorization
+        result = CATEGORIZATION.parse(response.choices[0].message.content)
+        categorized = {}
+        for cat in result.get('categorized_products', []):
+            if 0 <= cat['index'] < len(names):
+                categorized[names[cat['index']]] = cat['category']
+        return categorized
+
     def _save_products(self, invoice, products):
-        """Save categorized products to database"""
+        """
+        Save categorized products to database
+        Rows go out as one multi-row INSERT and the invoice's category
+        summary is built in the same pass; the caller commits.
+        Each line is also recorded as an InvoiceItem matched to the catalog.
+        """
         try:
-            # Clear existing temp products
-            TempProduct.query.filter_by(invoice_id=invoice.id).delete()
+            # Clear existing lines, temp products and the streamed preview rows
+            InvoiceItem.query.filter_by(invoice_id=invoice.id).delete(synchronize_session=False)
+            TempProduct.query.filter_by(invoice_id=invoice.id).delete(synchronize_session=False)
+            ExtractedProduct.query.filter_by(invoice_id=invoice.id).delete(synchronize_session=False)
             
-            # Save new temp products with categories
-            for product in products:
-                temp_product = TempProduct(
-                    invoice_id=invoice.id,
-                    name=product['name'],
-                    quantity=product['quantity'],
-                    cost_price=product['price'],
-                    category_name=product['category_name']
-                )
-                db.session.add(temp_product)
+            rows = [{
+                'invoice_id': invoice.id,
+                'name': product['name'],
+                'quantity': product['quantity'],
+                'cost_price': product['price'],
+                'category_name': product['category_name']
+            } for product in products]
 
-            db.session.commit()
+            if rows:
+                temp_ids = db.session.scalars(
+                    db.insert(TempProduct).returning(TempProduct.id, sort_by_parameter_order=True),
+                    rows
+                ).all()
+                self._save_invoice_items(invoice, products, temp_ids)
+            invoice.apply_category_summary(
+                (row['category_name'], row['cost_price'], None) for row in rows
+            )
 
         except Exception as e:
             self.logger.error(f"Error saving products: {str(e)}")
             db.session.rollback()
             raise
 
+    def _save_invoice_items(self, invoice, products, temp_ids):
+        """Record each line as an InvoiceItem linked to its best catalog match"""
+        matches = ProductMatcher().match_lines(products)
+        items = []
+        for product, temp_id, match in zip(products, temp_ids, matches):
+            notes = None
+            if match['status'] == 'unmatched' and match['candidate_id']:
+                notes = f"Closest catalog product {match['candidate_id']} below match threshold"
+            items.append({
+                'invoice_id': invoice.id,
+                'temp_product_id': temp_id,
+                'product_id': match['product_id'],
+                'raw_product_name': product['name'][:200],
+                'raw_quantity': product['quantity'],
+                'raw_unit_price': product['price'],
+                'raw_total': product['quantity'] * product['price'],
+                'quantity': product['quantity'],
+                'unit_price': product['price'],
+                'total': product['quantity'] * product['price'],
+                'status': match['status'],
+                'confidence_score': match['confidence'],
+                'matching_notes': notes
+            })
+        db.session.execute(db.insert(InvoiceItem), items)
+
+@register_job_handler('process_invoice')
+def run_invoice_job(job, queue):
+    """Queue entry point for invoice processing jobs"""
+    EnhancedInvoiceProcessor().run_job(job, queue)
+
 # Alias for backwards compatibility
 InvoiceProcessor = EnhancedInvoiceProcessor
@@ -0,0 +1,358 @@
+# app/services/job_queue.py
+import os
+import socket
+import threading
+import click
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import aliased
+from app.extensions import db
+from app.models import Invoice, ProcessingJob, ProcessingProgress
+
+# job_type -> callable(job, queue), filled in by register_job_handler
+JOB_HANDLERS = {}
+
+def register_job_handler(job_type):
+    """Register a function that runs jobs of the given type"""
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+class JobQueue:
+    """Database-backed job queue; the processing_job table is the broker"""
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.max_attempts = current_app.config.get('INVOICE_JOB_MAX_ATTEMPTS', 3)
+        self.lease_seconds = current_app.config.get('INVOICE_JOB_LEASE_SECONDS', 300)
+        self.retry_delay = current_app.config.get('INVOICE_JOB_RETRY_DELAY', 15)
+        self.batch_concurrency = current_app.config.get('INVOICE_BATCH_CONCURRENCY', 2)
+
+    def enqueue(self, invoice_id, payload=None, job_type='process_invoice', stage=None, max_attempts=None):
+        """Add a job to the queue; the caller commits"""
+        job = ProcessingJob(
+            invoice_id=invoice_id,
+            job_type=job_type,
+            stage=stage,
+            status='queued',
+            payload=payload or {},
+            attempts=0,
+            max_attempts=max_attempts or self.max_attempts,
+            run_after=datetime.utcnow()
+        )
+        db.session.add(job)
+        if invoice_id:
+            self.logger.info(f"Queued {job_type} job for invoice {invoice_id}")
+        else:
+            self.logger.info(f"Queued {job_type} job")
+        return job
+
+    def _claimable(self, now):
+        """
+        Queued jobs that are due, plus running jobs whose worker lease expired,
+        skipping batches that already have batch_concurrency invoices processing
+        """
+        stale = now - timedelta(seconds=self.lease_seconds)
+        claimable = or_(
+            and_(ProcessingJob.status == 'queued', ProcessingJob.run_after <= now),
+            and_(ProcessingJob.status == 'running', ProcessingJob.locked_at < stale,
+                 ProcessingJob.attempts < ProcessingJob.max_attempts)
+        )
+        if not self.batch_concurrency:
+            return claimable
+        return and_(claimable, self._batch_has_capacity(stale))
+
+    def _batch_has_capacity(self, stale):
+        """
+        The job is not an invoice processing job of a batch, or its batch
+        has a free processing slot
+        """
+        running_job = aliased(ProcessingJob)
+        running_invoice = aliased(Invoice)
+        batch_id = select(Invoice.batch_id).where(
+            Invoice.id == ProcessingJob.invoice_id
+        ).scalar_subquery()
+        running = select(func.count(running_job.id)).join(
+            running_invoice, running_invoice.id == running_job.invoice_id
+        ).where(
+            running_invoice.batch_id == batch_id,
+            running_job.job_type == 'process_invoice',
+            running_job.status == 'running',
+            running_job.locked_at >= stale
+        ).scalar_subquery()
+        return or_(
+            ProcessingJob.job_type != 'process_invoice',
+            batch_id.is_(None),
+            running < self.batch_concurrency
+        )
+
+    def claim(self, worker_id):
+        """
+        Claim the next due job for this worker
+        Returns the locked ProcessingJob or None when the queue is empty
+        """
+        try:
+            self.fail_expired()
+            now = datetime.utcnow()
+            candidate = db.session.query(ProcessingJob.id).filter(
+                self._claimable(now)
+            ).order_by(
+                ProcessingJob.run_after, ProcessingJob.id
+            ).with_for_update(skip_locked=True).first()
+
+            if not candidate:
+                db.session.rollback()
+                return None
+
+            # Conditional update so two workers can never claim the same row,
+            # even on backends that ignore FOR UPDATE SKIP LOCKED
+            result = db.session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.id == candidate.id, self._claimable(now))
+                .values(
+                    status='running',
+                    locked_by=worker_id,
+                    locked_at=now,
+                    attempts=ProcessingJob.attempts + 1,
+                    updated_at=now
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+
+            if result.rowcount != 1:
+                return None
+            return db.session.get(ProcessingJob, candidate.id)
+
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error(f"Error claiming job: {str(e)}")
+            return None
+
+    def fail_expired(self):
+        """
+        Fail running jobs whose worker lease expired on their last allowed
+        attempt; they can no longer be reclaimed and would stay running
+        """
+        stale = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        expired = db.session.query(ProcessingJob.id).filter(
+            ProcessingJob.status == 'running',
+            ProcessingJob.locked_at < stale,
+            ProcessingJob.attempts >= ProcessingJob.max_attempts
+        ).all()
+        for (job_id,) in expired:
+            job = db.session.get(ProcessingJob, job_id)
+            self.fail(job, f"Worker stopped responding during attempt {job.attempts}")
+        return len(expired)
+
+    def renew_lease(self, job_id, worker_id):
+        """
+        Extend a running job's lease; returns False when the worker no
+        longer holds it, e.g. after the job was reclaimed or failed
+        """
+        result = db.session.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, ProcessingJob.status == 'running',
+                   ProcessingJob.locked_by == worker_id)
+            .values(locked_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def checkpoint(self, job, next_stage, payload):
+        """Persist stage output so a restarted job resumes from next_stage"""
+        job.stage = next_stage
+        job.payload = payload
+        job.locked_at = datetime.utcnow()
+        db.session.commit()
+
+    def complete(self, job):
+        """Mark job as finished"""
+        job.status = 'completed'
+        job.stage = None
+        job.locked_by = None
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+        self.logger.info(f"Job {job.id} for invoice {job.invoice_id} completed")
+
+    def fail(self, job, error):
+        """
+        Record a failed attempt
+        Reschedules with exponential backoff until max_attempts is reached,
+        then marks the job, and for processing jobs its invoice, as failed
+        """
+        db.session.rollback()
+        job = db.session.get(ProcessingJob, job.id)
+        job.error_message = str(error)
+        job.locked_by = None
+        progress = None
+        if job.job_type == 'process_invoice':
+            progress = ProcessingProgress.query.filter_by(invoice_id=job.invoice_id).first()
+
+        if job.attempts < job.max_attempts:
+            delay = self.retry_delay * (2 ** (job.attempts - 1))
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+            if progress:
+                progress.detailed_status = f"Attempt {job.attempts} failed, retrying in {delay}s: {error}"
+            self.logger.warning(f"Job {job.id} attempt {job.attempts} failed, retrying in {delay}s: {error}")
+        else:
+            job.status = 'failed'
+            if job.job_type == 'process_invoice':
+                job.invoice.update_status('failed', str(error))
+            if progress:
+                progress.error_message = str(error)
+                progress.detailed_status = f"Processing failed: {error}"
+            self.logger.error(f"Job {job.id} failed after {job.attempts} attempts: {error}")
+
+        db.session.commit()
+        return job.status == 'queued'
+
+    def latest_job(self, invoice_id, job_type='process_invoice'):
+        """Most recent job of a type for an invoice"""
+        return ProcessingJob.query.filter_by(
+            invoice_id=invoice_id, job_type=job_type
+        ).order_by(ProcessingJob.id.desc()).first()
+
+class LeaseHeartbeat:
+    """
+    Renew a job's lease from a background thread while its handler runs,
+    so a long stage is not mistaken for a dead worker and run twice
+    """
+
+    def __init__(self, app, job_id, worker_id, interval):
+        self.app = app
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    if not JobQueue().renew_lease(self.job_id, self.worker_id):
+                        self.app.logger.warning(f"Worker {self.worker_id} lost the lease on job {self.job_id}")
+                        return
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Error renewing lease on job {self.job_id}: {str(e)}")
+                finally:
+                    db.session.remove()
+
+class WorkerPool:
+    """Local pool of threads that poll the queue and run jobs"""
+
+    def __init__(self, app, size=None, poll_interval=None):
+        self.app = app
+        self.size = size if size is not None else app.config.get('INVOICE_WORKERS', 2)
+        self.poll_interval = poll_interval or app.config.get('INVOICE_JOB_POLL_INTERVAL', 2)
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """Start worker threads"""
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.size):
+            thread = threading.Thread(
+                target=self._run,
+                args=(f"{prefix}:{i}",),
+                name=f"invoice-worker-{i}",
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        self.app.logger.info(f"Started {self.size} invoice workers")
+
+    def stop(self, timeout=None):
+        """Signal workers to exit and wait for them"""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self, worker_id):
+        while not self.stop_event.is_set():
+            try:
+                if not self.run_once(worker_id):
+                    self.stop_event.wait(self.poll_interval)
+            except Exception as e:
+                self.app.logger.error(f"Worker {worker_id} error: {str(e)}")
+                self.stop_event.wait(self.poll_interval)
+
+    def run_once(self, worker_id):
+        """Claim and run a single job; returns False when the queue was empty"""
+        with self.app.app_context():
+            try:
+                queue = JobQueue()
+                job = queue.claim(worker_id)
+                if not job:
+                    return False
+
+                handler = JOB_HANDLERS.get(job.job_type)
+                if not handler:
+                    queue.fail(job, f"No handler for job type {job.job_type}")
+                    return True
+
+                try:
+                    # Renew well before the lease runs out
+                    with LeaseHeartbeat(self.app, job.id, worker_id, queue.lease_seconds / 3):
+                        handler(job, queue)
+                    queue.complete(job)
+                except Exception as e:
+                    queue.fail(job, e)
+                return True
+            finally:
+                db.session.remove()
+
+def _load_handlers():
+    # Handlers register themselves on import
+    import app.services.invoice_processor  # noqa: F401
+    import app.services.blob_replication  # noqa: F401
+    import app.services.label_sheets  # noqa: F401
+
+@click.command('invoice-worker')
+@click.option('--workers', default=None, type=int, help='Number of worker threads')
+@with_appcontext
+def invoice_worker_command(workers):
+    """Run invoice processing workers in the foreground."""
+    _load_handlers()
+    pool = current_app.extensions.get('invoice_worker_pool')
+    if pool is None or workers is not None:
+        if pool is not None:
+            pool.stop()
+        pool = WorkerPool(current_app._get_current_object(), size=workers)
+        pool.start()
+    click.echo(f'Running {pool.size} invoice workers, press Ctrl+C to stop')
+    try:
+        while True:
+            pool.stop_event.wait(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=30)
+
+def init_app(app):
+    app.cli.add_command(invoice_worker_command)
+
+    # Workers normally run in their own process (flask invoice-worker).
+    # Embedded workers never start for CLI commands such as flask db
+    # upgrade, which may run before the processing_job table exists
+    if (app.testing or not app.config.get('INVOICE_WORKERS_EMBEDDED')
+            or not app.config.get('INVOICE_WORKERS') or click.get_current_context(silent=True)):
+        return
+
+    _load_handlers()
+    pool = WorkerPool(app)
+    pool.start()
+    app.extensions['invoice_worker_pool'] = pool
@@ -0,0 +1,254 @@
+# app/services/label_sheets.py
+import hashlib
+import json
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select
+from app.extensions import db
+from app.models import Invoice, LabelSheet, TempProduct
+from app.services.blob_store import BlobStore
+from app.services.job_queue import JobQueue, register_job_handler
+
+# Multi-up layouts on US Letter, in points: label grid, page margins,
+# gaps between labels and font sizes
+LABEL_TEMPLATES = {
+    # 30 labels of 2.625" x 1", the common address-label sheet
+    'shelf': {'columns': 3, 'rows': 10, 'margin': (13.5, 36), 'gap': (9, 0),
+              'name_size': 7.5, 'price_size': 20, 'footer_size': 5.5},
+    # 8 large labels for promotions and end caps
+    'large': {'columns': 2, 'rows': 4, 'margin': (36, 36), 'gap': (18, 18),
+              'name_size': 14, 'price_size': 48, 'footer_size': 9}
+}
+PAGE_SIZE = (612, 792)
+LAYOUT_VERSION = 1  # Bump when the drawing code changes, so cached sheets are redrawn
+
+class LabelSheetService:
+    """
+    Printable price-tag sheets for whole categories of an invoice
+
+    Each (invoice, category, template) gets one multi-up PDF, rendered by a
+    'render_labels' job and kept in the blob store. A sheet remembers a hash
+    of the labels it was drawn from, so asking again is instant while the
+    prices are unchanged and queues a redraw once they are not.
+    """
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.default_template = current_app.config.get('LABEL_DEFAULT_TEMPLATE', 'shelf')
+
+    def _template(self, template):
+        template = template or self.default_template
+        if template not in LABEL_TEMPLATES:
+            raise ValueError(f"Unknown label template: {template}")
+        return template
+
+    # ----- Label data -----
+
+    def labels(self, invoice_id):
+        """Priced products of an invoice grouped by category, in shelf order"""
+        invoice_date = db.session.execute(
+            select(Invoice.processed_date).where(Invoice.id == invoice_id)
+        ).scalar()
+        rows = db.session.execute(
+            select(TempProduct.category_name, TempProduct.name, TempProduct.selling_price)
+            .where(TempProduct.invoice_id == invoice_id, TempProduct.selling_price.isnot(None))
+            .order_by(TempProduct.category_name, TempProduct.name, TempProduct.id)
+        ).all()
+
+        footer_date = (invoice_date or datetime.utcnow()).strftime('%m/%d/%y')
+        groups = defaultdict(list)
+        for category_name, name, price in rows:
+            groups[category_name or ''].append({
+                'name': name,
+                'price': f"${price:.2f}",
+                'footer': f"{category_name or 'Uncategorized'}  {footer_date}"
+            })
+        return groups
+
+    @staticmethod
+    def content_hash(labels, template):
+        payload = json.dumps([LAYOUT_VERSION, template, labels], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # ----- Requests -----
+
+    def request_sheets(self, invoice_id, template=None, categories=None):
+        """
+        Make sure sheets for the invoice's categories are ready or queued
+        Sheets whose labels are unchanged are reused as they are; the rest
+        are queued together in one render job. Returns the sheets; the
+        caller commits
+        """
+        template = self._template(template)
+        groups = self.labels(invoice_id)
+        if categories is not None:
+            wanted = {category or '' for category in categories}
+            groups = {name: labels for name, labels in groups.items() if name in wanted}
+
+        existing = {
+            sheet.category_name: sheet for sheet in LabelSheet.query.filter_by(
+                invoice_id=invoice_id, template=template
+            )
+        }
+        store = BlobStore()
+        sheets, stale = [], []
+        for category_name, labels in sorted(groups.items()):
+            digest = self.content_hash(labels, template)
+            sheet = existing.get(category_name)
+            if sheet is None:
+                sheet = LabelSheet(invoice_id=invoice_id, category_name=category_name, template=template)
+                db.session.add(sheet)
+            sheets.append(sheet)
+
+            if sheet.content_hash == digest and (
+                sheet.status == 'queued' or (sheet.status == 'ready' and store.exists(sheet.blob_key))
+            ):
+                continue
+            sheet.content_hash = digest
+            sheet.status = 'queued'
+            sheet.label_count = len(labels)
+            sheet.error_message = None
+            stale.append(category_name)
+
+        # Categories with no priced products left have nothing to print
+        for category_name, sheet in existing.items():
+            if category_name not in groups and (categories is None or category_name in wanted):
+                db.session.delete(sheet)
+
+        if stale:
+            JobQueue().enqueue(invoice_id, {
+                'template': template,
+                'categories': stale
+            }, job_type='render_labels')
+        return sheets
+
+    def sheets(self, invoice_id, template=None):
+        """Current sheets of an invoice for a template"""
+        return LabelSheet.query.filter_by(
+            invoice_id=invoice_id, template=self._template(template)
+        ).order_by(LabelSheet.category_name).all()
+
+    # ----- Rendering -----
+
+    def render_job(self, job):
+        """Render the sheets a job was queued for, committing each as it is stored"""
+        payload = job.payload or {}
+        template = self._template(payload.get('template'))
+        groups = self.labels(job.invoice_id)
+        store = BlobStore()
+
+        for category_name in payload.get('categories', []):
+            sheet = LabelSheet.query.filter_by(
+                invoice_id=job.invoice_id, category_name=category_name, template=template
+            ).first()
+            if sheet is None:
+                continue
+            # Prices may have changed since the job was queued; draw what is current
+            labels = groups.get(category_name, [])
+            if not labels:
+                # Nothing left to print in this category
+                db.session.delete(sheet)
+                db.session.commit()
+                continue
+            try:
+                pdf, pages = self.render_pdf(labels, template)
+                sheet.blob_key = store.put_bytes(pdf)
+                sheet.content_hash = self.content_hash(labels, template)
+                sheet.status = 'ready'
+                sheet.label_count = len(labels)
+                sheet.page_count = pages
+                sheet.rendered_at = datetime.utcnow()
+            except Exception as e:
+                self.logger.error(f"Error rendering {category_name or 'uncategorized'} labels "
+                                  f"for invoice {job.invoice_id}: {str(e)}")
+                sheet.status = 'failed'
+                sheet.error_message = str(e)
+            db.session.commit()
+
+    def render_pdf(self, labels, template):
+        """Draw labels onto multi-up pages; returns (PDF bytes, page count)"""
+        if not labels:
+            raise ValueError("No labels to render")
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            raise RuntimeError("PyMuPDF is required to render label sheets")
+
+        layout = LABEL_TEMPLATES[template]
+        columns, rows = layout['columns'], layout['rows']
+        margin_x, margin_y = layout['margin']
+        gap_x, gap_y = layout['gap']
+        width = (PAGE_SIZE[0] - 2 * margin_x - (columns - 1) * gap_x) / columns
+        height = (PAGE_SIZE[1] - 2 * margin_y - (rows - 1) * gap_y) / rows
+        per_page = columns * rows
+
+        document = fitz.open()
+        for index, label in enumerate(labels):
+            if index % per_page == 0:
+                page = document.new_page(width=PAGE_SIZE[0], height=PAGE_SIZE[1])
+            row, column = divmod(index % per_page, columns)
+            x = margin_x + column * (width + gap_x)
+            y = margin_y + row * (height + gap_y)
+            self._draw_label(fitz, page, fitz.Rect(x, y, x + width, y + height), label, layout)
+
+        pages = document.page_count
+        pdf = document.tobytes(garbage=3, deflate=True)
+        document.close()
+        return pdf, pages
+
+    def _draw_label(self, fitz, page, rect, label, layout):
+        pad = max(3, rect.height * 0.06)
+        inner = fitz.Rect(rect.x0 + pad, rect.y0 + pad, rect.x1 - pad, rect.y1 - pad)
+        page.draw_rect(rect, color=(0.8, 0.8, 0.8), width=0.3)
+
+        # Product name on up to two lines, shrunk until it fits
+        name_box = fitz.Rect(inner.x0, inner.y0, inner.x1, inner.y0 + inner.height * 0.36)
+        size = layout['name_size']
+        while page.insert_textbox(name_box, label['name'], fontsize=size, fontname='helv',
+                                  align=fitz.TEXT_ALIGN_CENTER) < 0 and size > 4:
+            size -= 0.5
+
+        # Price, as large as the label allows
+        price_size = layout['price_size']
+        price_width = fitz.get_text_length(label['price'], fontname='hebo', fontsize=price_size)
+        if price_width > inner.width:
+            price_size *= inner.width / price_width
+        price_box = fitz.Rect(inner.x0, inner.y0 + inner.height * 0.36, inner.x1,
+                              inner.y1 - layout['footer_size'] * 1.2)
+        baseline = price_box.y0 + (price_box.height + price_size * 0.7) / 2
+        page.insert_text(
+            (inner.x0 + (inner.width - fitz.get_text_length(label['price'], 'hebo', price_size)) / 2, baseline),
+            label['price'], fontname='hebo', fontsize=price_size
+        )
+
+        page.insert_text((inner.x0, inner.y1 - 1), label['footer'], fontname='helv',
+                         fontsize=layout['footer_size'], color=(0.35, 0.35, 0.35))
+
+    def combined_pdf(self, invoice_id, template=None):
+        """All ready sheets of an invoice as one PDF, for printing in one go; None if none are ready"""
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            raise RuntimeError("PyMuPDF is required to combine label sheets")
+
+        store = BlobStore()
+        ready = [sheet for sheet in self.sheets(invoice_id, template)
+                 if sheet.status == 'ready' and store.exists(sheet.blob_key)]
+        if not ready:
+            return None
+        if len(ready) == 1:
+            return store.read(ready[0].blob_key)
+
+        combined = fitz.open()
+        for sheet in ready:
+            with fitz.open(store.path(sheet.blob_key)) as document:
+                combined.insert_pdf(document)
+        pdf = combined.tobytes(garbage=3, deflate=True)
+        combined.close()
+        return pdf
+
+@register_job_handler('render_labels')
+def run_label_job(job, queue):
+    """Queue entry point for label sheet rendering jobs"""
+    LabelSheetService().render_job(job)
@@ -0,0 +1,331 @@
+# app/services/llm_gateway.py
+import asyncio
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from app.services.llm_usage import bind_trace, current_trace, track_llm_usage, usage_tokens
+
+# Status codes worth retrying
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = ('APIConnectionError', 'APITimeoutError')
+
+# Rate-limit headers per provider: (remaining requests, reset)
+RATE_LIMIT_HEADERS = {
+    'openai': ('x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'),
+    'anthropic': ('anthropic-ratelimit-requests-remaining', 'anthropic-ratelimit-requests-reset')
+}
+
+def _parse_duration(value):
+    """Parse OpenAI-style reset durations like '1s', '250ms' or '6m0s' into seconds"""
+    total = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|s|m|h)', value or ''):
+        total += float(amount) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total
+
+def _parse_reset(value):
+    """Seconds until a rate-limit window resets, from a duration or an RFC 3339 timestamp"""
+    if not value:
+        return 0.0
+    try:
+        reset_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        return _parse_duration(value)
+
+def _delta_text(provider, chunk):
+    """Text carried by one streamed chunk/event"""
+    if provider == 'openai':
+        return (chunk.choices[0].delta.content or '') if chunk.choices else ''
+    if getattr(chunk, 'type', None) == 'content_block_delta':
+        return getattr(chunk.delta, 'text', '') or ''
+    return ''
+
+def _chunk_usage(provider, chunk):
+    """(prompt, completion) tokens reported by a streamed chunk/event, None where absent"""
+    if provider == 'openai':
+        usage = getattr(chunk, 'usage', None)
+        return usage_tokens(provider, usage) if usage else (None, None)
+    kind = getattr(chunk, 'type', None)
+    if kind == 'message_start':
+        return usage_tokens(provider, chunk.message.usage)[0], None
+    if kind == 'message_delta':
+        return None, usage_tokens(provider, chunk.usage)[1]
+    return None, None
+
+class LLMGateway:
+    """
+    Application-wide entry point for OpenAI and Anthropic calls
+
+    Owns one pooled async client per provider on a dedicated event loop
+    thread, limits concurrent requests per provider, retries transient
+    failures with exponential backoff and pauses a provider when its
+    rate-limit headers say the window is exhausted.
+    """
+
+    def __init__(self, app):
+        self.logger = app.logger
+        self.config = app.config
+        self.max_retries = app.config.get('LLM_MAX_RETRIES', 3)
+        self.backoff_base = app.config.get('LLM_BACKOFF_BASE', 1.0)
+        self.timeout = app.config.get('LLM_TIMEOUT', 120)
+        self.max_connections = app.config.get('LLM_MAX_CONNECTIONS', 20)
+        self.concurrency = {
+            'openai': app.config.get('LLM_OPENAI_CONCURRENCY', 8),
+            'anthropic': app.config.get('LLM_ANTHROPIC_CONCURRENCY', 4)
+        }
+        self.backend = app.config.get('LLM_BACKEND', 'live')
+        if self.backend not in ('live', 'replay', 'record'):
+            raise ValueError(f"Unknown LLM_BACKEND: {self.backend}")
+        if self.backend != 'live':
+            self.logger.info(f"LLM gateway using the {self.backend} backend")
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._clients = {}
+        self._semaphores = {}
+        self._paused_until = {}
+
+    # ----- Event loop -----
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name='llm-gateway',
+                    daemon=True
+                )
+                self._thread.start()
+        return self._loop
+
+    def submit(self, coroutine):
+        """
+        Start a coroutine on the gateway loop; returns a concurrent.futures.Future
+        Calls it makes are recorded to the caller's usage trace
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(bind_trace(coroutine), loop)
+
+    def run(self, coroutine):
+        """Run a coroutine on the gateway loop and wait for its result"""
+        with track_llm_usage():
+            return self.submit(coroutine).result()
+
+    # ----- Clients -----
+
+    def _transport(self):
+        """httpx transport for the configured backend (live network, replay or record)"""
+        import httpx
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
+        )
+        if self.backend == 'replay':
+            from app.services.llm_replay import ReplayTransport
+            return ReplayTransport(
+                recordings_dir=self.config.get('LLM_RECORDINGS_DIR'),
+                latency=self.config.get('LLM_REPLAY_LATENCY', 0),
+                error_rate=self.config.get('LLM_REPLAY_ERROR_RATE', 0),
+                products_per_page=self.config.get('LLM_REPLAY_PRODUCTS', 40)
+            )
+        if self.backend == 'record':
+            from app.services.llm_replay import RecordingTransport
+            return RecordingTransport(
+                self.config.get('LLM_RECORDINGS_DIR'),
+                inner=httpx.AsyncHTTPTransport(limits=limits)
+            )
+        return httpx.AsyncHTTPTransport(limits=limits)
+
+    def _api_key(self, name):
+        # The SDKs refuse to start without a key, which replay never sends anywhere
+        return self.config.get(name) or ('replay' if self.backend == 'replay' else None)
+
+    def _client(self, provider):
+        """Pooled async client for a provider; created on the gateway loop"""
+        if provider in self._clients:
+            return self._clients[provider]
+
+        import httpx
+        http_client = httpx.AsyncClient(transport=self._transport(), timeout=self.timeout)
+
+        if provider == 'openai':
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(
+                api_key=self._api_key('OPENAI_API_KEY'),
+                http_client=http_client,
+                max_retries=0  # Retries are handled here
+            )
+        elif provider == 'anthropic':
+            from anthropic import AsyncAnthropic
+            client = AsyncAnthropic(
+                api_key=self._api_key('CLAUDE_API_KEY'),
+                http_client=http_client,
+                max_retries=0
+            )
+        else:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+
+        self._clients[provider] = client
+        self._semaphores[provider] = asyncio.Semaphore(self.concurrency.get(provider, 4))
+        return client
+
+    def _endpoint(self, provider):
+        client = self._client(provider)
+        if provider == 'openai':
+            return client.chat.completions.with_raw_response
+        return client.messages.with_raw_response
+
+    # ----- Rate limits and retries -----
+
+    def _pause(self, provider, seconds):
+        if seconds > 0:
+            until = time.monotonic() + seconds
+            self._paused_until[provider] = max(self._paused_until.get(provider, 0), until)
+
+    async def _wait_if_paused(self, provider):
+        delay = self._paused_until.get(provider, 0) - time.monotonic()
+        if delay > 0:
+            self.logger.info(f"{provider} rate limit reached, waiting {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _track_rate_limit(self, provider, headers):
+        remaining_header, reset_header = RATE_LIMIT_HEADERS[provider]
+        remaining = headers.get(remaining_header)
+        if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+            self._pause(provider, _parse_reset(headers.get(reset_header)))
+
+    def _is_retryable(self, error):
+        status = getattr(error, 'status_code', None)
+        return status in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+    def _retry_delay(self, error, attempt):
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff_base * (2 ** attempt) + random.uniform(0, self.backoff_base)
+
+    # ----- Usage accounting -----
+
+    def _record(self, provider, kwargs, started, retries, tokens=(0, 0), streamed=False, error=None):
+        trace = current_trace()
+        if trace is None:
+            return
+        trace.record(
+            provider,
+            kwargs.get('model'),
+            prompt_tokens=tokens[0],
+            completion_tokens=tokens[1],
+            latency=time.perf_counter() - started,
+            retries=retries,
+            streamed=streamed,
+            error=error
+        )
+
+    # ----- Public API -----
+
+    async def acreate(self, provider='openai', **kwargs):
+        """
+        Async chat completion (OpenAI) or message (Anthropic)
+        Accepts the provider SDK's create() arguments and returns its parsed response
+        """
+        endpoint = self._endpoint(provider)
+        semaphore = self._semaphores[provider]
+        started = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_if_paused(provider)
+            try:
+                async with semaphore:
+                    raw = await endpoint.create(**kwargs)
+                self._track_rate_limit(provider, raw.headers)
+                response = raw.parse()
+                self._record(provider, kwargs, started, attempt,
+                             tokens=usage_tokens(provider, getattr(response, 'usage', None)))
+                return response
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    self._record(provider, kwargs, started, attempt, error=e)
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if getattr(e, 'status_code', None) == 429:
+                    self._pause(provider, delay)
+                self.logger.warning(
+                    f"{provider} call failed ({type(e).__name__}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def astream(self, provider='openai', **kwargs):
+        """
+        Streaming completion; an async generator of text deltas
+        Failures are retried only until the first chunk has been yielded
+        """
+        endpoint = self._endpoint(provider)
+        semaphore = self._semaphores[provider]
+        request = dict(kwargs)
+        if provider == 'openai' and 'extra_body' not in request:
+            # Ask for a final chunk carrying token usage
+            request['extra_body'] = {'stream_options': {'include_usage': True}}
+        began = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_if_paused(provider)
+            started = False
+            tokens = [0, 0]
+            try:
+                async with semaphore:
+                    raw = await endpoint.create(stream=True, **request)
+                    self._track_rate_limit(provider, raw.headers)
+                    async for chunk in raw.parse():
+                        for index, count in enumerate(_chunk_usage(provider, chunk)):
+                            if count is not None:
+                                tokens[index] = count
+                        text = _delta_text(provider, chunk)
+                        if text:
+                            started = True
+                            yield text
+                self._record(provider, kwargs, began, attempt, tokens=tokens, streamed=True)
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not self._is_retryable(e):
+                    self._record(provider, kwargs, began, attempt, tokens=tokens, streamed=True, error=e)
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if getattr(e, 'status_code', None) == 429:
+                    self._pause(provider, delay)
+                self.logger.warning(
+                    f"{provider} stream failed ({type(e).__name__}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def acreate_many(self, provider, requests, return_exceptions=False):
+        """Run several create() calls concurrently; results keep request order"""
+        return await asyncio.gather(
+            *[self.acreate(provider, **kwargs) for kwargs in requests],
+            return_exceptions=return_exceptions
+        )
+
+    def create(self, provider='openai', **kwargs):
+        """Blocking wrapper around acreate() for Flask views and workers"""
+        return self.run(self.acreate(provider, **kwargs))
+
+    def create_many(self, provider, requests, return_exceptions=False):
+        """Blocking wrapper around acreate_many()"""
+        return self.run(self.acreate_many(provider, requests, return_exceptions))
+
+def init_app(app):
+    app.extensions['llm_gateway'] = LLMGateway(app)
+
+def get_llm_gateway():
+    """The gateway for the current application"""
+    return current_app.extensions['llm_gateway']
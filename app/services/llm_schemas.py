@@ -0,0 +1,200 @@
+# app/services/llm_schemas.py
+import threading
+from contextvars import ContextVar
+from typing import Annotated, Any, Dict, List, Optional
+from pydantic import BaseModel, BeforeValidator, Field, TypeAdapter, ValidationError, WrapValidator
+
+class LLMOutputError(ValueError):
+    """Model output that cannot be read as its schema"""
+
+# Process-wide validation counters per schema
+_stats_lock = threading.Lock()
+_stats = {}
+
+def _count(schema, **amounts):
+    with _stats_lock:
+        counters = _stats.setdefault(schema, {
+            'documents': 0, 'failed': 0, 'repaired': 0, 'repaired_fields': 0, 'dropped_items': 0
+        })
+        for name, amount in amounts.items():
+            counters[name] += amount
+
+def schema_stats():
+    """Validation counters for this process, with each schema's failure rate"""
+    with _stats_lock:
+        stats = {name: dict(counters) for name, counters in _stats.items()}
+    for counters in stats.values():
+        documents = counters['documents']
+        counters['failure_rate'] = round(counters['failed'] / documents, 3) if documents else None
+    return stats
+
+# ----- Field repairs -----
+
+# Fields repaired while validating the current document, as a one-item list
+_field_repairs = ContextVar('field_repairs', default=None)
+
+def _repaired():
+    counter = _field_repairs.get()
+    if counter is not None:
+        counter[0] += 1
+
+def _text(value):
+    if value is None or not isinstance(value, str):
+        _repaired()
+    return '' if value is None else str(value).strip()
+
+def _number(value):
+    """Numbers as models write them: '5.99', '$1,299.00', '35%', 12"""
+    if isinstance(value, str):
+        _repaired()
+        for symbol in ('$', '%', ',', '\u00a0', ' '):
+            value = value.replace(symbol, '')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"not a number: {value!r}")
+
+def _quantity(value):
+    if value in (None, ''):
+        _repaired()
+        return 1
+    number = _number(value)
+    quantity = max(1, int(number))
+    if quantity != number and not isinstance(value, str):
+        _repaired()
+    return quantity
+
+def _price(value):
+    if value in (None, ''):
+        _repaired()
+        return 0.0
+    number = _number(value)
+    if number < 0 and not isinstance(value, str):
+        _repaired()
+    return max(0.0, number)
+
+def _string_list(value):
+    if value is None or isinstance(value, str):
+        _repaired()
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else value
+
+def _or_none(value, handler):
+    # A bad item becomes None and is dropped, instead of failing the whole document
+    try:
+        return handler(value)
+    except ValidationError:
+        return None
+
+def Lenient(item_type):
+    """Item type for lists and dicts whose invalid entries should be dropped"""
+    return Annotated[Optional[item_type], WrapValidator(_or_none)]
+
+# ----- Response schemas -----
+
+class ProductLine(BaseModel):
+    name: Annotated[str, BeforeValidator(_text)] = ''
+    quantity: Annotated[int, BeforeValidator(_quantity)] = 1
+    price: Annotated[float, BeforeValidator(_price)] = 0.0
+
+class ExtractionResponse(BaseModel):
+    products: List[Lenient(ProductLine)] = []
+
+class CategoryAssignment(BaseModel):
+    index: int
+    name: Optional[str] = None
+    category: Annotated[str, BeforeValidator(_text), Field(min_length=1)]
+
+class CategorizationResponse(BaseModel):
+    categorized_products: List[Lenient(CategoryAssignment)] = []
+
+class MarginAdvice(BaseModel):
+    suggested_margin: Annotated[float, BeforeValidator(_number), Field(ge=0, le=100)]
+    reasoning: Annotated[List[str], BeforeValidator(_string_list)] = []
+    confidence: Annotated[float, BeforeValidator(_number)] = 0.0
+    risk_level: str = 'medium'
+
+class MarginResponse(BaseModel):
+    margins: Dict[str, Lenient(MarginAdvice)]
+    market_summary: Optional[Dict[str, Any]] = None
+
+class LLMSchema:
+    """
+    A compiled validator for one kind of LLM JSON response
+
+    parse() reads the raw response text in a single pydantic-core pass:
+    JSON decoding, type coercion, field repairs and dropping of invalid
+    list/dict entries all happen there, and the result comes back as
+    plain dicts and lists.
+    """
+
+    def __init__(self, name, schema):
+        self.name = name
+        self.adapter = TypeAdapter(schema)
+
+    def parse(self, content):
+        text = (content or '').strip()
+        unwrapped = _unwrap(text)
+        value, fields = self._run(self.adapter.validate_json, unwrapped, 'response')
+        _count(self.name, documents=1, repaired=int(unwrapped != text or fields > 0),
+               repaired_fields=fields, dropped_items=_drop_invalid(value))
+        return self.adapter.dump_python(value)
+
+    def validate(self, data):
+        """Validate already decoded data, e.g. an object pulled from a stream"""
+        value, fields = self._run(self.adapter.validate_python, data, 'data')
+        _count(self.name, documents=1, repaired=int(fields > 0),
+               repaired_fields=fields, dropped_items=_drop_invalid(value))
+        return self.adapter.dump_python(value)
+
+    def _run(self, validator, data, kind):
+        """Validate data; returns the value and how many fields were repaired"""
+        counter = [0]
+        token = _field_repairs.set(counter)
+        try:
+            return validator(data), counter[0]
+        except ValidationError as e:
+            _count(self.name, documents=1, failed=1)
+            raise LLMOutputError(
+                f"{self.name} {kind} does not match its schema: {_summarize(e)}"
+            ) from e
+        finally:
+            _field_repairs.reset(token)
+
+def _unwrap(text):
+    """Strip markdown code fences and any prose around the JSON object"""
+    if text.startswith('{') and text.endswith('}'):
+        return text
+    text = text.replace('```json', '').replace('```', '').strip()
+    start, end = text.find('{'), text.rfind('}')
+    return text[start:end + 1] if 0 <= start < end else text
+
+def _summarize(error):
+    first = error.errors()[0]
+    location = '.'.join(str(part) for part in first['loc']) or 'response'
+    return f"{error.error_count()} error(s), first at {location}: {first['msg']}"
+
+def _drop_invalid(value):
+    """Remove the None entries lenient items left behind; returns how many"""
+    if not isinstance(value, BaseModel):
+        return 0
+    dropped = 0
+    for name in type(value).model_fields:
+        field = getattr(value, name)
+        if isinstance(field, list) and None in field:
+            kept = [item for item in field if item is not None]
+            dropped += len(field) - len(kept)
+            setattr(value, name, kept)
+        elif isinstance(field, dict) and None in field.values():
+            kept = {key: item for key, item in field.items() if item is not None}
+            dropped += len(field) - len(kept)
+            setattr(value, name, kept)
+    return dropped
+
+EXTRACTION = LLMSchema('extraction', ExtractionResponse)
+PRODUCT_LINE = LLMSchema('extraction_stream', ProductLine)
+CATEGORIZATION = LLMSchema('categorization', CategorizationResponse)
+MARGINS = LLMSchema('margins', MarginResponse)
+MARKET_INSIGHTS = LLMSchema('market_insights', Dict[str, Any])
+COMPETITIVE_ANALYSIS = LLMSchema('competitive_analysis', Dict[str, Any])
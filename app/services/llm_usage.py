@@ -0,0 +1,194 @@
+# app/services/llm_usage.py
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, desc, func, insert
+from app.extensions import db
+from app.models import Invoice, LLMCall, Wholesaler
+
+# USD per million (prompt, completion) tokens; the longest matching model prefix wins
+MODEL_PRICES = {
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4-1106-preview': (10.00, 30.00),
+    'gpt-4-0125-preview': (10.00, 30.00),
+    'gpt-4-vision-preview': (10.00, 30.00),
+    'gpt-4o': (5.00, 15.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4': (30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'claude-3-opus': (15.00, 75.00),
+    'claude-3-5-sonnet': (3.00, 15.00),
+    'claude-3-sonnet': (3.00, 15.00),
+    'claude-3-haiku': (0.25, 1.25)
+}
+
+_current_trace = contextvars.ContextVar('llm_usage_trace', default=None)
+
+def model_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of a call; 0 for models without a known price"""
+    prefix = max((p for p in MODEL_PRICES if (model or '').startswith(p)), key=len, default=None)
+    if prefix is None:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[prefix]
+    return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1_000_000
+
+def usage_tokens(provider, usage):
+    """(prompt, completion) tokens from an SDK usage object or dict"""
+    if usage is None:
+        return 0, 0
+    get = usage.get if isinstance(usage, dict) else (lambda name: getattr(usage, name, None))
+    if provider == 'anthropic':
+        return get('input_tokens') or 0, get('output_tokens') or 0
+    return get('prompt_tokens') or 0, get('completion_tokens') or 0
+
+class UsageTrace:
+    """LLM calls made for one invoice and stage, written with one insert when the trace closes"""
+
+    def __init__(self, invoice_id=None, stage=None):
+        self.invoice_id = invoice_id
+        self.stage = stage
+        self.records = []
+
+    def record(self, provider, model, prompt_tokens=0, completion_tokens=0, latency=0.0,
+               retries=0, cached=False, streamed=False, error=None):
+        # Called from the gateway loop thread; list.append is atomic
+        self.records.append({
+            'invoice_id': self.invoice_id,
+            'stage': self.stage,
+            'provider': provider,
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': model_cost(model, prompt_tokens, completion_tokens),
+            'latency_ms': int(latency * 1000),
+            'retries': retries,
+            'cached': cached,
+            'streamed': streamed,
+            'status': 'error' if error else 'ok',
+            'error_message': str(error) if error else None,
+            'created_at': datetime.utcnow()
+        })
+
+    def flush(self):
+        """Write the recorded calls on their own connection, independent of the caller's transaction"""
+        records, self.records = self.records, []
+        if not records:
+            return
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(insert(LLMCall.__table__), records)
+        except Exception as e:
+            current_app.logger.error(f"Error recording LLM usage: {str(e)}")
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def track_llm_usage(invoice_id=None, stage=None):
+    """
+    Attribute LLM calls made inside the block, including those it submits
+    to the gateway loop, to an invoice and pipeline stage
+    Without arguments an enclosing trace is reused
+    """
+    parent = _current_trace.get()
+    if parent is not None and invoice_id is None and stage is None:
+        yield parent
+        return
+
+    trace = UsageTrace(
+        invoice_id if invoice_id is not None else getattr(parent, 'invoice_id', None),
+        stage or getattr(parent, 'stage', None)
+    )
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.flush()
+
+def bind_trace(coroutine):
+    """Run a coroutine under the caller's trace once it is scheduled on the gateway loop"""
+    trace = _current_trace.get()
+    if trace is None:
+        return coroutine
+
+    async def traced():
+        _current_trace.set(trace)
+        return await coroutine
+    return traced()
+
+def record_cache_hit(model, provider='openai'):
+    """Record a call that a cache answered instead of the model"""
+    with track_llm_usage() as trace:
+        trace.record(provider, model, cached=True)
+
+class LLMUsageReport:
+    """Cost and latency of recorded LLM calls, ranked by invoice, wholesaler and stage"""
+
+    def __init__(self, days=30):
+        self.logger = current_app.logger
+        self.days = days
+        self.since = datetime.utcnow() - timedelta(days=days)
+
+    def _totals(self):
+        return [
+            func.count(LLMCall.id).label('calls'),
+            func.sum(case((LLMCall.cached.is_(True), 1), else_=0)).label('cache_hits'),
+            func.sum(case((LLMCall.status == 'error', 1), else_=0)).label('errors'),
+            func.coalesce(func.sum(LLMCall.retries), 0).label('retries'),
+            func.coalesce(func.sum(LLMCall.prompt_tokens), 0).label('prompt_tokens'),
+            func.coalesce(func.sum(LLMCall.completion_tokens), 0).label('completion_tokens'),
+            func.coalesce(func.sum(LLMCall.cost), 0).label('cost'),
+            func.coalesce(func.sum(LLMCall.latency_ms), 0).label('latency_ms'),
+            func.coalesce(func.max(LLMCall.latency_ms), 0).label('max_latency_ms')
+        ]
+
+    def _ordering(self, order_by):
+        return desc('latency_ms' if order_by == 'latency' else 'cost')
+
+    def _rows(self, query):
+        return [dict(row._mapping) for row in query.all()]
+
+    def summary(self):
+        row = db.session.query(*self._totals()).filter(LLMCall.created_at >= self.since).one()
+        return dict(row._mapping)
+
+    def by_invoice(self, order_by='cost', limit=25):
+        return self._rows(db.session.query(
+            Invoice.id.label('invoice_id'),
+            Invoice.invoice_number,
+            Invoice.file_path,
+            Wholesaler.name.label('wholesaler'),
+            *self._totals()
+        ).join(
+            Invoice, Invoice.id == LLMCall.invoice_id
+        ).join(
+            Wholesaler, Wholesaler.id == Invoice.wholesaler_id
+        ).filter(
+            LLMCall.created_at >= self.since
+        ).group_by(
+            Invoice.id, Invoice.invoice_number, Invoice.file_path, Wholesaler.name
+        ).order_by(self._ordering(order_by)).limit(limit))
+
+    def by_wholesaler(self, order_by='cost'):
+        return self._rows(db.session.query(
+            Wholesaler.id.label('wholesaler_id'),
+            Wholesaler.name.label('wholesaler'),
+            func.count(func.distinct(Invoice.id)).label('invoices'),
+            *self._totals()
+        ).join(
+            Invoice, Invoice.id == LLMCall.invoice_id
+        ).join(
+            Wholesaler, Wholesaler.id == Invoice.wholesaler_id
+        ).filter(
+            LLMCall.created_at >= self.since
+        ).group_by(Wholesaler.id, Wholesaler.name).order_by(self._ordering(order_by)))
+
+    def by_stage(self, order_by='cost'):
+        return self._rows(db.session.query(
+            func.coalesce(LLMCall.stage, 'other').label('stage'),
+            *self._totals()
+        ).filter(
+            LLMCall.created_at >= self.since
+        ).group_by(func.coalesce(LLMCall.stage, 'other')).order_by(self._ordering(order_by)))
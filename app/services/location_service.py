@@ -43,7 +43,14 @@ def analyze_competition(location):
         }
 
 def get_market_insights(location, area_type):
-    """Get market insights combining demographics and competition"""
+    """Get market insights combining demographics and competition, cached per location"""
+    from app.services.market_insights_cache import MarketInsightsCache
+    return MarketInsightsCache('location_service', _compute_market_insights).get_or_load(
+        location, area_type
+    )
+
+def _compute_market_insights(location, area_type):
+    """Build market insights from demographics and competition data"""
     demographics = get_demographics(location)
     competition = analyze_competition(location)
     
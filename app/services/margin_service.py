@@ -1,19 +1,44 @@
 # app/services/margin_service.py
 
-from openai import OpenAI
 from flask import current_app
 from app.extensions import db
 from app.models import MarginSuggestion, Category, TempProduct
+from app.services.llm_gateway import get_llm_gateway
+from app.services.market_insights_cache import MarketInsightsCache
+from app.services.llm_usage import track_llm_usage, record_cache_hit
+from app.services.llm_schemas import COMPETITIVE_ANALYSIS, MARGINS, MARKET_INSIGHTS
+from app.services.margin_simulator import MarginSimulator
+from app.services.category_stats import CategoryStatsService
 import json
+import math
 from datetime import datetime
+from sqlalchemy import func
+
+MARKET_INSIGHTS_SOURCE = 'gpt'
+MARGIN_MODEL = "gpt-4-1106-preview"
+
+def _load_market_insights(location, area_type):
+    """Cache loader; runs in an app context, possibly on a refresh thread"""
+    service = EnhancedMarginService()
+    return service.gateway.run(service._aget_market_insights(location, area_type))
 
 class EnhancedMarginService:
     def __init__(self):
-        self.client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
+        self.gateway = get_llm_gateway()
         self.logger = current_app.logger
+        self.insights_cache = MarketInsightsCache(MARKET_INSIGHTS_SOURCE, _load_market_insights)
 
     def get_margin_suggestions(self, invoice_id, location, area_type=None):
-        """Get AI-suggested margins based on location and market data"""
+        """
+        Get AI-suggested margins based on location and market data
+        Cached market insights (refreshed in the background once stale) go
+        straight into the prompt; on a cold cache the market analysis runs
+        concurrently with the margin request on the LLM gateway
+        """
+        with track_llm_usage(invoice_id, 'margins'):
+            return self._suggest_margins(invoice_id, location, area_type)
+
+    def _suggest_margins(self, invoice_id, location, area_type):
         try:
             # Get unique categories from temp products
             categories = db.session.query(TempProduct.category_name).filter_by(
@@ -24,11 +49,17 @@ class EnhancedMarginService:
             if not category_names:
                 raise ValueError(f"No categories found for invoice {invoice_id}")
 
-            # Get historical margin data
-            historical_data = self._get_historical_margins(category_names)
+            # Market insights don't depend on the invoice; use the cached copy
+            # or start the analysis right away
+            market_data = self.insights_cache.get(location, area_type)
+            insights_future = None
+            if market_data is not None:
+                record_cache_hit(MARGIN_MODEL)
+            else:
+                insights_future = self.gateway.submit(self._aget_market_insights(location, area_type))
 
-            # Get market insights
-            market_data = self._get_market_insights(location, area_type)
+            # Historical margin data for all categories in one query
+            historical_data = self._get_historical_margins(category_names)
 
             # Prepare prompt with all available data
             prompt = self._prepare_margin_prompt(
@@ -39,9 +70,10 @@ class EnhancedMarginService:
                 market_data
             )
 
-            # Get AI suggestions
-            response = self.client.chat.completions.create(
-                model="gpt-4-1106-preview",
+            # Get AI suggestions while any market analysis is still running
+            response = self.gateway.create(
+                'openai',
+                model=MARGIN_MODEL,
                 messages=[{
                     "role": "system",
                     "content": """You are a retail pricing expert specializing in beauty supply stores.
@@ -54,9 +86,8 @@ class EnhancedMarginService:
                 response_format={"type": "json_object"}
             )
 
-            # Process and validate response
-            content = response.choices[0].message.content.strip()
-            suggestions = json.loads(content)
+            # Validate the response against its schema
+            suggestions = MARGINS.parse(response.choices[0].message.content)
 
             # Validate and store suggestions
             validated_suggestions = self._process_suggestions(
@@ -66,57 +97,76 @@ class EnhancedMarginService:
                 area_type
             )
 
+            if insights_future is not None:
+                market_data = insights_future.result()
+                if market_data:
+                    self.insights_cache.store(location, area_type, market_data)
+
+            validated_suggestions['market_insights'] = market_data
             return validated_suggestions
 
         except Exception as e:
             self.logger.error(f"Error getting margin suggestions: {str(e)}")
             raise
 
-    def _get_historical_margins(self, categories):
-        """Get historical margin data for categories"""
-        historical_data = {}
-        for category in categories:
-            cat_data = self._analyze_category_history(category)
-            if cat_data:
-                historical_data[category] = cat_data
-        return historical_data
-
-    def _analyze_category_history(self, category):
-        """Analyze historical performance of a category"""
+    def _get_historical_margins(self, categories, limit=10):
+        """
+        Get historical margin data for categories
+        Loads default margins with the confirmed margin statistics, and the
+        latest `limit` suggestions per category, with two set-based queries
+        """
         try:
-            # Get category details
-            category_obj = Category.query.filter_by(name=category).first()
-            if not category_obj:
-                return None
-
-            # Get recent margin suggestions
-            recent_suggestions = MarginSuggestion.query.filter_by(
-                category_name=category
-            ).order_by(
-                MarginSuggestion.created_at.desc()
-            ).limit(10).all()
-
-            return {
-                'default_margin': category_obj.default_margin,
-                'recent_suggestions': [
-                    {
-                        'margin': s.suggested_margin,
-                        'location': s.location,
-                        'date': s.created_at.isoformat()
-                    } for s in recent_suggestions
-                ]
+            stats = CategoryStatsService().lookup(categories)
+            if not stats:
+                return {}
+
+            ranked = db.session.query(
+                MarginSuggestion.category_name,
+                MarginSuggestion.suggested_margin,
+                MarginSuggestion.location,
+                MarginSuggestion.created_at,
+                func.row_number().over(
+                    partition_by=MarginSuggestion.category_name,
+                    order_by=MarginSuggestion.created_at.desc()
+                ).label('rank')
+            ).filter(
+                MarginSuggestion.category_name.in_(stats.keys())
+            ).subquery()
+
+            recent = db.session.query(ranked).filter(
+                ranked.c.rank <= limit
+            ).order_by(ranked.c.category_name, ranked.c.rank).all()
+
+            historical_data = {
+                name: {
+                    'default_margin': category_stats['default_margin'],
+                    'confirmed_margins': category_stats['confirmed'],
+                    'recent_suggestions': []
+                } for name, category_stats in stats.items()
             }
+            for row in recent:
+                historical_data[row.category_name]['recent_suggestions'].append({
+                    'margin': row.suggested_margin,
+                    'location': row.location,
+                    'date': row.created_at.isoformat() if row.created_at else None
+                })
+            return historical_data
 
         except Exception as e:
             self.logger.error(f"Error analyzing category history: {str(e)}")
-            return None
+            return {}
 
     def _get_market_insights(self, location, area_type):
-        """Get market insights for location"""
+        """Get market insights for location, from the cache when available"""
+        return self.insights_cache.get_or_load(location, area_type)
+
+    async def _aget_market_insights(self, location, area_type):
+        """Get market insights for location on the gateway loop"""
         try:
             # Call GPT-4 for market analysis
-            response = self.client.chat.completions.create(
-                model="gpt-4-1106-preview",
+            response = await self.gateway.acreate(
+                'openai',
+                model=MARGIN_MODEL,
                 messages=[{
                     "role": "system",
                     "content": """You are a market research expert. Analyze the given location
@@ -140,7 +190,7 @@ class EnhancedMarginService:
                 response_format={"type": "json_object"}
             )
             
-            insights = json.loads(response.choices[0].message.content)
+            insights = MARKET_INSIGHTS.parse(response.choices[0].message.content)
             return insights
 
         except Exception as e:
@@ -156,7 +206,7 @@ Categories to analyze: {json.dumps(categories)}
 Location Information:
 - Location: {location}
 - Area Type: {area_type or 'Not specified'}
-- Market Analysis: {json.dumps(market_data, indent=2)}
+- Market Analysis: {json.dumps(market_data, indent=2) if market_data else 'Not provided, assess the local market from the location and area type'}
 
 Historical Data:
 {json.dumps(historical_data, indent=2)}
@@ -187,41 +237,32 @@ Return response in this exact JSON format:
         return prompt
 
     def _process_suggestions(self, invoice_id, suggestions, location, area_type):
-        """Process and validate AI suggestions"""
+        """Store AI suggestions already validated by the MARGINS schema"""
         try:
-            # Validate suggestions format
-            if not isinstance(suggestions, dict) or 'margins' not in suggestions:
-                raise ValueError("Invalid suggestion format")
-
             processed_suggestions = []
             for category, data in suggestions['margins'].items():
-                # Validate margin value
-                margin = float(data['suggested_margin'])
-                if margin < 0 or margin > 100:
-                    self.logger.warning(f"Invalid margin {margin} for {category}")
-                    continue
-
                 # Create suggestion record
                 suggestion = MarginSuggestion(
                     invoice_id=invoice_id,
                     category_name=category,
-                    suggested_margin=margin,
+                    suggested_margin=data['suggested_margin'],
                     location=location,
                     area_type=area_type,
                     insights={
-                        'reasoning': data.get('reasoning', []),
-                        'confidence': data.get('confidence', 0.0),
-                        'risk_level': data.get('risk_level', 'medium')
+                        'reasoning': data['reasoning'],
+                        'confidence': data['confidence'],
+                        'risk_level': data['risk_level']
                     }
                 )
                 db.session.add(suggestion)
                 processed_suggestions.append(suggestion)
 
             # Add market summary
-            if 'market_summary' in suggestions:
+            if suggestions['market_summary'] is not None:
                 market_suggestion = MarginSuggestion(
                     invoice_id=invoice_id,
                     category_name='_market_summary',
+                    suggested_margin=0.0,
                     location=location,
                     area_type=area_type,
                     insights=suggestions['market_summary']
@@ -239,7 +280,7 @@ Return response in this exact JSON format:
                         'insights': s.insights
                     } for s in processed_suggestions
                 ],
-                'market_summary': suggestions.get('market_summary', {})
+                'market_summary': suggestions['market_summary'] or {}
             }
 
         except Exception as e:
@@ -301,40 +342,28 @@ Return response in this exact JSON format:
             self.logger.error(f"Error getting margin history: {str(e)}")
             raise
 
-    def analyze_margin_impact(self, invoice_id, proposed_margins):
+    def analyze_margin_impact(self, invoice_id, proposed_margins, rounding_method='99'):
         """Analyze impact of proposed margins"""
         try:
-            # Get all products for the invoice
-            products = TempProduct.query.filter_by(invoice_id=invoice_id).all()
-            
-            current_totals = {
-                'cost': sum(p.cost_price * p.quantity for p in products),
-                'revenue': sum(p.selling_price * p.quantity if p.selling_price else 0 for p in products)
-            }
-            
-            # Calculate proposed totals
-            proposed_revenue = 0
-            for product in products:
-                margin = proposed_margins.get(product.category_name)
-                if margin:
-                    selling_price = product.cost_price * (1 + margin/100)
-                    proposed_revenue += selling_price * product.quantity
+            simulator = MarginSimulator(invoice_id)
+            current = simulator.summary()
+            proposed = simulator.simulate([proposed_margins], rounding_method)[0]
 
             return {
                 'current': {
-                    'total_cost': current_totals['cost'],
-                    'total_revenue': current_totals['revenue'],
-                    'total_profit': current_totals['revenue'] - current_totals['cost']
+                    'total_cost': current['total_cost'],
+                    'total_revenue': current['total_revenue'],
+                    'total_profit': round(current['total_revenue'] - current['total_cost'], 2)
                 },
                 'proposed': {
-                    'total_cost': current_totals['cost'],
-                    'total_revenue': proposed_revenue,
-                    'total_profit': proposed_revenue - current_totals['cost']
+                    'total_cost': current['total_cost'],
+                    'total_revenue': proposed['revenue'],
+                    'total_profit': proposed['profit'],
+                    'price_changes': proposed['price_changes']
                 },
                 'difference': {
-                    'revenue': proposed_revenue - current_totals['revenue'],
-                    'profit': (proposed_revenue - current_totals['cost']) - 
-                             (current_totals['revenue'] - current_totals['cost'])
+                    'revenue': round(proposed['revenue'] - current['total_revenue'], 2),
+                    'profit': round(proposed['revenue'] - current['total_revenue'], 2)
                 }
             }
 
@@ -342,11 +371,41 @@ Return response in this exact JSON format:
             self.logger.error(f"Error analyzing margin impact: {str(e)}")
             raise
 
+    def simulate_margins(self, invoice_id, scenarios=None, grid=None, base=None, rounding_method='99'):
+        """
+        Evaluate what-if margin scenarios for an invoice in one vectorized pass
+        scenarios is a list of {category: margin}; grid maps categories to
+        candidate margins and adds every combination of them. Categories a
+        scenario leaves out take their margin from base.
+        """
+        try:
+            simulator = MarginSimulator(invoice_id)
+            candidates = [dict(base or {}, **scenario) for scenario in scenarios or []]
+            if grid:
+                if len(candidates) + math.prod(len(values) for values in grid.values()) > simulator.max_scenarios:
+                    raise ValueError(f"At most {simulator.max_scenarios} scenarios can be simulated at once")
+                candidates.extend(simulator.expand_grid(grid, base))
+            if not candidates:
+                candidates = [dict(base or {})]
+
+            results = simulator.simulate(candidates, rounding_method)
+            best = max(range(len(results)), key=lambda index: results[index]['profit'])
+            return {
+                'current': simulator.summary(),
+                'scenarios': results,
+                'best': best
+            }
+
+        except Exception as e:
+            self.logger.error(f"Error simulating margins: {str(e)}")
+            raise
+
     def get_competitive_analysis(self, location, categories):
         """Get competitive analysis for categories in location"""
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4-1106-preview",
+            response = self.gateway.create(
+                'openai',
+                model=MARGIN_MODEL,
                 messages=[{
                     "role": "system",
                     "content": """You are a competitive analysis expert for retail stores.
@@ -369,7 +428,7 @@ Return response in this exact JSON format:
                 response_format={"type": "json_object"}
             )
             
-            analysis = json.loads(response.choices[0].message.content)
+            analysis = COMPETITIVE_ANALYSIS.parse(response.choices[0].message.content)
             return analysis
 
         except Exception as e:
@@ -0,0 +1,190 @@
+# app/services/margin_simulator.py
+import itertools
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+from app.extensions import db
+from app.models import InvoiceItem, Product, TempProduct
+from app.services.price_service import round_prices
+
+CACHE_SIZE = 32  # Invoices whose cost matrix is kept in memory
+MAX_CELLS = 250000  # Candidate margin x product prices evaluated per chunk
+
+# Process-wide cache of invoice cost matrices: invoice_id -> (loaded_at, CostMatrix)
+_cache_lock = threading.Lock()
+_cache = OrderedDict()
+
+def invalidate_cost_matrix(invoice_id):
+    """Drop an invoice's cached matrix, e.g. after its prices were saved"""
+    with _cache_lock:
+        _cache.pop(invoice_id, None)
+
+class CostMatrix:
+    """The columns of an invoice's products that scenarios are evaluated against"""
+
+    def __init__(self, rows):
+        self.product_ids = np.array([row.id for row in rows], dtype=np.int64)
+        self.categories, self.codes = np.unique(
+            np.array([row.category_name or '' for row in rows], dtype=object).astype(str),
+            return_inverse=True
+        )
+        # Row positions of each category's products
+        self.members = np.split(
+            np.argsort(self.codes, kind='stable'),
+            np.cumsum(np.bincount(self.codes, minlength=len(self.categories)))[:-1]
+        ) if len(self.codes) else []
+        self.cost = np.array([row.cost_price for row in rows], dtype=float)
+        self.quantity = np.nan_to_num(np.array([row.quantity for row in rows], dtype=float))
+        self.current_price = np.array([row.selling_price for row in rows], dtype=float)
+        # The shelf price a new price tag would replace: the matched catalog
+        # product's price, or the price already set on the invoice line
+        shelf = np.array([row.shelf_price for row in rows], dtype=float)
+        self.baseline_price = np.where(np.isnan(shelf), self.current_price, shelf)
+        self.total_cost = float(np.nan_to_num(self.cost) @ self.quantity)
+
+    @classmethod
+    def load(cls, invoice_id):
+        rows = db.session.execute(
+            select(
+                TempProduct.id, TempProduct.category_name, TempProduct.cost_price,
+                TempProduct.quantity, TempProduct.selling_price,
+                Product.selling_price.label('shelf_price')
+            )
+            .outerjoin(InvoiceItem, InvoiceItem.temp_product_id == TempProduct.id)
+            .outerjoin(Product, Product.id == InvoiceItem.product_id)
+            .where(TempProduct.invoice_id == invoice_id)
+            .order_by(TempProduct.id)
+        ).all()
+        # An invoice line matched more than once counts once
+        unique, seen = [], set()
+        for row in rows:
+            if row.id not in seen:
+                seen.add(row.id)
+                unique.append(row)
+        return cls(unique)
+
+class MarginSimulator:
+    """
+    Evaluate many what-if margin scenarios for one invoice at once
+
+    A scenario maps category -> margin percent. All scenarios become one
+    (scenarios x categories) margin matrix. Each category's products are
+    priced and rounded as one array per distinct candidate margin, and
+    revenue is a matrix-vector product with the quantities, so the cost
+    grows with the candidate margins rather than with the scenarios. The
+    invoice's cost matrix is cached for MARGIN_SIMULATION_CACHE_SECONDS,
+    so a sweep of requests reads the database once.
+    """
+
+    def __init__(self, invoice_id):
+        self.logger = current_app.logger
+        self.invoice_id = invoice_id
+        self.max_scenarios = current_app.config.get('MARGIN_SIMULATION_MAX_SCENARIOS', 1000)
+        self.cache_seconds = current_app.config.get('MARGIN_SIMULATION_CACHE_SECONDS', 60)
+        self.matrix = self._matrix()
+
+    def _matrix(self):
+        now = time.monotonic()
+        with _cache_lock:
+            entry = _cache.get(self.invoice_id)
+            if entry and now - entry[0] < self.cache_seconds:
+                _cache.move_to_end(self.invoice_id)
+                return entry[1]
+
+        matrix = CostMatrix.load(self.invoice_id)
+        with _cache_lock:
+            _cache[self.invoice_id] = (now, matrix)
+            _cache.move_to_end(self.invoice_id)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        return matrix
+
+    @staticmethod
+    def expand_grid(grid, base=None):
+        """
+        Every combination of candidate margins per category, e.g.
+        {'Hair Care': [30, 35], 'Skin Care': [40, 45]} -> 4 scenarios;
+        categories missing from the grid keep their margin from base
+        """
+        names = list(grid)
+        return [
+            dict(base or {}, **dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))
+        ]
+
+    def simulate(self, scenarios, rounding_method='99'):
+        """
+        Revenue, profit and price-tag changes for each scenario, in order
+        Categories a scenario leaves out keep their current prices
+        """
+        if len(scenarios) > self.max_scenarios:
+            raise ValueError(f"At most {self.max_scenarios} scenarios can be simulated at once")
+
+        matrix = self.matrix
+        index = {name: position for position, name in enumerate(matrix.categories)}
+        margins = np.full((len(scenarios), len(matrix.categories)), np.nan)
+        for row, scenario in enumerate(scenarios):
+            for name, margin in scenario.items():
+                if name in index and margin is not None:
+                    margins[row, index[name]] = float(margin)
+        if (margins < 0).any():
+            raise ValueError("Margins cannot be negative")
+
+        # A category's prices depend only on its own margin, so each category
+        # is priced once per distinct candidate margin and scenarios add up
+        # those per-category totals
+        revenue = np.zeros(len(scenarios))
+        changes = np.zeros(len(scenarios), dtype=np.int64)
+        for code, members in enumerate(matrix.members):
+            candidates, picks = np.unique(margins[:, code], return_inverse=True)
+            category_revenue, category_changes = self._category_totals(members, candidates, rounding_method)
+            revenue += category_revenue[picks.ravel()]
+            changes += category_changes[picks.ravel()]
+
+        profit = revenue - matrix.total_cost
+        with np.errstate(divide='ignore', invalid='ignore'):
+            profit_margin = np.where(revenue > 0, profit / revenue * 100, 0)
+        return [
+            {
+                'margins': scenarios[row],
+                'revenue': round(float(revenue[row]), 2),
+                'profit': round(float(profit[row]), 2),
+                'profit_margin': round(float(profit_margin[row]), 2),
+                'price_changes': int(changes[row])
+            } for row in range(len(scenarios))
+        ]
+
+    def _category_totals(self, members, candidates, rounding_method):
+        """Revenue and changed price tags of one category's products at each candidate margin"""
+        matrix = self.matrix
+        cost = matrix.cost[members]
+        quantity = matrix.quantity[members]
+        current = matrix.current_price[members]
+        baseline = np.nan_to_num(matrix.baseline_price[members], nan=-1)
+        costed = cost > 0
+
+        revenue = np.zeros(len(candidates))
+        changes = np.zeros(len(candidates), dtype=np.int64)
+        step = max(1, MAX_CELLS // max(1, len(members)))
+        for start in range(0, len(candidates), step):
+            margin = candidates[start:start + step, None]
+            proposed = round_prices(np.nan_to_num(cost) * (1 + np.nan_to_num(margin) / 100), rounding_method)
+            # NaN margin: the scenario leaves this category alone
+            prices = np.where(~np.isnan(margin) & costed, proposed, current)
+            revenue[start:start + step] = np.nan_to_num(prices) @ quantity
+            changes[start:start + step] = (~np.isnan(prices) & ~np.isclose(prices, baseline)).sum(axis=1)
+        return revenue, changes
+
+    def summary(self):
+        """Cost and current revenue of the invoice"""
+        matrix = self.matrix
+        revenue = float(np.nan_to_num(matrix.current_price) @ matrix.quantity)
+        return {
+            'products': int(len(matrix.cost)),
+            'categories': [str(name) for name in matrix.categories if name],
+            'total_cost': round(matrix.total_cost, 2),
+            'total_revenue': round(revenue, 2)
+        }
@@ -0,0 +1,149 @@
+# app/services/market_insights_cache.py
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import MarketInsight
+
+# A refresh that has not finished after this long is assumed dead
+REFRESH_TIMEOUT = timedelta(minutes=5)
+
+def location_key(location):
+    """Normalize a location so 'Austin, TX' and ' austin,  tx' share an entry"""
+    return ' '.join(str(location or '').lower().split())
+
+class MarketInsightsCache:
+    """
+    Database-backed TTL cache of market insights per (location, area_type)
+
+    Stale entries are still served while a background thread reloads
+    them, so the pricing page only waits on a cold cache.
+    """
+
+    def __init__(self, source, loader):
+        """
+        Args:
+            source: name of the insights provider, part of the cache key
+            loader: callable(location, area_type) returning insights or None;
+                    runs inside an application context
+        """
+        self.logger = current_app.logger
+        self.source = source
+        self.loader = loader
+        self.ttl = timedelta(hours=current_app.config.get('MARKET_INSIGHTS_TTL_HOURS', 168))
+
+    def _entry(self, location, area_type):
+        return MarketInsight.query.filter_by(
+            location_key=location_key(location),
+            area_type=area_type or '',
+            source=self.source
+        ).first()
+
+    def get(self, location, area_type):
+        """
+        Cached insights or None, without ever calling the loader inline
+        Stale entries are returned as-is and refreshed in the background
+        """
+        entry = self._entry(location, area_type)
+        if not entry:
+            return None
+        if entry.is_stale():
+            self.refresh_in_background(entry, location, area_type)
+        return entry.insights
+
+    def get_or_load(self, location, area_type):
+        """Cached insights, loading and storing them on a miss"""
+        entry = self._entry(location, area_type)
+        if entry:
+            if entry.is_stale():
+                self.refresh_in_background(entry, location, area_type)
+            return entry.insights
+
+        insights = self.loader(location, area_type)
+        if insights:
+            self.store(location, area_type, insights)
+        return insights
+
+    def store(self, location, area_type, insights):
+        """Insert or replace the cached insights"""
+        now = datetime.utcnow()
+        values = {
+            'location': location,
+            'insights': insights,
+            'fetched_at': now,
+            'expires_at': now + self.ttl,
+            'refresh_started_at': None
+        }
+        try:
+            with db.session.begin_nested():
+                entry = self._entry(location, area_type)
+                if entry:
+                    for key, value in values.items():
+                        setattr(entry, key, value)
+                else:
+                    db.session.add(MarketInsight(
+                        location_key=location_key(location),
+                        area_type=area_type or '',
+                        source=self.source,
+                        **values
+                    ))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same key concurrently
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.warning(f"Failed to cache market insights for {location}: {str(e)}")
+
+    def _claim_refresh(self, entry):
+        """Mark the entry as refreshing; False if it is fresh again or another worker is on it"""
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(MarketInsight)
+            .where(
+                MarketInsight.id == entry.id,
+                or_(MarketInsight.expires_at.is_(None), MarketInsight.expires_at <= now),
+                or_(
+                    MarketInsight.refresh_started_at.is_(None),
+                    MarketInsight.refresh_started_at < now - REFRESH_TIMEOUT
+                )
+            )
+            .values(refresh_started_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def refresh_in_background(self, entry, location, area_type):
+        """Reload stale insights on a daemon thread"""
+        try:
+            if not self._claim_refresh(entry):
+                return
+        except Exception as e:
+            db.session.rollback()
+            self.logger.warning(f"Could not schedule market insights refresh: {str(e)}")
+            return
+
+        app = current_app._get_current_object()
+        entry_id = entry.id
+
+        def refresh():
+            with app.app_context():
+                try:
+                    insights = self.loader(location, area_type)
+                    if insights:
+                        self.store(location, area_type, insights)
+                        app.logger.info(f"Refreshed {self.source} market insights for {location}")
+                    else:
+                        # Keep serving the old data; allow another attempt later
+                        MarketInsight.query.filter_by(id=entry_id).update({'refresh_started_at': None})
+                        db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Market insights refresh failed for {location}: {str(e)}")
+                finally:
+                    db.session.remove()
+
+        threading.Thread(target=refresh, name='market-insights-refresh', daemon=True).start()
@@ -0,0 +1,202 @@
+# app/services/price_commit.py
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, cast, column, insert, select, update, values
+from app.extensions import db
+from app.models import Category, InvoiceItem, PriceHistory, Product, TempProduct
+from app.services.category_stats import CONFIRMED_STATUSES, CategoryStatsService
+from app.services.margin_simulator import invalidate_cost_matrix
+from app.services.price_service import as_percent
+
+CHUNK_SIZE = 1000  # Rows per VALUES list, well under PostgreSQL's bind parameter limit
+
+def bulk_update(model, rows):
+    """
+    Update rows of a model by primary key; rows are dicts with 'id' and the
+    same columns. PostgreSQL gets one UPDATE ... FROM (VALUES ...) per chunk,
+    other databases an executemany UPDATE
+    """
+    if not rows:
+        return
+    table = model.__table__
+    unknown = [name for name in rows[0] if name not in table.c]
+    if unknown:
+        # The ORM executemany would silently skip them
+        raise ValueError(f"{table.name} has no column {', '.join(unknown)}")
+    if db.session.get_bind().dialect.name != 'postgresql':
+        db.session.execute(update(model), rows)
+        return
+
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(values_update(table, rows[start:start + CHUNK_SIZE]))
+
+def values_update(table, rows):
+    """The UPDATE ... FROM (VALUES ...) statement for one chunk of rows"""
+    names = list(rows[0])
+    new = values(
+        *[column(name, table.c[name].type) for name in names],
+        name='new_values'
+    ).data([tuple(row[name] for name in names) for row in rows])
+    return (
+        update(table)
+        .where(table.c.id == new.c.id)
+        # A VALUES column of only NULLs would otherwise be typed as text
+        .values({name: cast(new.c[name], table.c[name].type) for name in names if name != 'id'})
+    )
+
+class PriceCommitService:
+    """
+    Confirm an invoice's prices in one transaction
+
+    All lines are read with their matched catalog product and its category
+    in a single query. Invoice lines and catalog products are then updated
+    with one statement each, and price history is inserted as one batch,
+    so the cost no longer grows with a round-trip per line.
+    """
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.stats = CategoryStatsService()
+
+    def _load(self, invoice_id):
+        return db.session.execute(
+            select(
+                TempProduct.id, TempProduct.name, TempProduct.category_name,
+                TempProduct.cost_price, TempProduct.margin, TempProduct.selling_price,
+                InvoiceItem.unit_price,
+                Product.id.label('product_id'),
+                Product.cost_price.label('old_cost_price'),
+                Product.selling_price.label('old_selling_price'),
+                Category.name.label('catalog_category'),
+                Category.default_margin
+            )
+            .outerjoin(InvoiceItem, and_(
+                InvoiceItem.temp_product_id == TempProduct.id,
+                InvoiceItem.invoice_id == invoice_id,
+                InvoiceItem.status == 'matched'
+            ))
+            .outerjoin(Product, Product.id == InvoiceItem.product_id)
+            .outerjoin(Category, Category.id == Product.category_id)
+            .where(TempProduct.invoice_id == invoice_id)
+            .order_by(TempProduct.id)
+        ).all()
+
+    def commit(self, invoice, prices=None, margin_source='invoice', user=None):
+        """
+        Apply an invoice's prices to its lines and matched catalog products
+        and mark the invoice prices_set; the caller commits
+
+        prices optionally overrides lines, as dicts with product_id (the
+        temp product), margin and selling_price. With margin_source
+        'category', matched products are instead priced from the invoice
+        cost and their category's default margin, and unmatched lines are
+        left alone. Returns a summary with one outcome per line: updated
+        (line and catalog), staged (line only) or skipped with a reason.
+        """
+        if margin_source not in ('invoice', 'category'):
+            raise ValueError(f"Unknown margin source: {margin_source}")
+
+        rows = {row.id: row for row in self._load(invoice.id)}
+        overrides = {}
+        results = []
+        for price in prices or []:
+            try:
+                product_id = int(price.get('product_id'))
+            except (TypeError, ValueError):
+                product_id = None
+            if product_id not in rows:
+                results.append({'product_id': price.get('product_id'), 'outcome': 'skipped',
+                                'reason': 'not on this invoice'})
+                continue
+            overrides[product_id] = price
+
+        now = datetime.utcnow()
+        line_updates, catalog_updates, history, confirmed = [], [], [], []
+        for product_id, row in rows.items():
+            if prices is not None and product_id not in overrides:
+                continue
+            outcome = {'product_id': product_id, 'name': row.name}
+            results.append(outcome)
+
+            if margin_source == 'category':
+                cost = row.unit_price if row.unit_price is not None else row.cost_price
+                if row.product_id is None:
+                    outcome.update(outcome='skipped', reason='not matched to a catalog product')
+                    continue
+                if cost is None:
+                    outcome.update(outcome='skipped', reason='no cost price')
+                    continue
+                margin = as_percent(row.default_margin) or 0
+                selling_price = round(cost * (1 + margin / 100), 2)
+                category_name = row.catalog_category
+            else:
+                price = overrides.get(product_id, {})
+                cost = row.cost_price
+                margin = price.get('margin', row.margin)
+                selling_price = price.get('selling_price', row.selling_price)
+                category_name = row.category_name
+                try:
+                    margin = None if margin is None else float(margin)
+                    selling_price = None if selling_price is None else float(selling_price)
+                except (TypeError, ValueError):
+                    outcome.update(outcome='skipped', reason='invalid price')
+                    continue
+                if selling_price is None:
+                    outcome.update(outcome='skipped', reason='no selling price')
+                    continue
+                line_updates.append({
+                    'id': product_id,
+                    'margin': margin,
+                    'selling_price': selling_price
+                })
+
+            confirmed.append((category_name, margin))
+            if row.product_id is None or cost is None:
+                outcome['outcome'] = 'staged'
+                continue
+
+            # Product.margin is the margin actually earned at the confirmed price
+            earned = round((selling_price - cost) / cost * 100, 2) if cost > 0 else 0
+            catalog_updates.append({
+                'id': row.product_id,
+                'cost_price': cost,
+                'selling_price': selling_price,
+                'margin': earned,
+                'last_price_update': now
+            })
+            history.append({
+                'product_id': row.product_id,
+                'invoice_id': invoice.id,
+                'old_cost_price': row.old_cost_price,
+                'new_cost_price': cost,
+                'old_selling_price': row.old_selling_price,
+                'new_selling_price': selling_price,
+                'margin': earned,
+                'created_at': now
+            })
+            outcome.update(outcome='updated', catalog_product_id=row.product_id,
+                           old_selling_price=row.old_selling_price, new_selling_price=selling_price)
+
+        bulk_update(TempProduct, line_updates)
+        bulk_update(Product, catalog_updates)
+        if history:
+            db.session.execute(insert(PriceHistory), history)
+
+        if invoice.status not in CONFIRMED_STATUSES:
+            self.stats.record_lines(confirmed)
+        invoice.status = 'prices_set'
+        invoice.processed_date = now
+        if user is not None:
+            invoice.processed_by_id = user.id
+
+        invalidate_cost_matrix(invoice.id)
+
+        counts = {}
+        for outcome in results:
+            counts[outcome['outcome']] = counts.get(outcome['outcome'], 0) + 1
+        return {
+            'updated': counts.get('updated', 0),
+            'staged': counts.get('staged', 0),
+            'skipped': counts.get('skipped', 0),
+            'results': results
+        }
@@ -3,6 +3,7 @@
 from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
 from app.models import Invoice, InvoiceItem, Product, PriceHistory
+from app.services.price_commit import PriceCommitService
 from app import db
 from datetime import datetime
 
@@ -40,45 +41,14 @@ def confirm_prices(invoice_id):
     try:
         invoice = Invoice.query.get_or_404(invoice_id)
         
-        # Begin transaction
-        for item in invoice.items:
-            if item.product and item.is_matched:
-                # Get the current product
-                product = item.product
-                
-                # Create price history record
-                history = PriceHistory(
-                    product_id=product.id,
-                    cost_price=item.cost_price,
-                    selling_price=product.selling_price,
-                    margin=product.margin,
-                    invoice_id=invoice_id,
-                    effective_date=datetime.utcnow(),
-                    change_type='invoice',
-                    change_reason=f'Price update from invoice {invoice.invoice_number}'
-                )
-                db.session.add(history)
-                
-                # Update product prices
-                category_margin = product.category.default_margin if product.category else 0
-                product.cost_price = item.cost_price
-                product.selling_price = item.cost_price * (1 + category_margin/100)
-                product.margin = category_margin
-                product.last_price_update = datetime.utcnow()
-                
-                # Update invoice item status
-                item.status = 'pending_update'  # This will make it appear in staff's update list
-                
-        # Update invoice status
-        invoice.status = 'prices_set'
-        invoice.processed_by_id = current_user.id
-        invoice.processed_date = datetime.utcnow()
-        
+        # Price matched products from their category margin, in one bulk commit
+        result = PriceCommitService().commit(invoice, margin_source='category', user=current_user)
         db.session.commit()
         
         return jsonify({
             'status': 'success',
-            'message': 'Prices confirmed successfully'
+            'message': 'Prices confirmed successfully',
+            **result
         })
         
     except Exception as e:
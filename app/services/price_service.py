@@ -1,38 +1,85 @@
 # app/services/price_service.py
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
 from flask import current_app
+from sqlalchemy import select, update
 from app import db
-from app.models import (TempProduct, PriceUpdate, Category, Invoice, 
-                       TempPriceHistory, Task)
+from app.models import TempProduct, PriceUpdate, Category, Invoice, Product, Task
+
+# Retail endings: whole-dollar price minus this amount
+PRICE_ENDINGS = {'99': 0.01, '95': 0.05}
+# Absorbs binary float error so e.g. 2.675 rounds half up like the decimal it represents
+ROUNDING_EPSILON = 1e-9
+
+def round_prices(prices, rounding_method='99'):
+    """
+    Round an array of prices according to retail pricing conventions
+    Methods:
+    - '99': Round half up to the dollar, then end in .99 (default)
+    - '95': Round half up to the dollar, then end in .95
+    - 'std': Standard rounding half up to 2 decimal places
+    Prices under a dollar keep standard rounding so they can't turn negative
+    """
+    prices = np.asarray(prices, dtype=float)
+    cents = np.floor(prices * 100 + 0.5 + ROUNDING_EPSILON) / 100
+    ending = PRICE_ENDINGS.get(rounding_method)
+    if ending is None:
+        return np.round(cents, 2)
+    dollars = np.floor(prices + 0.5 + ROUNDING_EPSILON)
+    return np.round(np.where(dollars >= 1, dollars - ending, cents), 2)
+
+def as_percent(margin):
+    """Category.default_margin holds fractions (0.35) from init-categories, percentages once edited"""
+    return margin * 100 if margin is not None and 0 < margin <= 1 else margin
 
 class EnhancedPriceService:
     def __init__(self):
         self.logger = current_app.logger
 
     def _round_price(self, price, rounding_method='99'):
+        """Round a single price; see round_prices()"""
+        return float(round_prices([price], rounding_method)[0])
+
+    def price_by_category(self, category_names, cost, margins, rounding_method='99'):
         """
-        Round price according to retail pricing conventions
-        Methods:
-        - '99': Round to nearest .99 (default)
-        - '95': Round to nearest .95
-        - 'std': Standard mathematical rounding
+        Selling prices for arrays of category names and cost prices
+        Returns (categories, codes, margin, selling): the distinct categories,
+        each row's index into them, each row's margin in percent (NaN where
+        its category has none) and its rounded price (NaN where there is no
+        margin or no cost)
         """
-        try:
-            if rounding_method == '99':
-                # Round to nearest .99
-                base = Decimal(str(price)).quantize(Decimal('0'), rounding=ROUND_HALF_UP)
-                return float(base - Decimal('0.01'))
-            elif rounding_method == '95':
-                # Round to nearest .95
-                base = Decimal(str(price)).quantize(Decimal('0'), rounding=ROUND_HALF_UP)
-                return float(base - Decimal('0.05'))
-            else:
-                # Standard rounding to 2 decimal places
-                return float(Decimal(str(price)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        except Exception as e:
-            self.logger.error(f"Error rounding price {price}: {str(e)}")
-            return round(price, 2)
+        names = np.array([name or '' for name in category_names], dtype=object).astype(str)
+        categories, codes = np.unique(names, return_inverse=True)
+        category_margins = np.array([
+            float(margins[name]) if margins.get(name) is not None else np.nan for name in categories
+        ], dtype=float)
+        margin = category_margins[codes] if len(codes) else np.array([], dtype=float)
+
+        cost = np.asarray(cost, dtype=float)
+        priced = ~np.isnan(margin) & (cost > 0)
+        selling = np.full(len(cost), np.nan)
+        selling[priced] = round_prices(cost[priced] * (1 + margin[priced] / 100), rounding_method)
+        return categories, codes, margin, selling
+
+    def _summary(self, categories, codes, cost, selling, quantity):
+        """Per-category and total cost and revenue, summed with bincount"""
+        line_cost = np.nan_to_num(cost) * quantity
+        line_selling = np.nan_to_num(selling) * quantity
+        counts = np.bincount(codes, minlength=len(categories))
+        costs = np.bincount(codes, weights=line_cost, minlength=len(categories))
+        sellings = np.bincount(codes, weights=line_selling, minlength=len(categories))
+        return {
+            'total_products': int(len(codes)),
+            'total_cost': round(float(line_cost.sum()), 2),
+            'total_selling': round(float(line_selling.sum()), 2),
+            'by_category': {
+                str(name) or 'Uncategorized': {
+                    'count': int(counts[index]),
+                    'total_cost': round(float(costs[index]), 2),
+                    'total_selling': round(float(sellings[index]), 2)
+                } for index, name in enumerate(categories)
+            }
+        }
 
     def calculate_category_summary(self, invoice_id):
         """Generate summary statistics by category"""
@@ -73,10 +120,13 @@ class EnhancedPriceService:
                 summary['total_products'] += 1
                 summary['total_cost'] += product.cost_price * product.quantity
 
-            # Calculate average margins from historical data
-            for category in summary['categories'].keys():
-                avg_margin = self._get_category_average_margin(category)
-                summary['categories'][category]['avg_margin'] = avg_margin
+            # Average margins from the confirmed-margin statistics, in one query
+            from app.services.category_stats import CategoryStatsService  # Imports this module
+            stats = CategoryStatsService().lookup(summary['categories'].keys())
+            for category, cat_summary in summary['categories'].items():
+                category_stats = stats.get(category, {})
+                cat_summary['avg_margin'] = category_stats.get('avg_margin')
+                cat_summary['ewma_margin'] = (category_stats.get('confirmed') or {}).get('ewma_margin')
 
             return summary
 
@@ -84,56 +134,111 @@ class EnhancedPriceService:
             self.logger.error(f"Error calculating category summary: {str(e)}")
             raise
 
-    def _get_category_average_margin(self, category_name):
-        """Get average margin for a category from historical data"""
+    def calculate_prices(self, invoice_id, margins, rounding_method='99'):
+        """
+        Calculate selling prices for a whole invoice from per-category margins
+        Prices are computed as arrays and written back with one bulk UPDATE;
+        returns the invoice's cost/revenue summary, or None on failure
+        """
         try:
-            category = Category.query.filter_by(name=category_name).first()
-            if not category:
-                return None
+            Invoice.query.get_or_404(invoice_id)
+            rows = db.session.execute(
+                select(TempProduct.id, TempProduct.category_name, TempProduct.cost_price,
+                       TempProduct.selling_price, TempProduct.quantity)
+                .where(TempProduct.invoice_id == invoice_id)
+            ).all()
+            ids, category_names, cost, old_selling, quantity = (list(column) for column in zip(*rows)) if rows else ([],) * 5
+            cost = np.array(cost, dtype=float)
 
-            # Get recent price history
-            history = TempPriceHistory.query.join(TempProduct).filter(
-                TempProduct.category_name == category_name
-            ).order_by(
-                TempPriceHistory.created_at.desc()
-            ).limit(100).all()
+            categories, codes, margin, selling = self.price_by_category(
+                category_names, cost, margins, rounding_method
+            )
+            # Rows without a cost keep their price, as before
+            selling = np.where(np.isnan(selling), np.array(old_selling, dtype=float), selling)
 
-            if not history:
-                return category.default_margin
+            changed = np.flatnonzero(~np.isnan(margin))
+            updates = [
+                {
+                    'id': ids[index],
+                    'margin': float(margin[index]),
+                    'selling_price': None if np.isnan(selling[index]) else float(selling[index])
+                } for index in changed
+            ]
+            if updates:
+                db.session.execute(update(TempProduct), updates)
+            db.session.commit()
 
-            # Calculate average margin
-            total_margin = sum(h.margin for h in history)
-            return round(total_margin / len(history), 2)
+            from app.services.margin_simulator import invalidate_cost_matrix  # Imports this module
+            invalidate_cost_matrix(invoice_id)
 
-        except Exception as e:
-            self.logger.error(f"Error getting average margin for {category_name}: {str(e)}")
-            return None
+            return {
+                'status': 'success',
+                'updated': len(updates),
+                'summary': self._summary(
+                    categories, codes, cost, selling,
+                    np.nan_to_num(np.array(quantity, dtype=float))
+                )
+            }
 
-    def calculate_prices(self, invoice_id, margins, rounding_method='99'):
-        """Calculate selling prices based on margins"""
-        try:
-            invoice = Invoice.query.get_or_404(invoice_id)
-            
-            for product in invoice.temp_products:
-                category = product.category_name
-                if category in margins:
-                    margin = float(margins[category])
-                    product.margin = margin
-                    product.calculate_selling_price()
-            
-            db.session.commit()
-            return True
-            
         except Exception as e:
             self.logger.error(f"Error calculating prices: {str(e)}")
             db.session.rollback()
-            return False
+            return None
+
+    def reprice_catalog(self, margins=None, rounding_method='99', dry_run=False):
+        """
+        Reprice every active catalog product from its category's margin
+        margins maps category name -> percent and defaults to each
+        category's default_margin; products without a category or cost
+        are left alone. Returns how many products were priced and how
+        many of those prices changed
+        """
+        if margins is None:
+            margins = {
+                name: as_percent(margin) for name, margin in
+                db.session.query(Category.name, Category.default_margin).all()
+            }
+
+        rows = db.session.execute(
+            select(Product.id, Category.name, Product.cost_price, Product.selling_price)
+            .join(Category, Product.category_id == Category.id)
+            .where(Product.is_active.isnot(False))
+        ).all()
+        if not rows:
+            return {'priced': 0, 'changed': 0}
+        ids, category_names, cost, old_selling = (list(column) for column in zip(*rows))
+        cost = np.array(cost, dtype=float)
+
+        _, _, _, selling = self.price_by_category(category_names, cost, margins, rounding_method)
+        priced = ~np.isnan(selling)
+        moved = np.flatnonzero(priced & ~np.isclose(selling, np.array(old_selling, dtype=float)))
+
+        # Product.margin is the margin actually earned at the rounded price
+        earned = np.round((selling - cost) / np.where(cost > 0, cost, 1) * 100, 2)
+        if not dry_run and len(moved):
+            now = datetime.utcnow()
+            db.session.execute(update(Product), [
+                {
+                    'id': ids[index],
+                    'selling_price': float(selling[index]),
+                    'margin': float(earned[index]),
+                    'last_price_update': now
+                } for index in moved
+            ])
+            db.session.commit()
+            self.logger.info(f"Repriced {len(moved)} catalog products")
+        return {'priced': int(priced.sum()), 'changed': int(len(moved))}
 
     def create_tasks(self, invoice_id):
         """Create tasks for staff to update price tags"""
         try:
             invoice = Invoice.query.get_or_404(invoice_id)
             invoice.create_price_update_tasks()
+            
+            # Queue the printable label sheets the tasks refer to
+            from app.services.label_sheets import LabelSheetService
+            LabelSheetService().request_sheets(invoice_id)
+            db.session.commit()
             return True
             
         except Exception as e:
@@ -0,0 +1,177 @@
+# app/services/product_matcher.py
+import hashlib
+import heapq
+import json
+import math
+import re
+import threading
+from collections import defaultdict
+from flask import current_app
+from app.extensions import db
+from app.models import Product
+from app.services.category_memo import normalize_product_name
+
+# Candidates scored with trigrams per invoice line, after token filtering
+MAX_CANDIDATES = 25
+
+# Share of the confidence score from IDF-weighted token overlap; the rest is trigram similarity
+TOKEN_WEIGHT = 0.35
+
+# Tokens on more than this share of names are skipped when gathering candidates
+COMMON_TOKEN_SHARE = 0.2
+
+# Process-wide index, rebuilt when the catalog changes
+_index_lock = threading.Lock()
+_index = None
+
+def match_key(text):
+    """Normalized name with sizes split from units, so '8oz' and '8 OZ.' agree"""
+    key = normalize_product_name(text).replace('.', ' ')
+    key = re.sub(r'(?<=\d)(?=[a-z])|(?<=[a-z])(?=\d)', ' ', key)
+    return ' '.join(key.split())
+
+def trigrams(text):
+    """Character trigrams of a normalized string, padded so short words still match"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2.0 * len(a & b) / (len(a) + len(b))
+
+class CatalogIndex:
+    """
+    Inverted token index plus trigram sets over product names,
+    invoice identifiers and alternative names
+    """
+
+    def __init__(self, products, signature=None):
+        self.signature = signature
+        self.exact = {}  # normalized string -> product id
+        self.entries = []  # (product id, normalized string, trigram set, token set)
+        self.postings = defaultdict(set)  # token -> entry indexes
+
+        for product_id, name, identifier, alternatives in products:
+            # Identifier first so it wins when another product uses it as a name
+            strings = [identifier, name] + (alternatives or '').split(',')
+            for text in strings:
+                key = match_key(text)
+                if not key:
+                    continue
+                self.exact.setdefault(key, product_id)
+                tokens = set(key.split())
+                entry = len(self.entries)
+                self.entries.append((product_id, key, trigrams(key), tokens))
+                for token in tokens:
+                    self.postings[token].add(entry)
+
+        total = max(len(self.entries), 1)
+        self.idf = {
+            token: math.log(1 + total / len(entries))
+            for token, entries in self.postings.items()
+        }
+
+    def match(self, name, code=None):
+        """
+        Best catalog product for an invoice line
+        Returns (product_id, confidence) or (None, best score)
+        """
+        for text in (code, name):
+            key = match_key(text)
+            if key and key in self.exact:
+                return self.exact[key], 1.0
+
+        key = match_key(name)
+        if not key:
+            return None, 0.0
+        tokens = set(key.split())
+
+        # Rank entries by the IDF weight of the tokens they share with the line;
+        # tokens on most entries (units, sizes) only count once a candidate is picked
+        known = [token for token in tokens if token in self.postings]
+        selective = [
+            token for token in known
+            if len(self.postings[token]) <= COMMON_TOKEN_SHARE * len(self.entries)
+        ] or known
+        overlap = defaultdict(float)
+        for token in selective:
+            weight = self.idf[token]
+            for entry in self.postings[token]:
+                overlap[entry] += weight
+        if not overlap:
+            return None, 0.0
+
+        query_weight = sum(self.idf.get(token, math.log(2)) for token in tokens)
+        query_grams = trigrams(key)
+        best_id, best_score = None, 0.0
+        for entry in heapq.nlargest(MAX_CANDIDATES, overlap, key=overlap.get):
+            product_id, _, grams, entry_tokens = self.entries[entry]
+            shared = sum(self.idf[token] for token in tokens & entry_tokens)
+            entry_weight = sum(self.idf[token] for token in entry_tokens)
+            token_score = 2.0 * shared / (query_weight + entry_weight)
+            # Trigrams carry most of the weight so misspelled tokens still count
+            score = TOKEN_WEIGHT * token_score + (1 - TOKEN_WEIGHT) * dice(query_grams, grams)
+            if score > best_score:
+                best_id, best_score = product_id, score
+
+        return best_id, round(best_score, 3)
+
+class ProductMatcher:
+    """Resolve invoice lines to catalog products without an LLM call"""
+
+    def __init__(self):
+        self.logger = current_app.logger
+        self.threshold = current_app.config.get('PRODUCT_MATCH_THRESHOLD', 0.75)
+
+    def _catalog_names(self):
+        return db.session.query(
+            Product.id, Product.name, Product.invoice_identifier, Product.alternative_names
+        ).filter(Product.is_active.is_(True)).order_by(Product.id).all()
+
+    @staticmethod
+    def _catalog_signature(products):
+        """
+        Hash of the matched columns only; price writes bump updated_at on
+        every purchase and must not throw the index away
+        """
+        digest = hashlib.sha256()
+        for row in products:
+            digest.update(json.dumps(list(row)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def index(self):
+        """The catalog index, rebuilt only when product names were added or changed"""
+        global _index
+        products = self._catalog_names()
+        signature = self._catalog_signature(products)
+        with _index_lock:
+            if _index is None or _index.signature != signature:
+                _index = CatalogIndex(products, signature)
+                self.logger.info(f"Built product match index: {len(products)} products, "
+                                 f"{len(_index.entries)} names")
+            return _index
+
+    def match_lines(self, lines):
+        """
+        Match invoice lines to products
+        Args:
+            lines: list of dicts with 'name' and optional 'code'
+        Returns:
+            list of dicts with product_id, confidence and status per line
+        """
+        index = self.index()
+        results = []
+        for line in lines:
+            product_id, score = index.match(line['name'], line.get('code'))
+            matched = product_id is not None and score >= self.threshold
+            results.append({
+                'product_id': product_id if matched else None,
+                'candidate_id': product_id,
+                'confidence': score,
+                'status': 'matched' if matched else 'unmatched'
+            })
+
+        matched = sum(1 for result in results if result['status'] == 'matched')
+        self.logger.info(f"Matched {matched} of {len(lines)} invoice lines to the catalog")
+        return results
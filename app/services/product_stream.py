@@ -0,0 +1,126 @@
+# app/services/product_stream.py
+import json
+import queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import current_app
+from app.extensions import db
+from app.models import ExtractedProduct
+
+class ProductStreamParser:
+    """
+    Pull complete product objects out of a streamed
+    {"products": [{...}, {...}]} document as soon as each one closes
+    """
+
+    # Container depth of an object inside the top-level "products" array
+    PRODUCT_DEPTH = 2
+
+    def __init__(self):
+        self.text = ''
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start = None
+
+    def feed(self, delta):
+        """Add streamed text; returns the product dicts completed by it"""
+        self.text += delta
+        products = []
+
+        for index in range(self._scanned, len(self.text)):
+            char = self.text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if char == '{' and self._depth == self.PRODUCT_DEPTH:
+                    self._start = index
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if char == '}' and self._depth == self.PRODUCT_DEPTH and self._start is not None:
+                    try:
+                        products.append(json.loads(self.text[self._start:index + 1]))
+                    except json.JSONDecodeError:
+                        pass  # The final parse reports malformed output
+                    self._start = None
+
+        self._scanned = len(self.text)
+        return products
+
+class ExtractedProductPublisher:
+    """
+    Make products visible to the processing page while extraction runs
+
+    Products are pushed from the LLM gateway loop and written to the
+    extracted_product table from the worker thread that owns the session.
+    """
+
+    def __init__(self, invoice_id):
+        self.logger = current_app.logger
+        self.invoice_id = invoice_id
+        self.count = 0
+        self._pending = queue.Queue()
+
+    def reset(self):
+        """Drop rows left over from an earlier attempt"""
+        ExtractedProduct.query.filter_by(invoice_id=self.invoice_id).delete()
+        db.session.commit()
+
+    def push(self, page_number, position, product):
+        """Thread-safe; called for each product as it is recognized"""
+        self._pending.put((page_number, position, product))
+
+    def flush(self):
+        """Write pending products; returns how many were written"""
+        rows = []
+        while True:
+            try:
+                page_number, position, product = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            rows.append({
+                'invoice_id': self.invoice_id,
+                'page_number': page_number,
+                'position': position,
+                'name': product['name'][:200],
+                'quantity': product['quantity'],
+                'price': product['price']
+            })
+        if not rows:
+            return 0
+
+        try:
+            db.session.execute(db.insert(ExtractedProduct), rows)
+            db.session.commit()
+            self.count += len(rows)
+        except Exception as e:
+            # The preview is best effort; extraction carries on without it
+            db.session.rollback()
+            self.logger.warning(f"Could not publish extracted products: {str(e)}")
+            return 0
+        return len(rows)
+
+    def publish_all(self, products):
+        """Publish an already complete product list, e.g. from the cache"""
+        for position, product in enumerate(products, 1):
+            self.push(1, position, product)
+        self.flush()
+
+    def wait(self, future, interval=0.25):
+        """Wait for a gateway future, flushing products as they arrive"""
+        try:
+            while True:
+                try:
+                    return future.result(timeout=interval)
+                except FutureTimeoutError:
+                    self.flush()
+        finally:
+            self.flush()
@@ -0,0 +1,249 @@
+# app/services/progress_reporter.py
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, select, update
+from app.extensions import db
+from app.models import ProcessingProgress
+
+# Seconds per stage until real measurements are available
+DEFAULT_STAGE_SECONDS = {'store': 1.0, 'extract': 30.0, 'categorize': 8.0, 'save': 3.0}
+TIMING_SAMPLE = 50   # Finished invoices used to seed the stage averages
+TIMING_WEIGHT = 0.2  # Weight of each new measurement in the running average
+
+PROGRESS_COLUMNS = (
+    'progress', 'current_step', 'detailed_status', 'step_number', 'total_steps',
+    'stage_details', 'estimated_time_remaining', 'updated_at'
+)
+
+class StageTimings:
+    """Running average duration of each pipeline stage, shared by the process"""
+
+    _lock = threading.Lock()
+    _averages = None
+
+    @classmethod
+    def averages(cls):
+        with cls._lock:
+            if cls._averages is None:
+                cls._averages = cls._load()
+            return dict(cls._averages)
+
+    @classmethod
+    def _load(cls):
+        """Seed from the stage durations stored with recently finished invoices"""
+        averages = dict(DEFAULT_STAGE_SECONDS)
+        samples = defaultdict(list)
+        try:
+            with db.engine.connect() as connection:
+                rows = connection.execute(
+                    select(ProcessingProgress.stage_details).where(
+                        ProcessingProgress.progress == 100,
+                        ProcessingProgress.stage_details.isnot(None)
+                    ).order_by(ProcessingProgress.updated_at.desc()).limit(TIMING_SAMPLE)
+                ).scalars().all()
+        except Exception as e:
+            current_app.logger.error(f"Error loading stage timings: {str(e)}")
+            rows = []
+
+        for details in rows:
+            for stage, seconds in ((details or {}).get('durations') or {}).items():
+                if isinstance(seconds, (int, float)):
+                    samples[stage].append(seconds)
+        for stage, values in samples.items():
+            averages[stage] = sum(values) / len(values)
+        return averages
+
+    @classmethod
+    def observe(cls, stage, seconds):
+        cls.averages()  # Make sure the seed is loaded first
+        with cls._lock:
+            previous = cls._averages.get(stage)
+            cls._averages[stage] = seconds if previous is None else previous + TIMING_WEIGHT * (seconds - previous)
+
+class ProgressReporter:
+    """
+    Progress of one invoice through the pipeline, kept in memory
+
+    Updates only touch this object and may come from any thread; the
+    ProgressFlusher writes dirty reporters on its own connection at most
+    once per PROGRESS_FLUSH_INTERVAL, so progress never shares a
+    transaction with the pipeline's work. Stage durations are measured
+    and turn into step_number, stage_details and estimated_time_remaining.
+    """
+
+    def __init__(self, invoice_id, stages):
+        self.invoice_id = invoice_id
+        self.stages = stages  # [(name, percentage when started, message)]
+        self.stage_names = [name for name, _, _ in stages]
+        self.expected = StageTimings.averages()
+        self.durations = {}
+        self.stage = None
+        self.stage_started = None
+        self.fraction = 0.0
+        self.values = {'total_steps': len(stages)}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.flusher = get_progress_flusher()
+        self.flusher.register(self)
+
+    # ----- Updates -----
+
+    def start_stage(self, stage, message=None):
+        """Finish the current stage and start the next one"""
+        index = self.stage_names.index(stage)
+        with self._lock:
+            self._finish_stage()
+            self.stage = stage
+            self.stage_started = time.monotonic()
+            self.fraction = 0.0
+            self.values.update(
+                current_step=stage,
+                step_number=index + 1,
+                progress=self.stages[index][1],
+                detailed_status=message or self.stages[index][2]
+            )
+            self._refresh()
+
+    def update(self, message=None, fraction=None):
+        """Progress within the current stage, fraction between 0 and 1"""
+        with self._lock:
+            if fraction is not None and self.stage:
+                self.fraction = min(max(fraction, 0.0), 1.0)
+                index = self.stage_names.index(self.stage)
+                start = self.stages[index][1]
+                end = self.stages[index + 1][1] if index + 1 < len(self.stages) else 100
+                self.values['progress'] = int(start + (end - start) * self.fraction)
+            if message:
+                self.values['detailed_status'] = message
+            self._refresh()
+
+    def complete(self, message):
+        """Mark processing as finished and write it out immediately"""
+        with self._lock:
+            self._finish_stage()
+            self.stage = None
+            self.values.update(
+                current_step='complete',
+                step_number=len(self.stages),
+                progress=100,
+                detailed_status=message
+            )
+            self._refresh()
+        self.flush()
+
+    def flush(self):
+        self.flusher.flush([self])
+
+    def close(self):
+        """Write any pending update and stop tracking this invoice"""
+        self.flush()
+        self.flusher.unregister(self)
+
+    # ----- Internals, called with the lock held -----
+
+    def _finish_stage(self):
+        if self.stage is None:
+            return
+        seconds = round(time.monotonic() - self.stage_started, 2)
+        self.durations[self.stage] = seconds
+        StageTimings.observe(self.stage, seconds)
+
+    def _remaining_seconds(self):
+        """Expected time left: the rest of the current stage plus every later stage"""
+        if self.stage is None:
+            return 0
+        index = self.stage_names.index(self.stage)
+        elapsed = time.monotonic() - self.stage_started
+        expected = self.expected.get(self.stage, 0)
+        if self.fraction > 0:
+            # Measured pace within the stage beats the historical average
+            current = elapsed / self.fraction - elapsed
+        else:
+            current = max(expected - elapsed, 1.0)
+        later = sum(self.expected.get(name, 0) for name in self.stage_names[index + 1:])
+        return int(round(current + later))
+
+    def _refresh(self):
+        self.values['estimated_time_remaining'] = self._remaining_seconds()
+        self.values['stage_details'] = {
+            'stage': self.stage,
+            'durations': dict(self.durations),
+            'expected': {name: round(self.expected.get(name, 0), 2) for name in self.stage_names}
+        }
+        self.values['updated_at'] = datetime.utcnow()
+        self.dirty = True
+
+    def snapshot(self):
+        """Column values to write, or None when nothing changed since the last flush"""
+        with self._lock:
+            if not self.dirty:
+                return None
+            self.dirty = False
+            row = {name: self.values.get(name) for name in PROGRESS_COLUMNS}
+            row['b_invoice_id'] = self.invoice_id
+            return row
+
+    def flush_failed(self):
+        """Keep the update pending after a failed write, so the next flush retries it"""
+        with self._lock:
+            self.dirty = True
+
+class ProgressFlusher:
+    """Writes buffered progress for all active invoices with one UPDATE per interval"""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get('PROGRESS_FLUSH_INTERVAL', 1.0)
+        self._reporters = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, reporter):
+        with self._lock:
+            self._reporters.add(reporter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='progress-flusher', daemon=True)
+                self._thread.start()
+
+    def unregister(self, reporter):
+        with self._lock:
+            self._reporters.discard(reporter)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                self.flush()
+
+    def flush(self, reporters=None):
+        if reporters is None:
+            with self._lock:
+                reporters = list(self._reporters)
+        pending = [(reporter, reporter.snapshot()) for reporter in reporters]
+        pending = [(reporter, row) for reporter, row in pending if row]
+        if not pending:
+            return
+        rows = [row for _, row in pending]
+        statement = update(ProcessingProgress.__table__).where(
+            ProcessingProgress.__table__.c.invoice_id == bindparam('b_invoice_id')
+        ).values({name: bindparam(name) for name in PROGRESS_COLUMNS})
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, rows)
+        except Exception as e:
+            self.app.logger.error(f"Error writing invoice progress: {str(e)}")
+            for reporter, _ in pending:
+                reporter.flush_failed()
+
+    def stop(self):
+        self._stop.set()
+
+def init_app(app):
+    app.extensions['progress_flusher'] = ProgressFlusher(app)
+
+def get_progress_flusher():
+    """The progress flusher for the current application"""
+    return current_app.extensions['progress_flusher']
@@ -24,6 +24,19 @@ class Config(object):
     # DeepSeek API Configuration
     DEEPSEEK_API_KEY = os.environ.get('DEEPSEEK_API_KEY')
     
+    # Shared LLM gateway
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+    LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 1.0))  # Seconds, doubled per retry
+    LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 120))
+    LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 20))  # Pooled connections per provider
+    LLM_OPENAI_CONCURRENCY = int(os.environ.get('LLM_OPENAI_CONCURRENCY', 8))
+    LLM_ANTHROPIC_CONCURRENCY = int(os.environ.get('LLM_ANTHROPIC_CONCURRENCY', 4))
+    LLM_BACKEND = os.environ.get('LLM_BACKEND', 'live')  # live, replay (offline) or record
+    LLM_RECORDINGS_DIR = os.environ.get('LLM_RECORDINGS_DIR', os.path.join(basedir, 'llm_recordings'))
+    LLM_REPLAY_LATENCY = float(os.environ.get('LLM_REPLAY_LATENCY', 0))  # Mean seconds per replayed call
+    LLM_REPLAY_ERROR_RATE = float(os.environ.get('LLM_REPLAY_ERROR_RATE', 0))  # Share of calls answered 429/503
+    LLM_REPLAY_PRODUCTS = int(os.environ.get('LLM_REPLAY_PRODUCTS', 40))  # Products per synthesized invoice page
+    
     # Database Configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', (
         "postgresql://postgres.xaemejebdiuehjadbxzt:postgres"
@@ -45,11 +58,16 @@ class Config(object):
     
     # File Upload Configuration
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB max request size, batch uploads included
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+    BLOB_STORE_FOLDER = os.environ.get('BLOB_STORE_FOLDER', os.path.join(UPLOAD_FOLDER, 'blobs'))  # Local copy of every document
     
     # Cloudinary Configuration
     CLOUDINARY_URL = os.environ.get('CLOUDINARY_URL')
+    CLOUDINARY_BACKEND = os.environ.get('CLOUDINARY_BACKEND', 'live')  # live, or local for tests and development
+    CLOUDINARY_LOCAL_FOLDER = os.environ.get('CLOUDINARY_LOCAL_FOLDER', os.path.join(UPLOAD_FOLDER, 'cloudinary_local'))
+    CLOUDINARY_LOCAL_ERROR_RATE = float(os.environ.get('CLOUDINARY_LOCAL_ERROR_RATE', 0))  # Share of local uploads that fail
+    CLOUDINARY_REPLICATION_MAX_ATTEMPTS = int(os.environ.get('CLOUDINARY_REPLICATION_MAX_ATTEMPTS', 8))
     CLOUDINARY_CLOUD_NAME = None
     CLOUDINARY_API_KEY = None
     CLOUDINARY_API_SECRET = None
@@ -88,6 +106,57 @@ class Config(object):
     INVOICE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'invoices')
     ALLOWED_INVOICE_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png'}
     
+    # Background invoice processing
+    INVOICE_WORKERS = int(os.environ.get('INVOICE_WORKERS', 2))  # Worker threads per process, 0 disables
+    INVOICE_WORKERS_EMBEDDED = os.environ.get('INVOICE_WORKERS_EMBEDDED', 'false').lower() == 'true'  # Also run workers in web processes
+    INVOICE_JOB_POLL_INTERVAL = float(os.environ.get('INVOICE_JOB_POLL_INTERVAL', 2))  # Seconds
+    INVOICE_JOB_MAX_ATTEMPTS = int(os.environ.get('INVOICE_JOB_MAX_ATTEMPTS', 3))
+    INVOICE_JOB_RETRY_DELAY = int(os.environ.get('INVOICE_JOB_RETRY_DELAY', 15))  # Seconds, doubled per attempt
+    INVOICE_JOB_LEASE_SECONDS = int(os.environ.get('INVOICE_JOB_LEASE_SECONDS', 300))  # Reclaim jobs of dead workers
+    INVOICE_BATCH_CONCURRENCY = int(os.environ.get('INVOICE_BATCH_CONCURRENCY', 2))  # Jobs of one batch running at once, 0 for no limit
+    INVOICE_BATCH_MAX_FILES = int(os.environ.get('INVOICE_BATCH_MAX_FILES', 50))
+    INVOICE_STREAM_POLL_INTERVAL = float(os.environ.get('INVOICE_STREAM_POLL_INTERVAL', 0.5))  # Seconds between SSE checks
+    INVOICE_STREAM_MAX_SECONDS = int(os.environ.get('INVOICE_STREAM_MAX_SECONDS', 300))  # Browser reconnects after this
+    PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 1))  # Seconds between progress writes
+    
+    # Duplicate upload detection
+    INVOICE_DUPLICATE_MAX_DISTANCE = int(os.environ.get('INVOICE_DUPLICATE_MAX_DISTANCE', 28))  # Image hash bits that may differ (max 31)
+    
+    # Invoice extraction cache
+    EXTRACTION_CACHE_ENABLED = os.environ.get('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true'
+    EXTRACTION_CACHE_TTL_DAYS = int(os.environ.get('EXTRACTION_CACHE_TTL_DAYS', 30))
+    EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', 5000))
+    
+    # Catalog matching of invoice lines
+    PRODUCT_MATCH_THRESHOLD = float(os.environ.get('PRODUCT_MATCH_THRESHOLD', 0.75))  # Minimum confidence to link a product
+    
+    # Product categorization
+    CATEGORIZATION_CHUNK_SIZE = int(os.environ.get('CATEGORIZATION_CHUNK_SIZE', 40))  # Product names per request
+    CATEGORIZATION_WORKERS = int(os.environ.get('CATEGORIZATION_WORKERS', 4))  # Concurrent requests per invoice
+    CATEGORIZATION_CHUNK_ATTEMPTS = int(os.environ.get('CATEGORIZATION_CHUNK_ATTEMPTS', 3))
+    
+    # Confirmed margin statistics per category
+    CATEGORY_STATS_WINDOW = int(os.environ.get('CATEGORY_STATS_WINDOW', 100))  # Recent margins kept
+    CATEGORY_STATS_EWMA_ALPHA = float(os.environ.get('CATEGORY_STATS_EWMA_ALPHA', 0.1))  # Weight of each new margin
+    
+    # What-if margin simulation
+    MARGIN_SIMULATION_MAX_SCENARIOS = int(os.environ.get('MARGIN_SIMULATION_MAX_SCENARIOS', 1000))  # Per request
+    MARGIN_SIMULATION_CACHE_SECONDS = int(os.environ.get('MARGIN_SIMULATION_CACHE_SECONDS', 60))  # Invoice cost matrix lifetime
+    
+    # Price-tag label sheets
+    LABEL_DEFAULT_TEMPLATE = os.environ.get('LABEL_DEFAULT_TEMPLATE', 'shelf')  # shelf (30-up) or large (8-up)
+    
+    # Market insights cache
+    MARKET_INSIGHTS_TTL_HOURS = int(os.environ.get('MARKET_INSIGHTS_TTL_HOURS', 168))  # Refreshed in the background after this
+    
+    # Invoice page rendering
+    INVOICE_PAGE_DPI = int(os.environ.get('INVOICE_PAGE_DPI', 150))
+    INVOICE_PAGE_MAX_SIDE = int(os.environ.get('INVOICE_PAGE_MAX_SIDE', 2000))  # Pixels
+    INVOICE_PAGE_JPEG_QUALITY = int(os.environ.get('INVOICE_PAGE_JPEG_QUALITY', 70))
+    INVOICE_PAGE_WORKERS = int(os.environ.get('INVOICE_PAGE_WORKERS', 4))  # Concurrent page extractions
+    INVOICE_IMAGE_PREPROCESS = os.environ.get('INVOICE_IMAGE_PREPROCESS', 'true').lower() == 'true'
+    INVOICE_IMAGE_PIXEL_BUDGET = int(os.environ.get('INVOICE_IMAGE_PIXEL_BUDGET', 2000000))  # Max pixels per photo
+    
     # Ensure required directories exist
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(INVOICE_UPLOAD_FOLDER, exist_ok=True)
@@ -0,0 +1,75 @@
+# tests/conftest.py
+from datetime import date
+import pytest
+from app import create_app
+from app.extensions import db as _db
+from app.models import Category, Invoice, TempProduct, User, Wholesaler
+from config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    INVOICE_WORKERS = 0
+    LLM_BACKEND = 'replay'
+    CLOUDINARY_BACKEND = 'local'
+
+@pytest.fixture
+def app(tmp_path):
+    class Settings(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        INVOICE_UPLOAD_FOLDER = str(tmp_path / 'uploads' / 'invoices')
+        BLOB_STORE_FOLDER = str(tmp_path / 'blobs')
+        CLOUDINARY_LOCAL_FOLDER = str(tmp_path / 'cloudinary_local')
+
+    app = create_app(Settings)
+    with app.app_context():
+        _db.create_all()
+        yield app
+        _db.session.remove()
+        _db.drop_all()
+
+@pytest.fixture
+def db(app):
+    return _db
+
+@pytest.fixture
+def user(db):
+    user = User(username='owner', email='owner@example.com', role='owner')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    return client
+
+@pytest.fixture
+def make_invoice(db):
+    """Create an invoice with lines given as dicts of TempProduct columns"""
+    wholesaler = Wholesaler(name='Wholesaler')
+    db.session.add(wholesaler)
+    db.session.commit()
+
+    def make(lines=(), **columns):
+        invoice = Invoice(wholesaler_id=wholesaler.id, invoice_date=date(2026, 1, 15),
+                          **dict({'status': 'processed'}, **columns))
+        db.session.add(invoice)
+        db.session.flush()
+        for line in lines:
+            db.session.add(TempProduct(**dict({'invoice_id': invoice.id, 'quantity': 1}, **line)))
+        db.session.commit()
+        return invoice
+
+    return make
+
+@pytest.fixture
+def categories(db):
+    rows = [Category(name='Hair Care', default_margin=35), Category(name='Skin Care', default_margin=40)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
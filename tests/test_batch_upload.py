@@ -0,0 +1,56 @@
+# tests/test_batch_upload.py
+import io
+import zipfile
+from datetime import date
+import pytest
+from werkzeug.datastructures import FileStorage
+from app.models import Invoice, InvoiceBatch, ProcessingProgress
+from app.services.batch_upload import BatchUploadService
+
+def archive(members, compression=zipfile.ZIP_STORED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as zip_file:
+        for name, data in members.items():
+            zip_file.writestr(name, data)
+    return buffer.getvalue()
+
+def upload(filename, data):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+def test_archives_are_expanded(app):
+    data = archive({'a.pdf': b'%PDF-1 a', 'scans/b.png': b'png b', 'notes.txt': b'hi', '__MACOSX/._a.pdf': b''})
+    files, skipped = BatchUploadService().collect_files([upload('invoices.zip', data), upload('c.jpg', b'jpg c')])
+    assert [name for name, _ in files] == ['a.pdf', 'b.png', 'c.jpg']
+    assert skipped == ['notes.txt']
+
+def test_corrupt_member_is_a_value_error(app):
+    data = bytearray(archive({'a.pdf': b'%PDF-1.4 invoice 1001'}))
+    data[data.index(b'invoice')] ^= 0xFF  # Contents no longer match the stored CRC
+    with pytest.raises(ValueError, match='a.pdf in invoices.zip could not be read'):
+        BatchUploadService().collect_files([upload('invoices.zip', bytes(data))])
+
+def test_invalid_archive_is_a_value_error(app):
+    with pytest.raises(ValueError, match='not a valid ZIP archive'):
+        BatchUploadService().collect_files([upload('invoices.zip', b'not a zip')])
+
+def test_priced_invoices_count_as_done(db, make_invoice):
+    batch = InvoiceBatch(wholesaler_id=make_invoice().wholesaler_id, invoice_date=date(2026, 1, 15), file_count=3)
+    db.session.add(batch)
+    db.session.flush()
+    statuses = ['processing', 'processed', 'failed']
+    invoices = [make_invoice(status=status, batch_id=batch.id) for status in statuses]
+    db.session.add(ProcessingProgress(invoice_id=invoices[0].id, progress=40))
+    db.session.commit()
+    service = BatchUploadService()
+
+    status = service.batch_status(batch.id)
+    assert (status['counts'], status['progress'], status['complete']) == (
+        {'processing': 1, 'processed': 1, 'failed': 1}, 80, False
+    )
+
+    invoices[0].status = 'processed'
+    invoices[1].status = 'prices_set'
+    db.session.commit()
+    status = service.batch_status(batch.id)
+    assert status['counts'] == {'processing': 0, 'processed': 2, 'failed': 1}
+    assert status['complete'] is True
@@ -0,0 +1,59 @@
+# tests/test_blob_replication.py
+import os
+import pytest
+from app.models import ProcessingJob
+from app.services.blob_replication import BlobReplicator
+from app.services.blob_store import BlobStore
+from app.services.job_queue import WorkerPool, _load_handlers
+
+@pytest.fixture
+def stored_invoice(app, make_invoice):
+    return make_invoice(blob_key=BlobStore().put_bytes(b'%PDF-1.4 invoice 1001'))
+
+def run_jobs(app, db):
+    _load_handlers()
+    pool = WorkerPool(app, size=0)
+    while pool.run_once('test'):
+        pass
+    db.session.expire_all()
+
+def test_blob_store_deduplicates(app):
+    store = BlobStore()
+    key = store.put_bytes(b'same bytes')
+    assert store.put_bytes(b'same bytes') == key
+    assert store.read(key) == b'same bytes'
+    with pytest.raises(ValueError):
+        store.path('../etc/passwd')
+
+def test_failed_write_leaves_no_temp_file(app, monkeypatch):
+    store = BlobStore()
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        store.put_bytes(b'never stored')
+    assert os.listdir(store.tmp_dir) == []
+
+def test_invoice_is_replicated_once(app, db, stored_invoice):
+    replicator = BlobReplicator()
+    job = replicator.schedule_invoice(stored_invoice)
+    assert replicator.schedule_invoice(stored_invoice) is job
+    db.session.commit()
+
+    run_jobs(app, db)
+    assert stored_invoice.cloudinary_public_id == f'invoices/invoice_{stored_invoice.id}'
+    assert stored_invoice.cloudinary_secure_url.startswith('https://res.cloudinary.local/')
+    local_copy = os.path.join(app.config['CLOUDINARY_LOCAL_FOLDER'], 'invoices', f'invoice_{stored_invoice.id}')
+    assert open(local_copy, 'rb').read() == b'%PDF-1.4 invoice 1001'
+    assert replicator.schedule_invoice(stored_invoice) is None
+
+def test_failed_upload_is_retried(app, db, stored_invoice):
+    app.config['CLOUDINARY_LOCAL_ERROR_RATE'] = 1.0
+    BlobReplicator().schedule_invoice(stored_invoice)
+    db.session.commit()
+
+    run_jobs(app, db)
+    job = ProcessingJob.query.filter_by(job_type='replicate_blob').one()
+    assert (job.status, job.attempts) == ('queued', 1)
+    assert 'Injected failure' in job.error_message
+    assert stored_invoice.cloudinary_secure_url is None
@@ -0,0 +1,86 @@
+# tests/test_category_stats.py
+from datetime import datetime
+import pytest
+from app.models import CategoryMarginStats
+from app.services.category_stats import CategoryStatsService, per_category
+
+def lines(category_name, margins):
+    return [{'name': f'{category_name} {n}', 'category_name': category_name, 'margin': margin,
+             'cost_price': 10.0, 'selling_price': 15.0} for n, margin in enumerate(margins)]
+
+def test_per_category_takes_the_median():
+    assert sorted(per_category([('Hair', 30), ('Hair', 50), ('Hair', 35), ('Skin', 40), (None, 90), ('Skin', None)])) == [
+        ('Hair', 35.0), ('Skin', 40.0)
+    ]
+
+def test_long_invoice_counts_once(db, app, make_invoice):
+    invoice = make_invoice(lines('Hair Care', [40] * 300))
+    CategoryStatsService().record_invoice(invoice)
+    db.session.commit()
+
+    stats = CategoryMarginStats.query.filter_by(category_name='Hair Care').one()
+    assert stats.count == 1
+    assert stats.recent_margins == [40.0]
+    assert stats.ewma_margin == 40.0
+
+def test_ewma_moves_once_per_confirmation(db, app, make_invoice):
+    app.config['CATEGORY_STATS_EWMA_ALPHA'] = 0.5
+    service = CategoryStatsService()
+    service.record_invoice(make_invoice(lines('Hair Care', [30])))
+    service.record_invoice(make_invoice(lines('Hair Care', [50] * 300)))
+    db.session.commit()
+
+    stats = CategoryMarginStats.query.filter_by(category_name='Hair Care').one()
+    assert stats.count == 2
+    assert stats.mean_margin == 40.0
+    assert stats.ewma_margin == 40.0
+
+def test_confirmed_invoice_is_not_counted_again(db, make_invoice):
+    invoice = make_invoice(lines('Hair Care', [30]), status='prices_set')
+    assert CategoryStatsService().record_invoice(invoice) == 0
+
+def test_rebuild_matches_incremental_updates(db, make_invoice):
+    service = CategoryStatsService()
+    for day, margins in enumerate([[30, 32, 34], [40] * 200, [50, 55]], start=1):
+        invoice = make_invoice(lines('Hair Care', margins) + lines('Skin Care', [45]))
+        service.record_invoice(invoice)
+        invoice.status = 'prices_set'
+        invoice.processed_date = datetime(2026, 1, day)
+    db.session.commit()
+    incremental = {row.category_name: row.to_dict() for row in CategoryMarginStats.query}
+
+    assert service.rebuild() == 6
+    rebuilt = {row.category_name: row.to_dict() for row in CategoryMarginStats.query}
+    for name in ('Hair Care', 'Skin Care'):
+        for key in ('count', 'mean_margin', 'ewma_margin', 'recent_margins'):
+            assert rebuilt[name][key] == pytest.approx(incremental[name][key])
+    assert rebuilt['Hair Care']['recent_margins'] == [32.0, 40.0, 52.5]
+
+def test_lookup_prefers_confirmed_margins(db, categories, make_invoice):
+    service = CategoryStatsService()
+    service.record_invoice(make_invoice(lines('Hair Care', [50])))
+    db.session.commit()
+
+    stats = service.lookup(['Hair Care', 'Skin Care', None])
+    assert stats['Hair Care']['avg_margin'] == 50.0
+    assert stats['Skin Care']['avg_margin'] == 40
+    assert stats['Skin Care']['confirmed'] is None
+
+def test_category_inserted_concurrently_is_updated(db, app, monkeypatch):
+    service = CategoryStatsService()
+    service.record([('Hair Care', 30)])
+    db.session.commit()
+
+    # Another confirmation inserted the row after this one looked for it
+    locked_rows, lookups = service._locked_rows, []
+    def first_lookup_misses(names):
+        lookups.append(list(names))
+        return locked_rows(names) if len(lookups) > 1 else {}
+    monkeypatch.setattr(service, '_locked_rows', first_lookup_misses)
+    assert service.record([('Hair Care', 50), ('Skin Care', 40)]) == 2
+    db.session.commit()
+
+    stats = {row.category_name: row for row in CategoryMarginStats.query}
+    assert (stats['Hair Care'].count, stats['Hair Care'].mean_margin) == (2, 40.0)
+    assert stats['Skin Care'].count == 1
+    assert lookups[1:] == [['Hair Care']]
@@ -0,0 +1,51 @@
+# tests/test_claude_service.py
+import json
+from types import SimpleNamespace
+import pytest
+from app.models import TempProduct
+from app.services import claude_service
+from app.services.claude_service import ClaudeService
+
+class StubGateway:
+    """Answers every request with a fixed Anthropic-style message"""
+
+    def __init__(self, text):
+        self.text = text
+
+    def create(self, provider, **kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(type='text', text=self.text)])
+
+@pytest.fixture
+def reply(monkeypatch):
+    def set_reply(data):
+        text = data if isinstance(data, str) else json.dumps(data)
+        monkeypatch.setattr(claude_service, 'get_llm_gateway', lambda: StubGateway(text))
+    return set_reply
+
+def test_extraction_is_validated(app, reply):
+    reply('```json\n{"products": [{"name": "Shampoo", "quantity": "2", "price": "$5.50"}, '
+          '{"name": "Bad", "price": "n/a"}]}\n```')
+    assert ClaudeService().extract_invoice_data('invoice text') == {
+        'products': [{'name': 'Shampoo', 'quantity': 2, 'price': 5.5}]
+    }
+
+def test_suggested_margins_price_the_invoice(client, make_invoice, reply):
+    invoice = make_invoice([
+        {'name': 'Shampoo', 'cost_price': 10.0, 'category_name': 'Hair Care'},
+        {'name': 'Serum', 'cost_price': 20.0, 'category_name': 'Skin Care', 'quantity': 2},
+    ])
+    reply({'margins': {
+        'Hair Care': {'suggested_margin': '50%', 'reasoning': 'High demand'},
+        'Skin Care': {'suggested_margin': 25, 'reasoning': ['Competitive']},
+    }})
+
+    response = client.post(f'/pricing/api/invoice/{invoice.id}/suggest-margins',
+                           json={'location': 'Austin, TX', 'areaType': 'urban'})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['margins']['Hair Care']['suggested_margin'] == 50.0
+    assert data['summary'] == {'total_products': 2, 'total_cost': 50.0, 'expected_revenue': 64.97}
+    prices = {product.name: product.selling_price
+              for product in TempProduct.query.filter_by(invoice_id=invoice.id)}
+    assert prices == {'Shampoo': 14.99, 'Serum': 24.99}
@@ -0,0 +1,60 @@
+# tests/test_cost_changes.py
+from app.models import InvoiceItem, Product
+from app.services.cost_changes import CostChangeDetector
+
+def test_trends_and_alerts(db, make_invoice):
+    invoice = make_invoice()
+    products = [
+        Product(product_id='UP', name='Up', cost_price=10, selling_price=15, last_purchase_price=10.0),
+        Product(product_id='FLAT', name='Flat', cost_price=10, selling_price=15, last_purchase_price=10.0),
+        Product(product_id='DOWN', name='Down', cost_price=10, selling_price=15, last_purchase_price=10.0,
+                price_alert_threshold=5.0),
+        Product(product_id='NEW', name='New', cost_price=10, selling_price=15, price_trend='stable'),
+    ]
+    db.session.add_all(products)
+    db.session.flush()
+    up, flat, down, new = products
+    db.session.add_all([
+        # Two lines of the same product are averaged by quantity: (11 * 1 + 13 * 3) / 4 = 12.5
+        InvoiceItem(invoice_id=invoice.id, product_id=up.id, status='matched', unit_price=11.0, quantity=1,
+                    raw_product_name='Up small'),
+        InvoiceItem(invoice_id=invoice.id, product_id=up.id, status='matched', unit_price=13.0, quantity=3,
+                    raw_product_name='Up case'),
+        InvoiceItem(invoice_id=invoice.id, product_id=flat.id, status='matched', unit_price=10.0, quantity=2),
+        InvoiceItem(invoice_id=invoice.id, product_id=down.id, status='matched', unit_price=9.0, quantity=1),
+        InvoiceItem(invoice_id=invoice.id, product_id=new.id, status='matched', unit_price=8.0, quantity=1),
+        InvoiceItem(invoice_id=invoice.id, product_id=None, status='unmatched', unit_price=99.0, quantity=1),
+    ])
+    db.session.commit()
+
+    alerts = CostChangeDetector().apply(invoice.id)
+    db.session.commit()
+    db.session.expire_all()
+
+    assert [(alert['product_name'], alert['change_pct'], alert['line_name']) for alert in alerts] == [
+        ('Up', 25.0, 'Up small'), ('Up', 25.0, 'Up case'), ('Down', -10.0, None)
+    ]
+    assert [(product.price_trend, product.last_purchase_price) for product in products] == [
+        ('increasing', 12.5), ('stable', 10.0), ('decreasing', 9.0), ('stable', 8.0)
+    ]
+    notes = [item.matching_notes for item in InvoiceItem.query.filter_by(product_id=up.id)]
+    assert notes == ['Cost up 25.0% from 10.00 (alert threshold 10%)'] * 2
+
+def test_invoice_without_matches(db, make_invoice):
+    assert CostChangeDetector().apply(make_invoice().id) == []
+
+def test_rolled_back_with_the_caller(db, make_invoice):
+    # A save stage that fails after apply must not leave prices half-updated
+    invoice = make_invoice()
+    product = Product(product_id='P', name='P', cost_price=10, selling_price=15, last_purchase_price=10.0)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add(InvoiceItem(invoice_id=invoice.id, product_id=product.id, status='matched',
+                               unit_price=20.0, quantity=1))
+    db.session.commit()
+
+    assert len(CostChangeDetector().apply(invoice.id)) == 1
+    db.session.rollback()
+
+    assert db.session.get(Product, product.id).last_purchase_price == 10.0
+    assert CostChangeDetector().apply(invoice.id)[0]['previous_cost'] == 10.0
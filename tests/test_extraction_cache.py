@@ -0,0 +1,56 @@
+# tests/test_extraction_cache.py
+from datetime import datetime, timedelta
+import pytest
+from app.models import ExtractionCache
+from app.services.extraction_cache import ExtractionCacheService, extraction_version
+
+PDF = b'%PDF-1.4 invoice 1001'
+
+@pytest.fixture
+def cache(app):
+    return ExtractionCacheService(extraction_version('gpt-4o', 'Extract the products'))
+
+def expire(db):
+    for entry in ExtractionCache.query:
+        entry.expires_at = datetime.utcnow() - timedelta(minutes=1)
+    db.session.commit()
+
+def test_round_trip(db, cache):
+    assert cache.get(PDF) is None
+    cache.put(PDF, [{'name': 'Shampoo', 'quantity': 2}])
+
+    assert cache.get(PDF) == [{'name': 'Shampoo', 'quantity': 2}]
+    assert ExtractionCache.query.one().hit_count == 1
+
+def test_version_change_misses(db, cache):
+    cache.put(PDF, [{'name': 'Shampoo'}])
+    assert ExtractionCacheService(extraction_version('gpt-4o', 'Another prompt')).get(PDF) is None
+
+def test_storing_twice_keeps_one_entry(db, cache):
+    cache.put(PDF, [{'name': 'Shampoo'}])
+    cache.put(PDF, [{'name': 'Conditioner'}])
+
+    assert ExtractionCache.query.count() == 1
+    assert cache.get(PDF) == [{'name': 'Shampoo'}]
+
+def test_expired_entry_is_replaced(db, cache):
+    cache.put(PDF, [{'name': 'Shampoo'}])
+    expire(db)
+    assert cache.get(PDF) is None
+
+    cache.put(PDF, [{'name': 'Conditioner'}])
+    entry = ExtractionCache.query.one()
+    assert entry.expires_at > datetime.utcnow()
+    assert cache.get(PDF) == [{'name': 'Conditioner'}]
+
+def test_least_recently_used_entries_are_evicted(app, db):
+    app.config['EXTRACTION_CACHE_MAX_ENTRIES'] = 2
+    cache = ExtractionCacheService('v1')
+    for n in range(3):
+        cache.put(f'file {n}'.encode(), [{'name': f'Product {n}'}])
+        entry = ExtractionCache.query.filter_by(content_hash=cache.content_hash(f'file {n}'.encode())).one()
+        entry.last_used_at = datetime(2026, 1, 1 + n)
+        db.session.commit()
+
+    assert ExtractionCache.query.count() == 2
+    assert cache.get(b'file 0') is None
@@ -0,0 +1,124 @@
+# tests/test_job_queue.py
+import time
+from datetime import datetime, timedelta
+import pytest
+from app.models import Invoice, ProcessingJob
+from app.services import job_queue
+from app.services.blob_store import BlobStore
+from app.services.job_queue import JOB_HANDLERS, JobQueue, LeaseHeartbeat, WorkerPool
+
+@pytest.fixture
+def queue(app):
+    app.config.update(INVOICE_JOB_LEASE_SECONDS=60, INVOICE_JOB_RETRY_DELAY=15, INVOICE_BATCH_CONCURRENCY=0)
+    return JobQueue()
+
+@pytest.fixture
+def handler(monkeypatch):
+    calls = []
+    monkeypatch.setitem(JOB_HANDLERS, 'test_job', lambda job, queue: calls.append(job.id))
+    return calls
+
+def enqueue(db, queue, **options):
+    job = queue.enqueue(None, {'n': 1}, job_type='test_job', **options)
+    db.session.commit()
+    return job.id
+
+def expire_lease(db, job_id, seconds=120):
+    job = db.session.get(ProcessingJob, job_id)
+    job.locked_at = datetime.utcnow() - timedelta(seconds=seconds)
+    db.session.commit()
+
+def test_claim_locks_the_job_once(db, queue):
+    job_id = enqueue(db, queue)
+
+    job = queue.claim('w1')
+    assert (job.id, job.status, job.locked_by, job.attempts) == (job_id, 'running', 'w1', 1)
+    assert queue.claim('w2') is None
+
+def test_expired_lease_is_reclaimed(db, queue):
+    job_id = enqueue(db, queue)
+    queue.claim('w1')
+    expire_lease(db, job_id)
+
+    job = queue.claim('w2')
+    assert (job.id, job.locked_by, job.attempts) == (job_id, 'w2', 2)
+
+def test_fail_retries_with_backoff_then_gives_up(db, queue):
+    job_id = enqueue(db, queue, max_attempts=2)
+
+    job = queue.claim('w1')
+    assert queue.fail(job, 'boom') is True
+    job = db.session.get(ProcessingJob, job_id)
+    assert job.status == 'queued'
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=10)
+
+    job.run_after = datetime.utcnow()
+    db.session.commit()
+    job = queue.claim('w1')
+    assert queue.fail(job, 'boom again') is False
+    job = db.session.get(ProcessingJob, job_id)
+    assert (job.status, job.error_message) == ('failed', 'boom again')
+
+def test_expired_job_on_last_attempt_is_failed(db, queue, make_invoice):
+    invoice = make_invoice(status='processing')
+    job = queue.enqueue(invoice.id, {}, max_attempts=1)
+    db.session.commit()
+    queue.claim('w1')
+    expire_lease(db, job.id)
+
+    assert queue.claim('w2') is None
+    job = db.session.get(ProcessingJob, job.id)
+    assert job.status == 'failed'
+    assert 'stopped responding' in job.error_message
+    assert db.session.get(Invoice, invoice.id).status == 'failed'
+
+def test_heartbeat_renews_the_lease(app, db, queue):
+    job_id = enqueue(db, queue)
+    queue.claim('w1')
+    expire_lease(db, job_id, seconds=30)
+
+    with LeaseHeartbeat(app, job_id, 'w1', 0.05):
+        time.sleep(0.3)
+    db.session.expire_all()
+    assert db.session.get(ProcessingJob, job_id).locked_at > datetime.utcnow() - timedelta(seconds=5)
+
+def test_only_the_lease_holder_renews(db, queue):
+    job_id = enqueue(db, queue)
+    queue.claim('w1')
+    assert queue.renew_lease(job_id, 'w1') is True
+    assert queue.renew_lease(job_id, 'w2') is False
+
+def test_run_once_runs_and_completes(app, db, queue, handler):
+    job_id = enqueue(db, queue)
+
+    pool = WorkerPool(app, size=0)
+    assert pool.run_once('w1') is True
+    assert pool.run_once('w1') is False
+    assert handler == [job_id]
+    assert db.session.get(ProcessingJob, job_id).status == 'completed'
+
+def test_workers_do_not_start_by_default(app):
+    assert 'invoice_worker_pool' not in app.extensions
+
+def test_embedded_workers_skip_cli_commands(app, monkeypatch):
+    started = []
+    monkeypatch.setattr(WorkerPool, 'start', lambda self: started.append(self))
+    app.testing = False
+    app.config.update(INVOICE_WORKERS_EMBEDDED=True, INVOICE_WORKERS=1)
+
+    @app.cli.command('noop')
+    def noop():
+        job_queue.init_app(app)
+
+    assert app.test_cli_runner().invoke(args=['noop']).exit_code == 0
+    assert started == []
+    job_queue.init_app(app)
+    assert len(started) == 1
+
+def test_retry_without_an_earlier_job(client, db, make_invoice):
+    invoice = make_invoice(status='failed', blob_key=BlobStore().put_bytes(b'%PDF-1.4 invoice'))
+
+    response = client.post(f'/invoice/{invoice.id}/retry')
+    assert response.status_code == 200
+    job = JobQueue().latest_job(invoice.id)
+    assert (job.stage, job.payload['blob_key']) == (None, invoice.blob_key)
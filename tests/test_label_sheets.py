@@ -0,0 +1,76 @@
+# tests/test_label_sheets.py
+import fitz
+import pytest
+from app.extensions import db
+from app.models import LabelSheet, ProcessingJob, TempProduct
+from app.services.blob_store import BlobStore
+from app.services.job_queue import WorkerPool, _load_handlers
+from app.services.label_sheets import LabelSheetService
+
+@pytest.fixture
+def priced_invoice(make_invoice):
+    return make_invoice([
+        {'name': f'Product {n}', 'category_name': ['Hair Care', 'Skin Care', None][n % 3],
+         'cost_price': 10.0, 'selling_price': 14.99 + n}
+        for n in range(75)
+    ], status='prices_set')
+
+def run_jobs(app):
+    _load_handlers()
+    pool = WorkerPool(app, size=0)
+    while pool.run_once('test'):
+        pass
+    # Workers commit through their own session
+    db.session.expire_all()
+
+def test_sheets_render_once_per_category(app, priced_invoice):
+    sheets = LabelSheetService().request_sheets(priced_invoice.id)
+    db.session.commit()
+    assert [(sheet.category_name, sheet.label_count) for sheet in sheets] == [('', 25), ('Hair Care', 25), ('Skin Care', 25)]
+    assert ProcessingJob.query.filter_by(job_type='render_labels').count() == 1
+
+    run_jobs(app)
+    sheet = LabelSheet.query.filter_by(category_name='Hair Care').one()
+    assert (sheet.status, sheet.page_count) == ('ready', 1)
+    with fitz.open(BlobStore().path(sheet.blob_key)) as document:
+        assert '$14.99' in document[0].get_text()
+
+def test_unchanged_prices_reuse_sheets(app, priced_invoice):
+    service = LabelSheetService()
+    service.request_sheets(priced_invoice.id)
+    db.session.commit()
+    run_jobs(app)
+
+    service.request_sheets(priced_invoice.id)
+    db.session.commit()
+    assert ProcessingJob.query.filter_by(job_type='render_labels').count() == 1
+
+    line = TempProduct.query.filter_by(invoice_id=priced_invoice.id, category_name='Skin Care').first()
+    line.selling_price = 1.99
+    db.session.commit()
+    sheets = service.request_sheets(priced_invoice.id)
+    db.session.commit()
+    assert [sheet.status for sheet in sheets] == ['ready', 'ready', 'queued']
+
+def test_category_emptied_after_queueing(app, priced_invoice):
+    LabelSheetService().request_sheets(priced_invoice.id)
+    db.session.commit()
+    for line in TempProduct.query.filter_by(invoice_id=priced_invoice.id, category_name='Hair Care'):
+        line.selling_price = None
+    db.session.commit()
+
+    run_jobs(app)
+    assert sorted((sheet.category_name, sheet.status) for sheet in LabelSheet.query) == [('', 'ready'), ('Skin Care', 'ready')]
+
+def test_combined_pdf(client, priced_invoice):
+    response = client.post(f'/invoice/{priced_invoice.id}/labels', json={'template': 'large'})
+    assert response.status_code == 202
+    run_jobs(client.application)
+
+    response = client.get(f'/invoice/{priced_invoice.id}/labels.pdf?template=large')
+    assert response.status_code == 200
+    with fitz.open(stream=response.data, filetype='pdf') as document:
+        assert document.page_count == 12  # 25 labels per category, 8 per page
+
+def test_unknown_template(client, priced_invoice):
+    assert client.post(f'/invoice/{priced_invoice.id}/labels', json={'template': 'poster'}).status_code == 400
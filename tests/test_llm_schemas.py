@@ -0,0 +1,29 @@
+# tests/test_llm_schemas.py
+import pytest
+from app.services.llm_schemas import EXTRACTION, MARGINS, LLMOutputError, LLMSchema, ExtractionResponse, schema_stats
+
+def test_percent_margins_are_repaired():
+    result = MARGINS.parse('{"margins": {"Hair Care": {"suggested_margin": "35%", "confidence": "0.8"}}}')
+    assert result['margins']['Hair Care']['suggested_margin'] == 35.0
+    assert result['margins']['Hair Care']['confidence'] == 0.8
+
+def test_thousands_separators_are_stripped():
+    result = EXTRACTION.parse('{"products": [{"name": "Dryer", "quantity": "1,200", "price": "$1,299.00"}]}')
+    assert result['products'] == [{'name': 'Dryer', 'quantity': 1200, 'price': 1299.0}]
+
+def test_invalid_items_are_dropped():
+    result = EXTRACTION.parse('{"products": [{"name": "Gel", "price": "n/a"}, {"name": "Wax", "price": 4}]}')
+    assert [product['name'] for product in result['products']] == ['Wax']
+
+def test_unusable_response_raises():
+    with pytest.raises(LLMOutputError):
+        MARGINS.parse('Sorry, I cannot help with that')
+
+def test_repairs_are_counted():
+    schema = LLMSchema('test_extraction', ExtractionResponse)
+    schema.parse('{"products": [{"name": "Gel", "quantity": 2, "price": 3.5}]}')
+    schema.parse('```json\n{"products": [{"name": "Gel", "quantity": 2, "price": 3.5}]}\n```')
+    schema.parse('{"products": [{"name": "Gel", "quantity": "2", "price": "$3.50"}]}')
+
+    stats = schema_stats()['test_extraction']
+    assert (stats['documents'], stats['repaired'], stats['repaired_fields']) == (3, 2, 2)
@@ -0,0 +1,42 @@
+# tests/test_margin_simulator.py
+import pytest
+from app.models import TempProduct
+from app.services.margin_simulator import MarginSimulator, invalidate_cost_matrix
+from app.services.price_service import EnhancedPriceService
+
+@pytest.fixture
+def invoice(make_invoice):
+    invoice = make_invoice([
+        {'name': f'Product {n}', 'category_name': ['Hair', 'Skin', None][n % 3],
+         'cost_price': 5.0 + n, 'quantity': 1 + n % 4}
+        for n in range(30)
+    ])
+    yield invoice
+    invalidate_cost_matrix(invoice.id)
+
+def test_scenarios_match_calculated_prices(db, invoice):
+    scenarios = MarginSimulator.expand_grid({'Hair': [30, 45], 'Skin': [35, 50]})
+    results = MarginSimulator(invoice.id).simulate(scenarios)
+    assert len(results) == 4
+
+    for scenario, result in zip(scenarios, results):
+        summary = EnhancedPriceService().calculate_prices(invoice.id, scenario)['summary']
+        assert result['revenue'] == pytest.approx(summary['total_selling'])
+        assert result['profit'] == pytest.approx(summary['total_selling'] - summary['total_cost'])
+
+def test_left_out_categories_keep_their_prices(db, invoice):
+    EnhancedPriceService().calculate_prices(invoice.id, {'Hair': 40, 'Skin': 40})
+    simulator = MarginSimulator(invoice.id)
+    unchanged, skin_only = simulator.simulate([{}, {'Skin': 60}])
+
+    assert unchanged['revenue'] == simulator.summary()['total_revenue']
+    assert unchanged['price_changes'] == 0
+    assert skin_only['price_changes'] == TempProduct.query.filter_by(category_name='Skin').count()
+
+def test_limits(app, db, invoice):
+    app.config['MARGIN_SIMULATION_MAX_SCENARIOS'] = 2
+    simulator = MarginSimulator(invoice.id)
+    with pytest.raises(ValueError):
+        simulator.simulate([{}, {}, {}])
+    with pytest.raises(ValueError):
+        simulator.simulate([{'Hair': -5}])
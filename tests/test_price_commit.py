@@ -0,0 +1,72 @@
+# tests/test_price_commit.py
+import pytest
+from sqlalchemy.dialects import postgresql
+from app.models import InvoiceItem, PriceHistory, Product, TempProduct
+from app.services.price_commit import PriceCommitService, bulk_update, values_update
+
+@pytest.fixture
+def matched_invoice(db, make_invoice, categories):
+    invoice = make_invoice([
+        {'name': 'Shampoo', 'category_name': 'Hair Care', 'cost_price': 10.0, 'margin': 35, 'selling_price': 13.99},
+        {'name': 'Serum', 'category_name': 'Skin Care', 'cost_price': 20.0, 'margin': 40, 'selling_price': 27.99},
+        {'name': 'New lotion', 'category_name': 'Skin Care', 'cost_price': 5.0, 'margin': 40, 'selling_price': 6.99},
+    ])
+    shampoo = Product(product_id='P1', name='Shampoo', cost_price=9.0, selling_price=12.99, category_id=categories[0].id)
+    serum = Product(product_id='P2', name='Serum', cost_price=18.0, selling_price=24.99, category_id=categories[1].id)
+    db.session.add_all([shampoo, serum])
+    db.session.flush()
+    lines = TempProduct.query.filter_by(invoice_id=invoice.id).order_by(TempProduct.id).all()
+    for line, product in zip(lines, [shampoo, serum, None]):
+        db.session.add(InvoiceItem(
+            invoice_id=invoice.id, temp_product_id=line.id, product_id=product.id if product else None,
+            status='matched' if product else 'unmatched', unit_price=line.cost_price, quantity=1
+        ))
+    db.session.commit()
+    return invoice
+
+def test_values_update_compiles_for_postgresql():
+    rows = [{'id': 1, 'margin': 35.0, 'selling_price': 13.99}, {'id': 2, 'margin': None, 'selling_price': 27.99}]
+    sql = str(values_update(TempProduct.__table__, rows).compile(dialect=postgresql.dialect()))
+    assert sql.startswith('UPDATE temp_product SET')
+    assert 'FROM (VALUES' in sql
+    assert 'margin=CAST(new_values.margin AS FLOAT)' in sql
+    assert 'WHERE temp_product.id = new_values.id' in sql
+
+def test_bulk_update_rejects_unknown_columns(app):
+    with pytest.raises(ValueError, match='status'):
+        bulk_update(TempProduct, [{'id': 1, 'status': 'pending_update'}])
+
+def test_commit_updates_lines_and_catalog(db, matched_invoice, user):
+    invoice_id = matched_invoice.id
+    lines = TempProduct.query.filter_by(invoice_id=invoice_id).order_by(TempProduct.id).all()
+    result = PriceCommitService().commit(matched_invoice, [
+        {'product_id': lines[0].id, 'margin': 50, 'selling_price': 14.99},
+        {'product_id': lines[1].id},
+        {'product_id': lines[2].id},
+        {'product_id': 999999, 'selling_price': 1},
+    ], user=user)
+    db.session.commit()
+
+    assert (result['updated'], result['staged'], result['skipped']) == (2, 1, 1)
+    assert db.session.get(TempProduct, lines[0].id).selling_price == 14.99
+    shampoo = Product.query.filter_by(product_id='P1').one()
+    assert (shampoo.cost_price, shampoo.selling_price, shampoo.margin) == (10.0, 14.99, 49.9)
+    assert PriceHistory.query.count() == 2
+    assert matched_invoice.status == 'prices_set'
+    assert matched_invoice.processed_by_id == user.id
+
+def test_commit_from_category_margins(db, matched_invoice):
+    result = PriceCommitService().commit(matched_invoice, margin_source='category')
+    db.session.commit()
+
+    outcomes = [row['outcome'] for row in result['results']]
+    assert outcomes == ['updated', 'updated', 'skipped']
+    assert Product.query.filter_by(product_id='P2').one().selling_price == 28.0
+
+def test_save_prices_route(client, matched_invoice):
+    lines = TempProduct.query.filter_by(invoice_id=matched_invoice.id).all()
+    response = client.post(f'/invoice/{matched_invoice.id}/save-prices', json={
+        'prices': [{'product_id': line.id, 'margin': 30, 'selling_price': 9.99} for line in lines]
+    })
+    assert response.status_code == 200
+    assert response.json['updated'] == 2
@@ -0,0 +1,79 @@
+# tests/test_price_service.py
+from decimal import ROUND_HALF_UP, Decimal
+import numpy as np
+import pytest
+from app.models import Category, Product, TempProduct
+from app.services.price_service import EnhancedPriceService, as_percent, round_prices
+
+def reference_round(price, method):
+    """Scalar retail rounding on decimals, as priced before vectorization"""
+    cents = Decimal(repr(price)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    if method == 'std':
+        return float(cents)
+    dollars = Decimal(repr(price)).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    if dollars < 1:
+        return float(cents)
+    return float(dollars - Decimal('0.01' if method == '99' else '0.05'))
+
+@pytest.mark.parametrize('method, expected', [
+    ('99', [0.49, 0.13, 0.99, 11.99, 12.99]),
+    ('95', [0.49, 0.13, 0.95, 11.95, 12.95]),
+    ('std', [0.49, 0.13, 0.5, 12.49, 12.5]),
+])
+def test_round_prices(method, expected):
+    # Prices under a dollar after rounding keep their cents
+    assert round_prices([0.49, 0.125, 0.5, 12.49, 12.5], method).tolist() == expected
+
+@pytest.mark.parametrize('method', ['99', '95', 'std'])
+def test_round_prices_matches_decimal_rounding(method):
+    prices = np.round(np.random.default_rng(7).uniform(0, 200, 5000), 3)
+    expected = [reference_round(float(price), method) for price in prices]
+    assert round_prices(prices, method).tolist() == expected
+
+def test_as_percent():
+    assert [as_percent(margin) for margin in (0.35, 1, 35, 0, None)] == [35.0, 100, 35, 0, None]
+
+def test_price_by_category(app):
+    categories, codes, margin, selling = EnhancedPriceService().price_by_category(
+        ['Hair', 'Skin', None, 'Hair'], [10.0, 20.0, 5.0, np.nan], {'Hair': 35, 'Skin': 40}
+    )
+    assert categories.tolist() == ['', 'Hair', 'Skin']
+    assert codes.tolist() == [1, 2, 0, 1]
+    assert np.isnan(margin[2]) and margin[[0, 1, 3]].tolist() == [35, 40, 35]
+    assert selling[:2].tolist() == [13.99, 27.99]
+    assert np.isnan(selling[2:]).all()
+
+def test_calculate_prices(db, make_invoice):
+    invoice = make_invoice([
+        {'name': 'Shampoo', 'category_name': 'Hair', 'cost_price': 10.0, 'quantity': 2},
+        {'name': 'Serum', 'category_name': 'Skin', 'cost_price': 20.0, 'quantity': 1},
+        {'name': 'Mystery', 'category_name': None, 'cost_price': 5.0, 'quantity': 1, 'selling_price': 7.5},
+    ])
+    result = EnhancedPriceService().calculate_prices(invoice.id, {'Hair': 35, 'Skin': 40})
+
+    prices = {line.name: (line.margin, line.selling_price) for line in TempProduct.query}
+    assert prices == {'Shampoo': (35, 13.99), 'Serum': (40, 27.99), 'Mystery': (None, 7.5)}
+    assert result['updated'] == 2
+    assert result['summary']['total_selling'] == round(2 * 13.99 + 27.99 + 7.5, 2)
+    assert result['summary']['by_category']['Uncategorized']['count'] == 1
+
+def test_reprice_catalog(db):
+    hair = Category(name='Hair', default_margin=0.35)
+    db.session.add(hair)
+    db.session.flush()
+    db.session.add_all([
+        Product(product_id='P1', name='Shampoo', cost_price=10.0, selling_price=9.99, category_id=hair.id),
+        Product(product_id='P2', name='Gel', cost_price=10.0, selling_price=13.99, category_id=hair.id),
+        Product(product_id='P3', name='Loose', cost_price=10.0, selling_price=5.0),
+    ])
+    db.session.commit()
+    service = EnhancedPriceService()
+
+    # Gel already sells at its 35% price
+    assert service.reprice_catalog(dry_run=True) == {'priced': 2, 'changed': 1}
+    assert Product.query.filter_by(product_id='P1').one().selling_price == 9.99
+
+    assert service.reprice_catalog(rounding_method='std') == {'priced': 2, 'changed': 2}
+    shampoo = Product.query.filter_by(product_id='P1').one()
+    assert (shampoo.selling_price, shampoo.margin) == (13.5, 35.0)
+    assert Product.query.filter_by(product_id='P3').one().selling_price == 5.0
@@ -0,0 +1,66 @@
+# tests/test_product_matcher.py
+import pytest
+from app.models import Product
+from app.services import product_matcher
+from app.services.product_matcher import CatalogIndex, ProductMatcher, match_key
+
+CATALOG = [
+    (1, 'Argan Oil Shampoo 8 oz', 'AOS-8', 'Moroccan argan shampoo'),
+    (2, 'Argan Oil Conditioner 8 oz', 'AOC-8', None),
+    (3, 'Vitamin C Brightening Serum 1 oz', 'VCS-1', None),
+    (4, 'Tea Tree Body Wash 16 oz', None, None),
+]
+
+@pytest.fixture
+def index():
+    return CatalogIndex(CATALOG)
+
+def test_match_key_splits_sizes_from_units():
+    assert match_key('Argan Shampoo 8OZ.') == match_key('argan shampoo 8 oz')
+
+def test_exact_identifier_or_name(index):
+    assert index.match('Something else', code='AOC-8') == (2, 1.0)
+    assert index.match('moroccan argan shampoo') == (1, 1.0)
+
+def test_misspelled_name_matches(index):
+    product_id, score = index.match('Argan Oil Shampo 8oz')
+    assert product_id == 1
+    assert 0.75 <= score < 1.0
+
+def test_shared_units_do_not_match(index):
+    product_id, score = index.match('Lavender Candle 8 oz')
+    assert score < 0.75
+
+def test_unknown_words_do_not_match(index):
+    assert index.match('Gift card') == (None, 0.0)
+
+def test_matcher_applies_threshold_and_tracks_catalog(db, monkeypatch):
+    monkeypatch.setattr(product_matcher, '_index', None)
+    db.session.add(Product(product_id='P1', name='Argan Oil Shampoo 8 oz', cost_price=5, selling_price=9))
+    db.session.commit()
+
+    matcher = ProductMatcher()
+    results = matcher.match_lines([{'name': 'Argan Oil Shampo 8oz'}, {'name': 'Tea Tree Body Wash 16oz'}])
+    assert [result['status'] for result in results] == ['matched', 'unmatched']
+
+    db.session.add(Product(product_id='P2', name='Tea Tree Body Wash 16 oz', cost_price=4, selling_price=7))
+    db.session.commit()
+    results = matcher.match_lines([{'name': 'Tea Tree Body Wash 16oz'}])
+    assert results[0]['status'] == 'matched'
+
+def test_price_updates_keep_the_index(db, monkeypatch):
+    monkeypatch.setattr(product_matcher, '_index', None)
+    product = Product(product_id='P1', name='Argan Oil Shampoo 8 oz', cost_price=5, selling_price=9)
+    db.session.add(product)
+    db.session.commit()
+
+    matcher = ProductMatcher()
+    index = matcher.index()
+    product.selling_price = 10
+    product.last_purchase_price = 5.5
+    db.session.commit()
+    assert matcher.index() is index
+
+    product.alternative_names = 'Moroccan argan shampoo'
+    db.session.commit()
+    assert matcher.index() is not index
@@ -0,0 +1,44 @@
+# tests/test_progress_stream.py
+from datetime import datetime, timedelta
+from sqlalchemy.engine import Connection
+from app.models import ExtractedProduct, ProcessingProgress
+from app.services.invoice_processor import PIPELINE_STAGES
+from app.services.progress_reporter import ProgressReporter
+
+def read_events(response):
+    body = response.get_data(as_text=True)
+    return [line.split(': ', 1)[1] for line in body.splitlines() if line.startswith('event: ')]
+
+def test_countdown_alone_sends_no_events(app, client, db, make_invoice):
+    app.config.update(INVOICE_STREAM_POLL_INTERVAL=0.1, INVOICE_STREAM_MAX_SECONDS=2.5)
+    invoice = make_invoice(status='processing')
+    progress = ProcessingProgress(invoice_id=invoice.id)
+    progress.progress = 40
+    progress.estimated_time_remaining = 120
+    db.session.add(progress)
+    db.session.add(ExtractedProduct(invoice_id=invoice.id, position=1, name='Shampoo', quantity=1, price=4.5))
+    db.session.commit()
+    # The estimate was written a while ago, so the status counts down while streaming
+    progress.updated_at = datetime.utcnow() - timedelta(seconds=5)
+    db.session.commit()
+
+    events = read_events(client.get(f'/invoice/{invoice.id}/stream'))
+    assert events == ['product', 'progress']
+
+def test_failed_flush_is_retried(app, db, make_invoice, monkeypatch):
+    invoice = make_invoice(status='processing')
+    db.session.add(ProcessingProgress(invoice_id=invoice.id))
+    db.session.commit()
+    reporter = ProgressReporter(invoice.id, PIPELINE_STAGES)
+    try:
+        reporter.start_stage('extract')
+        with monkeypatch.context() as patch:
+            patch.setattr(Connection, 'execute', lambda *args, **kwargs: 1 / 0)
+            reporter.flush()
+        assert reporter.dirty
+
+        reporter.flush()
+        db.session.expire_all()
+        assert ProcessingProgress.query.filter_by(invoice_id=invoice.id).one().current_step == 'extract'
+    finally:
+        reporter.close()